@@ -6,11 +6,17 @@ Qwen3医学问答微调项目使用示例
 """
 
 import os
+import sys
 import json
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM
 from peft import PeftModel
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from tokenizer_utils import load_tokenizer
+from chat_template import chat_encoder
+from think_spans import split_think_answer
+
 def load_model_and_tokenizer(model_type="lora"):
     """
     加载模型和分词器
@@ -36,7 +42,7 @@ def load_model_and_tokenizer(model_type="lora"):
             trust_remote_code=True
         )
         model = PeftModel.from_pretrained(base_model, adapter_dir).eval()
-        tokenizer = AutoTokenizer.from_pretrained(base_dir, use_fast=False, trust_remote_code=True)
+        tokenizer = load_tokenizer(base_dir)
         
     else:
         # 全参数微调模型
@@ -51,7 +57,7 @@ def load_model_and_tokenizer(model_type="lora"):
             device_map="auto", 
             trust_remote_code=True
         ).eval()
-        tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=False, trust_remote_code=True)
+        tokenizer = load_tokenizer(model_dir)
     
     return model, tokenizer
 
@@ -77,15 +83,8 @@ def generate_response(model, tokenizer, question, system_prompt=None):
         {"role": "user", "content": question}
     ]
     
-    # 应用聊天模板
-    text = tokenizer.apply_chat_template(
-        messages, 
-        tokenize=False, 
-        add_generation_prompt=True
-    )
-    
-    # 编码输入
-    inputs = tokenizer([text], return_tensors="pt").to("cuda")
+    # 应用聊天模板并编码输入（与 apply_chat_template + 分词结果一致，固定片段的 token id 有缓存）
+    inputs = chat_encoder(tokenizer).inputs(messages).to("cuda")
     
     # 生成回答
     with torch.no_grad():
@@ -117,19 +116,8 @@ def parse_think_answer(response):
     Returns:
         tuple: (思考过程, 答案)
     """
-    import re
-    
-    # 提取<think>标签内容
-    think_match = re.search(r"<think>(.*?)</think>", response, re.DOTALL)
-    if think_match:
-        think_content = think_match.group(1).strip()
-        # 移除<think>标签后的内容作为答案
-        answer_content = re.sub(r"<think>.*?</think>\s*", "", response, flags=re.DOTALL).strip()
-    else:
-        think_content = ""
-        answer_content = response
-    
-    return think_content, answer_content
+    # 与 scripts/think_spans.py 的批量解析共用同一区间规则
+    return split_think_answer(response)
 
 def batch_inference(model, tokenizer, questions, system_prompt=None):
     """
@@ -0,0 +1,377 @@
+# scripts/activation_ckpt.py
+"""
+选择性激活检查点（SFT 用）：按显存预算决定哪些层的 attention / MLP 需要重算，代替全部解码层都重算。
+
+原先 train_full / train_lora 都打开 gradient_checkpointing，每个解码层在反向时整层重算一次（约多 30% 计算）。
+这里先对第 0 层实测（真实模型、计划长度、真实 batch）：
+- 每个子模块（self_attn / mlp）保留激活时为反向保存的字节数（按 storage 去重，不含参数）
+- 其输入（检查点边界，重算时仍需保留）的字节数
+- 前向耗时（即重算代价）
+序列长度取预分词数据的 input_ids 长度分布的 ACT_CKPT_QUANTILE 分位（默认 1.0 即最长样本，保证不 OOM）。
+每个子模块有三种处理：保留（0 代价）/ 重算（代价 = 前向耗时，只留边界输入）/ 激活卸载到 CPU
+（ACT_CKPT_OFFLOAD=1 时可选，代价 = 2 × 字节数 / ACT_OFFLOAD_GBPS，GPU 上几乎不占）。
+由于各层同构，只需枚举两类子模块各自"保留 / 卸载"的层数，在预算内取总额外耗时最小的组合；
+保留的放在靠后的层（反向最先用到、最早释放），卸载其次，重算放在前面的层。
+
+环境变量：
+    ACT_CKPT=all|selective|none     默认 all（HF 整层检查点，与原行为一致）；none 为完全不做检查点
+    ACT_MEM_BUDGET_GB               解码层激活的显存预算；不设时按 空闲显存 - 梯度与 AdamW 状态 - logits - ACT_RESERVE_GB 估算
+    ACT_CKPT_QUANTILE               规划用的长度分位（默认 1.0）
+    ACT_CKPT_OFFLOAD=1              允许把保留的激活卸载到 CPU（pinned memory）
+    ACT_OFFLOAD_GBPS                主机-显卡带宽估计（默认 12 GB/s）
+计划写入 <output_dir>/act_ckpt_plan.json；训练中 throughput.jsonl 的 step_sec 可直接与 ACT_CKPT=all 时对比。
+
+步时与峰值显存对比（none / all / selective；无 CUDA 时用 tiny 模型，预算默认取 none 模式激活量的一半）：
+    python scripts/activation_ckpt.py models/Qwen/Qwen3-1.7B [seq_len] [budget_gb]
+"""
+import json
+import os
+import statistics
+import sys
+import time
+from typing import List, Optional
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+ACT_CKPT = os.environ.get("ACT_CKPT", "all")
+ACT_MEM_BUDGET_GB = float(os.environ["ACT_MEM_BUDGET_GB"]) if os.environ.get("ACT_MEM_BUDGET_GB") else None
+ACT_CKPT_QUANTILE = float(os.environ.get("ACT_CKPT_QUANTILE", "1.0"))
+ACT_CKPT_OFFLOAD = os.environ.get("ACT_CKPT_OFFLOAD", "0") == "1"
+ACT_OFFLOAD_GBPS = float(os.environ.get("ACT_OFFLOAD_GBPS", "12"))
+ACT_RESERVE_GB = float(os.environ.get("ACT_RESERVE_GB", "2"))
+UNITS = ("self_attn", "mlp")
+GB = 2 ** 30
+
+
+def hf_gradient_checkpointing() -> bool:
+    """TrainingArguments.gradient_checkpointing：只有 ACT_CKPT=all 时交给 HF"""
+    return ACT_CKPT == "all"
+
+
+def decoder_layers(model) -> List[torch.nn.Module]:
+    """所有同时含 self_attn 与 mlp 的子模块（兼容 PEFT 包装）"""
+    return [m for m in model.modules() if all(isinstance(getattr(m, u, None), torch.nn.Module) for u in UNITS)]
+
+
+def length_quantile(lengths: List[int], q: float = ACT_CKPT_QUANTILE) -> int:
+    ordered = sorted(lengths)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))]
+
+
+# ================= 实测 =================
+class _Captured(Exception):
+    pass
+
+
+def _capture_unit_inputs(model, layer, batch: int, seq_len: int, device):
+    """跑到第 0 层 mlp 入口即中止，拿到两个子模块的真实调用参数（位置编码、掩码等）"""
+    captured = {}
+
+    def hook(name):
+        def fn(module, args, kwargs):
+            captured[name] = (args, kwargs)
+            if len(captured) == len(UNITS):
+                raise _Captured
+        return fn
+
+    handles = [getattr(layer, u).register_forward_pre_hook(hook(u), with_kwargs=True) for u in UNITS]
+    vocab = model.get_input_embeddings().num_embeddings
+    ids = torch.randint(0, vocab, (batch, seq_len), device=device)
+    try:
+        with torch.no_grad():
+            model(input_ids=ids, attention_mask=torch.ones_like(ids), use_cache=False)
+    except _Captured:
+        pass
+    finally:
+        for h in handles:
+            h.remove()
+    return captured
+
+
+def _as_input(x, hidden_size: int):
+    if torch.is_tensor(x) and x.is_floating_point() and x.dim() == 3 and x.shape[-1] == hidden_size:
+        return x.detach().clone().requires_grad_(True)
+    return x
+
+
+def _tensors(obj):
+    if torch.is_tensor(obj):
+        yield obj
+    elif isinstance(obj, (list, tuple)):
+        for x in obj:
+            yield from _tensors(x)
+    elif isinstance(obj, dict):
+        for x in obj.values():
+            yield from _tensors(x)
+
+
+def _sync(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+
+def measure_unit(module, args, kwargs, hidden_size: int, repeat: int = 3) -> dict:
+    """保留激活时保存的字节数、边界输入字节数与前向耗时（ms）"""
+    args = tuple(_as_input(a, hidden_size) for a in args)
+    kwargs = {k: _as_input(v, hidden_size) for k, v in kwargs.items()}
+    params = {p.untyped_storage().data_ptr() for p in module.parameters()}
+    seen, saved = set(), [0]
+
+    def pack(t):
+        ptr = t.untyped_storage().data_ptr()
+        if ptr not in params and ptr not in seen:
+            seen.add(ptr)
+            saved[0] += t.untyped_storage().nbytes()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        module(*args, **kwargs)
+    inputs = {t.untyped_storage().data_ptr(): t.untyped_storage().nbytes()
+              for t in _tensors((args, kwargs)) if t.requires_grad}
+    device = next(module.parameters()).device
+    times = []
+    with torch.no_grad():
+        for _ in range(repeat + 1):
+            _sync(device)
+            start = time.perf_counter()
+            module(*args, **kwargs)
+            _sync(device)
+            times.append((time.perf_counter() - start) * 1000)
+    return {"saved_bytes": saved[0], "boundary_bytes": sum(inputs.values()), "fwd_ms": statistics.median(times[1:])}
+
+
+def profile(model, batch: int, seq_len: int) -> dict:
+    layers = decoder_layers(model)
+    if not layers:
+        raise ValueError("No decoder layers with self_attn/mlp found")
+    layer = layers[0]
+    device = next(layer.parameters()).device
+    hidden_size = model.get_input_embeddings().embedding_dim
+    was_training = model.training
+    model.train()
+    captured = _capture_unit_inputs(model, layer, batch, seq_len, device)
+    units = {u: measure_unit(getattr(layer, u), *captured[u], hidden_size) for u in UNITS}
+    model.train(was_training)
+    return {"num_layers": len(layers), "batch": batch, "seq_len": seq_len,
+            "layer_input_bytes": batch * seq_len * hidden_size * next(layer.parameters()).element_size(),
+            "units": units}
+
+
+# ================= 规划 =================
+def auto_budget_bytes(model, batch: int, seq_len: int) -> int:
+    """空闲显存扣掉梯度 + AdamW 两个状态（与参数同 dtype）、fp32 logits 及其梯度、ACT_RESERVE_GB"""
+    free, _ = torch.cuda.mem_get_info()
+    trainable = sum(p.numel() * p.element_size() for p in model.parameters() if p.requires_grad)
+    vocab = model.get_input_embeddings().num_embeddings
+    logits = batch * seq_len * vocab * 4 * 2
+    return int(free - trainable * 3 - logits - ACT_RESERVE_GB * GB)
+
+
+def plan(prof: dict, budget_bytes: int, allow_offload: bool = ACT_CKPT_OFFLOAD,
+         offload_gbps: float = ACT_OFFLOAD_GBPS) -> dict:
+    """枚举两类子模块各自保留 / 卸载的层数，在预算内取额外耗时最小的组合（同耗时取显存更小者）"""
+    n = prof["num_layers"]
+    cost = {}
+    for u in UNITS:
+        m = prof["units"][u]
+        cost[u] = {
+            "keep": (m["saved_bytes"], 0.0),
+            "offload": (0, 2 * m["saved_bytes"] / (offload_gbps * GB) * 1000),
+            "recompute": (m["boundary_bytes"], m["fwd_ms"]),
+        }
+    best = None
+    offload_range = range(n + 1) if allow_offload else range(1)
+    for ka in range(n + 1):
+        for oa in (r for r in offload_range if ka + r <= n):
+            for km in range(n + 1):
+                for om in (r for r in offload_range if km + r <= n):
+                    counts = {"self_attn": (ka, oa), "mlp": (km, om)}
+                    mem = ms = 0.0
+                    for u, (k, o) in counts.items():
+                        c = cost[u]
+                        mem += k * c["keep"][0] + o * c["offload"][0] + (n - k - o) * c["recompute"][0]
+                        ms += o * c["offload"][1] + (n - k - o) * c["recompute"][1]
+                    if mem <= budget_bytes and (best is None or (ms, mem) < (best[0], best[1])):
+                        best = (ms, mem, counts)
+    fits = best is not None
+    if not fits:
+        print(f"⚠️  Activation budget {budget_bytes / GB:.2f} GB is below the all-recompute floor; recomputing everything")
+        best = (sum(n * cost[u]["recompute"][1] for u in UNITS),
+                sum(n * cost[u]["recompute"][0] for u in UNITS), {u: (0, 0) for u in UNITS})
+    ms, mem, counts = best
+    per_layer = []
+    for i in range(n):
+        entry = {}
+        for u, (k, o) in counts.items():
+            entry[u] = "keep" if i >= n - k else "offload" if i >= n - k - o else "recompute"
+        per_layer.append(entry)
+    full_ms = n * sum(cost[u]["recompute"][1] for u in UNITS)
+    return {
+        "budget_gb": round(budget_bytes / GB, 3),
+        "fits_budget": fits,
+        "counts": {u: {"keep": k, "offload": o, "recompute": n - k - o} for u, (k, o) in counts.items()},
+        "est_activation_gb": round(mem / GB, 3),
+        "est_extra_ms_per_step": round(ms, 2),
+        "all_layers_baseline": {
+            "est_activation_gb": round(n * prof["layer_input_bytes"] / GB, 3),
+            "est_extra_ms_per_step": round(full_ms, 2),
+        },
+        "no_checkpoint": {"est_activation_gb": round(n * sum(cost[u]["keep"][0] for u in UNITS) / GB, 3)},
+        "layers": per_layer,
+    }
+
+
+# ================= 应用 =================
+def _wrap(module, mode: str):
+    forward = module.forward
+
+    def wrapped(*args, **kwargs):
+        if not (module.training and torch.is_grad_enabled()):
+            return forward(*args, **kwargs)
+        if mode == "recompute":
+            return checkpoint(forward, *args, use_reentrant=False, **kwargs)
+        with torch.autograd.graph.save_on_cpu(pin_memory=torch.cuda.is_available()):
+            return forward(*args, **kwargs)
+
+    module.forward = wrapped
+
+
+def apply_plan(model, the_plan: dict) -> int:
+    """按计划给子模块的实例 forward 套上重算 / 卸载；返回包装的子模块数"""
+    wrapped = 0
+    for layer, modes in zip(decoder_layers(model), the_plan["layers"]):
+        for u, mode in modes.items():
+            if mode != "keep":
+                _wrap(getattr(layer, u), mode)
+                wrapped += 1
+    return wrapped
+
+
+def remove_plan(model):
+    for layer in decoder_layers(model):
+        for u in UNITS:
+            getattr(layer, u).__dict__.pop("forward", None)
+
+
+def configure_checkpointing(model, train_dataset, batch_size: int, output_dir: Optional[str] = None,
+                            mode: str = ACT_CKPT, budget_gb: Optional[float] = ACT_MEM_BUDGET_GB):
+    """
+    训练脚本入口（在数据集分词之后、构造 Trainer 之前调用）：
+    all -> HF 整层检查点；none -> 不做；selective -> 实测第 0 层、规划并包装子模块，返回计划
+    """
+    if mode == "all":
+        model.gradient_checkpointing_enable()
+        return None
+    if mode == "none":
+        return None
+    if mode != "selective":
+        raise ValueError(f"Unknown ACT_CKPT mode: {mode}")
+    if next(model.parameters()).device.type == "cpu" and torch.cuda.is_available():
+        # torchrun 多进程时模型未指定 device_map，先放到本 rank 的卡上再实测（Trainer 之后也会放到同一张卡）
+        model.to(torch.device("cuda", int(os.environ.get("LOCAL_RANK", "0"))))
+    lengths = [len(x) for x in train_dataset["input_ids"]]
+    seq_len = length_quantile(lengths)
+    prof = profile(model, batch_size, seq_len)
+    if budget_gb is not None:
+        budget = int(budget_gb * GB)
+    elif torch.cuda.is_available():
+        budget = auto_budget_bytes(model, batch_size, seq_len)
+    else:
+        raise ValueError("ACT_CKPT=selective on CPU needs ACT_MEM_BUDGET_GB")
+    result = plan(prof, budget)
+    result["lengths"] = {"p50": length_quantile(lengths, 0.5), "p90": length_quantile(lengths, 0.9),
+                         "p99": length_quantile(lengths, 0.99), "max": max(lengths), "planned": seq_len}
+    result["profile"] = prof
+    apply_plan(model, result)
+    c = result["counts"]
+    print(f"🧮 Selective checkpointing @ {seq_len} tokens: attn keep/offload/recompute="
+          f"{c['self_attn']['keep']}/{c['self_attn']['offload']}/{c['self_attn']['recompute']}, "
+          f"mlp={c['mlp']['keep']}/{c['mlp']['offload']}/{c['mlp']['recompute']}; "
+          f"est {result['est_activation_gb']} GB, +{result['est_extra_ms_per_step']} ms/step "
+          f"(all layers: {result['all_layers_baseline']['est_activation_gb']} GB, "
+          f"+{result['all_layers_baseline']['est_extra_ms_per_step']} ms)")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, "act_ckpt_plan.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+
+# ================= 基准 =================
+def _bench_steps(model, batch: int, seq_len: int, steps: int, device) -> dict:
+    vocab = model.get_input_embeddings().num_embeddings
+    ids = torch.randint(0, vocab, (batch, seq_len), device=device)
+    times = []
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+    for _ in range(steps + 1):
+        model.zero_grad(set_to_none=True)
+        _sync(device)
+        start = time.perf_counter()
+        model(input_ids=ids, labels=ids, use_cache=False).loss.backward()
+        _sync(device)
+        times.append(time.perf_counter() - start)
+    entry = {"step_sec": round(statistics.median(times[1:]), 4)}
+    if device.type == "cuda":
+        entry["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+    return entry
+
+
+def benchmark(model_path: str, seq_len: int = 1024, budget_gb: Optional[float] = None, batch: int = 1,
+              steps: int = 5) -> dict:
+    from tokenizer_utils import load_tokenizer
+
+    tokenizer = load_tokenizer(model_path)
+    if torch.cuda.is_available():
+        from transformers import AutoModelForCausalLM
+
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.bfloat16, trust_remote_code=True).cuda()
+    else:
+        from model_utils import tiny_causal_lm
+
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token_id = tokenizer.eos_token_id
+        model = tiny_causal_lm(tokenizer, seed=0, hidden_size=128, num_layers=8)
+    model.config.use_cache = False
+    device = next(model.parameters()).device
+    model.train()
+
+    prof = profile(model, batch, seq_len)
+    if budget_gb is None:
+        none_bytes = prof["num_layers"] * sum(m["saved_bytes"] for m in prof["units"].values())
+        budget_gb = none_bytes / 2 / GB
+    the_plan = plan(prof, int(budget_gb * GB))
+    report = {"model": model_path, "device": str(device), "seq_len": seq_len, "batch": batch, "plan": the_plan}
+
+    report["none"] = _bench_steps(model, batch, seq_len, steps, device)
+    model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+    report["all"] = _bench_steps(model, batch, seq_len, steps, device)
+    model.gradient_checkpointing_disable()
+    apply_plan(model, the_plan)
+    report["selective"] = _bench_steps(model, batch, seq_len, steps, device)
+    remove_plan(model)
+
+    base = report["all"]["step_sec"]
+    for name in ("none", "selective"):
+        report[name]["vs_all_layers"] = round(report[name]["step_sec"] / base, 3)
+    print(json.dumps({k: v for k, v in report.items() if k != "plan"}, indent=2))
+    print(f"🧮 Plan: {json.dumps(the_plan['counts'])}, est {the_plan['est_activation_gb']} GB "
+          f"(budget {the_plan['budget_gb']} GB)")
+    print(f"✅ selective step time = {report['selective']['vs_all_layers']:.3f} × all-layers checkpointing")
+    os.makedirs("eval_report", exist_ok=True)
+    with open(os.path.join("eval_report", "act_ckpt_bench.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    benchmark(
+        sys.argv[1] if len(sys.argv) > 1 else "models/Qwen/Qwen3-1.7B",
+        seq_len=int(sys.argv[2]) if len(sys.argv) > 2 else 1024,
+        budget_gb=float(sys.argv[3]) if len(sys.argv) > 3 else None,
+    )
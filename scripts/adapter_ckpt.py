@@ -0,0 +1,328 @@
+# scripts/adapter_ckpt.py
+"""
+LoRA SFT 的后台 checkpoint：只保存可训练的 adapter 张量与优化器状态，写盘不阻塞训练。
+
+Trainer 默认每 save_steps 写一个完整 checkpoint（含优化器），训练在此期间停住；而 LoRA 训练中真正变化的只有 adapter。
+AdapterCheckpointCallback 接管 Trainer 的保存时机（control.should_save，仍按 save_steps）：
+- 主线程：把可训练参数、优化器状态 non_blocking 拷进复用的 pinned CPU 缓冲区（两组轮换，
+  只在某组上一次还没写完时等待），随后把 Trainer/调度器状态序列化成 JSON
+- 后台线程（checkpoint_utils.AsyncCheckpointWriter）：在 .step_N.tmp 目录写
+  adapter_model.safetensors + adapter_config.json（可直接 PeftModel.from_pretrained 加载）、
+  optimizer.safetensors + training_state.json（param_groups、调度器、global_step）、trainer_state.json，
+  完成后原子重命名为 step_N，更新 latest 指针，按 ADAPTER_CKPT_KEEP 清理旧 checkpoint
+- 停顿统计：每次保存在主线程花费的时间（快照 / 等缓冲区 / 入队）、保存后一步与普通步的步时中位数
+  （步时从 on_step_begin 计到 on_step_end，不含评估与保存本身），训练结束时打印并写入 <output_dir>/adapter_ckpt_stats.json
+- 恢复：load_adapter_checkpoint 读回 adapter、优化器、调度器并返回 training_state（含 global_step）。
+  目录里同时有 adapter_config.json / adapter_model.safetensors / trainer_state.json，可直接交给
+  trainer.train(resume_from_checkpoint=...)（恢复 global_step、epoch 与数据跳过）；Trainer 找不到 optimizer.pt
+  会跳过优化器，由回调在 on_train_begin 用 load_adapter_checkpoint 补上
+多进程时各 rank 的 adapter 与优化器状态一致，只由全局主进程（world rank 0）写盘；TrainingArguments.save_on_each_node
+对这些 checkpoint 不生效，多节点恢复需要各节点都能访问 output_dir（共享存储）。
+
+环境变量：ASYNC_ADAPTER_CKPT=1 启用（train_lora.py），ADAPTER_CKPT_KEEP（默认 3），
+ADAPTER_CKPT_RESUME=1 从 <output_dir>/adapter_ckpt 的 latest 恢复
+
+CPU 小模型对比（同步保存完整状态 vs 后台保存的主线程停顿，并校验写出的 adapter 可加载且与内存一致）：
+    python scripts/adapter_ckpt.py models/Qwen/Qwen3-1.7B
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import torch
+from transformers import TrainerCallback
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+from checkpoint_utils import AsyncCheckpointWriter, latest_checkpoint
+
+ASYNC_ADAPTER_CKPT = os.environ.get("ASYNC_ADAPTER_CKPT", "0") == "1"
+ADAPTER_CKPT_KEEP = int(os.environ.get("ADAPTER_CKPT_KEEP", "3"))
+ADAPTER_CKPT_RESUME = os.environ.get("ADAPTER_CKPT_RESUME", "0") == "1"
+CKPT_SUBDIR = "adapter_ckpt"
+
+
+class PinnedBuffers:
+    """一组复用的 CPU 缓冲区（有 CUDA 时为 pinned）；free 在后台写完后置位"""
+
+    def __init__(self):
+        self.tensors = {}
+        self.free = threading.Event()
+        self.free.set()
+
+    def copy(self, key: str, t: torch.Tensor) -> torch.Tensor:
+        buf = self.tensors.get(key)
+        if buf is None or buf.shape != t.shape or buf.dtype != t.dtype:
+            buf = torch.empty(t.shape, dtype=t.dtype, device="cpu", pin_memory=torch.cuda.is_available())
+            self.tensors[key] = buf
+        buf.copy_(t.detach(), non_blocking=True)
+        return buf
+
+
+def snapshot_adapter(model, optimizer, buffers: PinnedBuffers):
+    """返回 (adapter 张量, 优化器张量, 优化器非张量部分)，张量都在 buffers 中"""
+    from peft import get_peft_model_state_dict
+
+    trainable = {n: buffers.copy(f"param.{n}", p) for n, p in model.named_parameters() if p.requires_grad}
+    opt_state = optimizer.state_dict()
+    opt_tensors, opt_scalars = {}, {}
+    for idx, state in opt_state["state"].items():
+        for k, v in state.items():
+            if torch.is_tensor(v):
+                opt_tensors[f"state.{idx}.{k}"] = buffers.copy(f"optim.{idx}.{k}", v)
+            else:
+                opt_scalars[f"state.{idx}.{k}"] = v
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    adapter = get_peft_model_state_dict(model, state_dict=trainable)
+    return adapter, opt_tensors, {"param_groups": opt_state["param_groups"], "scalars": opt_scalars}
+
+
+def write_adapter_checkpoint(tmp_dir: str, adapter: dict, peft_config, opt_tensors: dict, training_state: dict,
+                             trainer_state_json: str = None):
+    from safetensors.torch import save_file
+
+    save_file(adapter, os.path.join(tmp_dir, "adapter_model.safetensors"), metadata={"format": "pt"})
+    peft_config.save_pretrained(tmp_dir)
+    save_file(opt_tensors, os.path.join(tmp_dir, "optimizer.safetensors"))
+    with open(os.path.join(tmp_dir, "training_state.json"), "w", encoding="utf-8") as f:
+        json.dump(training_state, f, ensure_ascii=False)
+    if trainer_state_json is not None:
+        with open(os.path.join(tmp_dir, "trainer_state.json"), "w", encoding="utf-8") as f:
+            f.write(trainer_state_json)
+
+
+def load_adapter_checkpoint(checkpoint: str, model, optimizer=None, lr_scheduler=None) -> dict:
+    """把 write_adapter_checkpoint 写出的目录读回 model / optimizer / lr_scheduler，返回 training_state"""
+    from peft import set_peft_model_state_dict
+    from safetensors.torch import load_file
+
+    with open(os.path.join(checkpoint, "training_state.json"), "r", encoding="utf-8") as f:
+        training_state = json.load(f)
+    set_peft_model_state_dict(model, load_file(os.path.join(checkpoint, "adapter_model.safetensors")))
+    if optimizer is not None:
+        meta = training_state["optimizer"]
+        state = {}
+        for key, v in list(load_file(os.path.join(checkpoint, "optimizer.safetensors")).items()) + list(meta["scalars"].items()):
+            _, idx, k = key.split(".", 2)
+            state.setdefault(int(idx), {})[k] = v
+        optimizer.load_state_dict({"state": state, "param_groups": meta["param_groups"]})
+    if lr_scheduler is not None and training_state.get("scheduler") is not None:
+        lr_scheduler.load_state_dict(training_state["scheduler"])
+    return training_state
+
+
+def adapter_resume_checkpoint(output_dir: str):
+    """ADAPTER_CKPT_RESUME=1 时返回 <output_dir>/adapter_ckpt 中最近一次完整写入的目录，否则 None"""
+    return latest_checkpoint(os.path.join(output_dir, CKPT_SUBDIR)) if ADAPTER_CKPT_RESUME else None
+
+
+class AdapterCheckpointCallback(TrainerCallback):
+    def __init__(self, output_dir: str, keep_last: int = ADAPTER_CKPT_KEEP, resume_from: str = None):
+        self.root = os.path.join(output_dir, CKPT_SUBDIR)
+        self.output_dir = output_dir
+        self.keep_last = keep_last
+        self.resume_from = resume_from
+        self.writer = None
+        self._buffers = [PinnedBuffers(), PinnedBuffers()]
+        self._next = 0
+        self._step_start = None
+        self._after_save = False
+        self.step_sec, self.after_save_sec, self.saves = [], [], []
+
+    def on_train_begin(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if self.resume_from is not None:
+            # 每个 rank 都要恢复自己的优化器/调度器；global_step 与数据跳过由 Trainer 读 trainer_state.json 完成
+            restored = load_adapter_checkpoint(self.resume_from, model, optimizer, lr_scheduler)
+            if restored["global_step"] != state.global_step:
+                raise ValueError(f"{self.resume_from} 保存于 step {restored['global_step']}，Trainer 当前为 step "
+                                 f"{state.global_step}：需要同时传给 trainer.train(resume_from_checkpoint=...)")
+            print(f"♻️ Resumed adapter, optimizer and scheduler from {self.resume_from} (step {state.global_step})")
+        if state.is_world_process_zero:
+            self.writer = AsyncCheckpointWriter(self.root, keep_last=self.keep_last)
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._step_start = time.perf_counter()
+
+    def on_step_end(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if self._step_start is not None:
+            (self.after_save_sec if self._after_save else self.step_sec).append(time.perf_counter() - self._step_start)
+        self._after_save = False
+        if control.should_save:
+            # 接管 Trainer 的保存：不再写完整 checkpoint
+            control.should_save = False
+            if self.writer is not None:
+                self._save(state, model, optimizer, lr_scheduler)
+                self._after_save = True
+
+    def _save(self, state, model, optimizer, lr_scheduler):
+        start = time.perf_counter()
+        buffers = self._buffers[self._next]
+        self._next = 1 - self._next
+        buffers.free.wait()
+        waited = time.perf_counter() - start
+        buffers.free.clear()
+        try:
+            adapter, opt_tensors, opt_meta = snapshot_adapter(model, optimizer, buffers)
+        except BaseException:
+            buffers.free.set()
+            raise
+        training_state = {
+            "global_step": state.global_step,
+            "epoch": state.epoch,
+            "optimizer": opt_meta,
+            "scheduler": lr_scheduler.state_dict() if lr_scheduler is not None else None,
+        }
+        trainer_state_json = state.to_json_string()
+        peft_config = model.peft_config[getattr(model, "active_adapter", "default")]
+        snap_done = time.perf_counter()
+
+        def write(tmp_dir):
+            try:
+                write_adapter_checkpoint(tmp_dir, adapter, peft_config, opt_tensors, training_state, trainer_state_json)
+            finally:
+                buffers.free.set()
+
+        wait_before = self.writer.stats["queue_wait_sec"]
+        self.writer.submit(f"step_{state.global_step}", write)
+        self.saves.append({
+            "step": state.global_step,
+            "stall_sec": round(time.perf_counter() - start, 4),
+            "buffer_wait_sec": round(waited, 4),
+            "snapshot_sec": round(snap_done - start - waited, 4),
+            "queue_wait_sec": round(self.writer.stats["queue_wait_sec"] - wait_before, 4),
+        })
+
+    def stats(self) -> dict:
+        out = {
+            "saves": len(self.saves),
+            "step_sec_median": round(statistics.median(self.step_sec), 4) if self.step_sec else None,
+            "after_save_step_sec_median": round(statistics.median(self.after_save_sec), 4) if self.after_save_sec else None,
+            "stall_sec_total": round(sum(s["stall_sec"] for s in self.saves), 4),
+            "stall_sec_max": max((s["stall_sec"] for s in self.saves), default=0.0),
+            "per_save": self.saves,
+        }
+        if self.writer is not None:
+            out["background_write_sec"] = round(self.writer.stats["write_sec"], 3)
+        return out
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self.writer is None:
+            return
+        self.writer.close()
+        report = self.stats()
+        with open(os.path.join(self.output_dir, "adapter_ckpt_stats.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Adapter checkpoints: {report['saves']} saved to {self.root}, "
+              f"background write {report.get('background_write_sec', 0)}s, "
+              f"training stalled {report['stall_sec_total']}s (max {report['stall_sec_max']}s per save)")
+
+
+def adapter_checkpoint_callbacks(output_dir: str, resume_from: str = None):
+    """ASYNC_ADAPTER_CKPT=1 时返回 [AdapterCheckpointCallback]，否则为空（保持 Trainer 的完整 checkpoint）"""
+    if resume_from is not None and not ASYNC_ADAPTER_CKPT:
+        raise ValueError("ADAPTER_CKPT_RESUME 需要 ASYNC_ADAPTER_CKPT=1")
+    return [AdapterCheckpointCallback(output_dir, resume_from=resume_from)] if ASYNC_ADAPTER_CKPT else []
+
+
+# ================= 对比 / 校验 =================
+def benchmark(tokenizer_path: str, saves: int = 3) -> dict:
+    from peft import LoraConfig, PeftModel, TaskType, get_peft_model
+    from safetensors.torch import load_file
+
+    from model_utils import tiny_causal_lm
+    from tokenizer_utils import load_tokenizer
+
+    tokenizer = load_tokenizer(tokenizer_path)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    lora = LoraConfig(task_type=TaskType.CAUSAL_LM, r=16, lora_alpha=32,
+                      target_modules=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"])
+    def build():
+        model = get_peft_model(tiny_causal_lm(tokenizer, seed=0, hidden_size=256, num_layers=4), lora)
+        optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-3)
+        return model, optimizer, torch.optim.lr_scheduler.LambdaLR(optimizer, lambda s: 1.0 / (1 + s))
+
+    model, optimizer, scheduler = build()
+    ids = torch.randint(0, len(tokenizer), (2, 64), generator=torch.Generator().manual_seed(0))
+
+    def train_step(model=model, optimizer=optimizer, scheduler=scheduler):
+        model(input_ids=ids, labels=ids).loss.backward()
+        optimizer.step()
+        scheduler.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    work = tempfile.mkdtemp(prefix="adapter_ckpt_")
+    sync_sec = []
+    for i in range(saves):
+        train_step()
+        start = time.perf_counter()
+        # 与 Trainer 同步保存相同的内容：完整模型目录（PEFT 下为 adapter）+ 优化器
+        out = os.path.join(work, "sync", f"checkpoint-{i}")
+        model.save_pretrained(out)
+        torch.save(optimizer.state_dict(), os.path.join(out, "optimizer.pt"))
+        sync_sec.append(time.perf_counter() - start)
+
+    class _State:
+        epoch = 0.0
+
+        def __init__(self, step):
+            self.global_step = step
+
+        def to_json_string(self):
+            return json.dumps({"global_step": self.global_step})
+
+    callback = AdapterCheckpointCallback(os.path.join(work, "async"), keep_last=2)
+    callback.writer = AsyncCheckpointWriter(callback.root, keep_last=2)
+    for i in range(saves):
+        train_step()
+        callback._save(_State(i + 1), model, optimizer, scheduler)
+    callback.writer.close()
+
+    latest = os.path.join(callback.root, f"step_{saves}")
+    reloaded = PeftModel.from_pretrained(tiny_causal_lm(tokenizer, seed=0, hidden_size=256, num_layers=4), latest)
+    live = {n: p for n, p in model.named_parameters() if p.requires_grad}
+    max_diff = max(float((p - live[n]).abs().max()) for n, p in reloaded.named_parameters() if n in live)
+    opt_saved = load_file(os.path.join(latest, "optimizer.safetensors"))
+    opt_live = optimizer.state_dict()["state"]
+    opt_diff = max(float((opt_saved[f"state.{i}.{k}"] - v).abs().max())
+                   for i, s in opt_live.items() for k, v in s.items() if torch.is_tensor(v))
+    kept = sorted(n for n in os.listdir(callback.root) if n.startswith("step_"))
+
+    # 恢复：新建模型/优化器/调度器读回 latest，再各走一步，应与不中断的训练逐位一致
+    r_model, r_optimizer, r_scheduler = build()
+    for p in r_model.parameters():
+        if p.requires_grad:
+            torch.nn.init.normal_(p)  # 确保不是碰巧与初始化相同
+    restored = load_adapter_checkpoint(latest, r_model, r_optimizer, r_scheduler)
+    train_step()
+    train_step(r_model, r_optimizer, r_scheduler)
+    resume_diff = max(float((p - live[n]).abs().max()) for n, p in r_model.named_parameters() if p.requires_grad)
+    report = {
+        "sync_save_sec_median": round(statistics.median(sync_sec), 4),
+        "async_stall_sec_median": round(statistics.median(s["stall_sec"] for s in callback.saves), 4),
+        "async_background_write_sec": round(callback.writer.stats["write_sec"], 4),
+        "adapter_max_abs_diff": max_diff,
+        "optimizer_max_abs_diff": opt_diff,
+        "retained": kept,
+        "resumed_global_step": restored["global_step"],
+        "resumed_last_epoch": r_scheduler.last_epoch,
+        "resume_then_step_max_abs_diff": resume_diff,
+    }
+    report["ok"] = (max_diff == 0.0 and opt_diff == 0.0 and kept == [f"step_{saves - 1}", f"step_{saves}"]
+                    and restored["global_step"] == saves and r_scheduler.last_epoch == scheduler.last_epoch
+                    and resume_diff == 0.0)
+    print(json.dumps(report, indent=2))
+    print("✅ Adapter checkpoint reloads and resumes bit-exact" if report["ok"] else "❌ Adapter checkpoint mismatch")
+    return report
+
+
+if __name__ == "__main__":
+    ok = benchmark(sys.argv[1] if len(sys.argv) > 1 else "models/Qwen/Qwen3-1.7B")["ok"]
+    sys.exit(0 if ok else 1)
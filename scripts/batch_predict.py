@@ -1,7 +1,12 @@
 # scripts/batch_predict.py
-import os, json, torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
+import json
+from model_utils import load_model
+from generation import GenerationStats, generate, load_speculative_config
+from think_budget import make_think_controller
+from detokenizer import DeltaStreamer
+from dataset_io import iter_records, resolve_path
+from tracing import span
+from chat_template import chat_encoder
 
 DATA = "data/processed/test.jsonl"
 OUT  = "data/processed/test_pred.jsonl"
@@ -17,46 +22,50 @@ IS_LORA = False
 
 PROMPT = "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。"
 
-def apply_template(tokenizer, question):
-    return tokenizer.apply_chat_template(
-        [
-            {"role":"system","content":PROMPT},
-            {"role":"user","content":question}
-        ],
-        tokenize=False, add_generation_prompt=True
-    )
+def build_messages(question):
+    return [
+        {"role":"system","content":PROMPT},
+        {"role":"user","content":question}
+    ]
 
 def main():
+    # 设备/量化由 INFER_DEVICE、INFER_QUANT 控制（见 model_utils.py）
     if IS_LORA:
-        base = AutoModelForCausalLM.from_pretrained(BASE_DIR, torch_dtype=torch.bfloat16, device_map="auto", trust_remote_code=True)
-        model = PeftModel.from_pretrained(base, ADAPTER_DIR).eval()
-        tokenizer = AutoTokenizer.from_pretrained(BASE_DIR, use_fast=False, trust_remote_code=True)
+        model, tokenizer = load_model(base_dir=BASE_DIR, adapter_dir=ADAPTER_DIR)
     else:
-        model = AutoModelForCausalLM.from_pretrained(MODEL_DIR, torch_dtype=torch.bfloat16, device_map="auto", trust_remote_code=True).eval()
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR, use_fast=False, trust_remote_code=True)
+        model, tokenizer = load_model(model_dir=MODEL_DIR)
 
+    spec = load_speculative_config()  # SPEC_MODE=draft|ngram 时启用投机解码
+    total = GenerationStats()
+    controller = make_think_controller(tokenizer)  # THINK_BUDGET>0 时启用思考/回答预算
     outs = []
-    with open(DATA,"r",encoding="utf-8") as f:
-        for line in f:
-            r = json.loads(line)
-            text = apply_template(tokenizer, r["input"])
-            inputs = tokenizer([text], return_tensors="pt").to("cuda")
-            with torch.no_grad():
-                gen = model.generate(
-                    inputs.input_ids, max_new_tokens=512, temperature=0.7, top_p=0.9,
-                    eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id
-                )
-            gen_ids = gen[0][len(inputs.input_ids[0]):]
-            resp = tokenizer.decode(gen_ids, skip_special_tokens=True)
-            outs.append({
-                "instruction": r["instruction"],
-                "input": r["input"],
-                "output": resp,
-                "meta": r.get("meta",{})
-            })
+    encoder = chat_encoder(tokenizer)  # 固定片段的 token id 已缓存，只对问题文本分词
+    for r in iter_records(resolve_path(DATA), columns=["instruction", "input", "meta"]):
+        with span("tokenize"):
+            inputs = encoder.inputs(build_messages(r["input"])).to(model.device)
+        # 生成过程中增量反分词，结束时文本已就绪，无需再整段 decode
+        streamer = DeltaStreamer(tokenizer, on_text=lambda delta: None)
+        _, stats = generate(
+            model, tokenizer, inputs.input_ids, inputs.attention_mask,
+            max_new_tokens=512, temperature=0.7, top_p=0.9, spec=spec,
+            logits_processor=controller, streamer=streamer
+        )
+        for k in ("new_tokens", "seconds", "target_forwards", "drafted", "accepted"):
+            setattr(total, k, getattr(total, k) + getattr(stats, k))
+        resp = streamer.text
+        outs.append({
+            "instruction": r["instruction"],
+            "input": r["input"],
+            "output": resp,
+            "meta": r.get("meta",{})
+        })
     with open(OUT,"w",encoding="utf-8") as f:
         for o in outs:
             f.write(json.dumps(o, ensure_ascii=False) + "\n")
+    print("⏱️ Generation:", total.summary())
+    if controller is not None:
+        controller.flush()
+        print("🧠 Think budget:", controller.stats.summary())
     print("✅ Predictions saved:", OUT)
 
 if __name__ == "__main__":
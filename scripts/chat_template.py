@@ -0,0 +1,246 @@
+# scripts/chat_template.py
+"""
+预编译的聊天模板：固定片段的 token id 只算一次，每次请求只对消息内容分词，直接拼出 input_ids。
+
+原先每个请求都先 apply_chat_template(tokenize=False) 做一次 Jinja 渲染，再对整串重新分词；
+系统提示、角色头、<|im_end|> 这些每次都一样的部分被反复渲染、反复分词。这里：
+- 按 (角色序列, add_generation_prompt, 模板参数) 编译一次：用占位串代替各条消息内容做一次 Jinja 渲染，
+  在占位处切开，得到"固定片段 / 内容槽"的序列，固定片段预先分词缓存
+- 每次请求只对内容分词（LRU 缓存，系统提示与多轮历史通常直接命中），按序拼接
+- 与 Jinja 路径逐 id 一致的前提：内容前后有特殊 token（<|im_start|> 等）或换行作为切分边界。
+  编译时检查模板满足这一点；内容首尾有空白、或含有 added token 文本（<think>、<|im_end|>、<tool_response> 等，
+  模板可能会改写这些内容）时，该请求退回 Jinja 渲染 + 整串分词
+
+    encoder = chat_encoder(tokenizer)
+    inputs = encoder.inputs(messages).to(model.device)     # 等价于 tokenizer([apply_chat_template(...)], return_tensors="pt")
+
+语料一致性校验与每请求 CPU 预处理耗时对比：
+    python scripts/chat_template.py parity models/Qwen/Qwen3-1.7B data/processed/dev.jsonl
+    python scripts/chat_template.py bench  models/Qwen/Qwen3-1.7B data/processed/dev.jsonl
+"""
+import json
+import os
+import statistics
+import sys
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+CHAT_CONTENT_CACHE = int(os.environ.get("CHAT_CONTENT_CACHE", "4096"))
+PROMPT = "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。"
+SLOT = "\u2063SLOT{}\u2063"  # 不可见分隔符包裹，模板不会产生也不会改写
+
+
+class ChatTemplateEncoder:
+    def __init__(self, tokenizer, content_cache_size: int = CHAT_CONTENT_CACHE):
+        self.tokenizer = tokenizer
+        self.added_tokens = sorted(tokenizer.get_added_vocab(), key=len, reverse=True)
+        self._plans: Dict[tuple, Optional[list]] = {}
+        self._content_ids = lru_cache(maxsize=content_cache_size)(self._tokenize)
+        self.stats = {"compiled": 0, "fast": 0, "fallback": 0}
+
+    def _tokenize(self, text: str) -> tuple:
+        return tuple(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def render(self, messages: List[dict], add_generation_prompt: bool = True, **template_kwargs) -> str:
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=add_generation_prompt,
+                                                  **template_kwargs)
+
+    # ---- 编译 ----
+    def _starts_with_boundary(self, text: str) -> bool:
+        return text == "" or any(text.startswith(t) for t in self.added_tokens)
+
+    def _ends_with_boundary(self, text: str) -> bool:
+        return text == "" or text.endswith("\n") or any(text.endswith(t) for t in self.added_tokens)
+
+    def _compile(self, roles: tuple, add_generation_prompt: bool, template_kwargs: tuple) -> Optional[list]:
+        """返回 [固定片段 ids 元组 | 消息下标, ...]；模板不满足切分边界条件时返回 None（始终走 Jinja）"""
+        if self.tokenizer("")["input_ids"]:
+            return None  # 会自动加 BOS/EOS 的分词器：整串与分段的特殊 token 位置不同
+        slots = [SLOT.format(i) for i in range(len(roles))]
+        text = self.render([{"role": r, "content": s} for r, s in zip(roles, slots)], add_generation_prompt,
+                           **dict(template_kwargs))
+        pieces, pos = [], 0
+        for i, s in enumerate(slots):
+            at = text.find(s, pos)
+            if at < 0 or text.count(s) != 1:
+                return None
+            pieces += [text[pos:at], i]
+            pos = at + len(s)
+        pieces.append(text[pos:])
+        for j in range(1, len(pieces), 2):
+            if not (self._ends_with_boundary(pieces[j - 1]) and self._starts_with_boundary(pieces[j + 1])):
+                return None
+        self.stats["compiled"] += 1
+        return [self._tokenize(p) if isinstance(p, str) else p for p in pieces if p != ""]
+
+    def _plan(self, roles: tuple, add_generation_prompt: bool, template_kwargs: tuple):
+        key = (roles, add_generation_prompt, template_kwargs)
+        if key not in self._plans:
+            self._plans[key] = self._compile(roles, add_generation_prompt, template_kwargs)
+        return self._plans[key]
+
+    def _safe_content(self, content) -> bool:
+        return isinstance(content, str) and content == content.strip() and not any(t in content for t in self.added_tokens)
+
+    def _plan_for(self, messages: List[dict], add_generation_prompt: bool, template_kwargs: dict):
+        """可走预编译路径时返回编译结果，否则 None（需要 Jinja 渲染）"""
+        if not all(self._safe_content(m.get("content")) and set(m) <= {"role", "content"} for m in messages):
+            return None
+        return self._plan(tuple(m["role"] for m in messages), add_generation_prompt, tuple(sorted(template_kwargs.items())))
+
+    # ---- 编码 ----
+    def encode(self, messages: List[dict], add_generation_prompt: bool = True, **template_kwargs) -> List[int]:
+        """与 tokenizer(apply_chat_template(messages, tokenize=False, ...))["input_ids"] 逐 id 一致"""
+        plan = self._plan_for(messages, add_generation_prompt, template_kwargs)
+        if plan is None:
+            self.stats["fallback"] += 1
+            return self.tokenizer(self.render(messages, add_generation_prompt, **template_kwargs))["input_ids"]
+        self.stats["fast"] += 1
+        ids = []
+        for piece in plan:
+            ids.extend(piece if isinstance(piece, tuple) else self._content_ids(messages[piece]["content"]))
+        return ids
+
+    def lengths(self, conversations: List[List[dict]], add_generation_prompt: bool = True, batch_size: int = 1024,
+                **template_kwargs) -> List[int]:
+        """批量版 [len(encode(m)) for m in conversations]：固定片段长度取自编译结果，各条内容去重后按批分词"""
+        rows, content_len = [], {}
+        for messages in conversations:
+            plan = self._plan_for(messages, add_generation_prompt, template_kwargs)
+            if plan is None:
+                self.stats["fallback"] += 1
+                rows.append((len(self.tokenizer(self.render(messages, add_generation_prompt, **template_kwargs))["input_ids"]), ()))
+                continue
+            self.stats["fast"] += 1
+            contents = tuple(messages[p]["content"] for p in plan if not isinstance(p, tuple))
+            for c in contents:
+                content_len.setdefault(c, 0)
+            rows.append((sum(len(p) for p in plan if isinstance(p, tuple)), contents))
+        texts = list(content_len)
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start:start + batch_size]
+            for text, ids in zip(chunk, self.tokenizer(chunk, add_special_tokens=False)["input_ids"]):
+                content_len[text] = len(ids)
+        return [fixed + sum(content_len[c] for c in contents) for fixed, contents in rows]
+
+    def inputs(self, messages: List[dict], add_generation_prompt: bool = True, **template_kwargs):
+        """单条请求的 BatchEncoding（input_ids / attention_mask，形状 [1, T]）"""
+        import torch
+        from transformers import BatchEncoding
+
+        ids = torch.tensor([self.encode(messages, add_generation_prompt, **template_kwargs)], dtype=torch.long)
+        return BatchEncoding({"input_ids": ids, "attention_mask": torch.ones_like(ids)})
+
+
+_ENCODERS: Dict[int, ChatTemplateEncoder] = {}
+
+
+def chat_encoder(tokenizer) -> ChatTemplateEncoder:
+    """每个分词器对象共用一个编码器（编译结果与内容缓存随之复用）"""
+    encoder = _ENCODERS.get(id(tokenizer))
+    if encoder is None or encoder.tokenizer is not tokenizer:
+        encoder = _ENCODERS[id(tokenizer)] = ChatTemplateEncoder(tokenizer)
+    return encoder
+
+
+# ================= 校验 / 基准 =================
+def _answer_only(output: str) -> str:
+    return output.split("</think>")[-1].strip()
+
+
+def corpus_conversations(data_path: str, limit: int = 0) -> List[List[dict]]:
+    """单轮（系统 + 用户）、带历史的多轮（回答去掉思考段）、历史含完整 <think> 输出（走回退路径）三种形态"""
+    from dataset_io import iter_records, resolve_path
+
+    rows = []
+    for i, r in enumerate(iter_records(resolve_path(data_path), columns=["input", "output"])):
+        if limit and i >= limit:
+            break
+        rows.append(r)
+    convs = []
+    for i, r in enumerate(rows):
+        system, user = {"role": "system", "content": PROMPT}, {"role": "user", "content": r["input"]}
+        convs.append([system, user])
+        prev = rows[i - 1]
+        convs.append([system, {"role": "user", "content": prev["input"]},
+                      {"role": "assistant", "content": _answer_only(prev["output"] or "")}, user])
+        if i % 10 == 0:
+            convs.append([system, {"role": "user", "content": prev["input"]},
+                          {"role": "assistant", "content": prev["output"] or ""}, user])
+    return convs
+
+
+def check_parity(tokenizer, conversations):
+    """返回 (不一致列表 [(messages, jinja_ids, compiled_ids)], 编码器统计)"""
+    encoder = ChatTemplateEncoder(tokenizer)
+    mismatches = []
+    for msgs in conversations:
+        ref = tokenizer(encoder.render(msgs))["input_ids"]
+        got = encoder.encode(msgs)
+        if got != ref:
+            mismatches.append((msgs, ref, got))
+    return mismatches, encoder.stats
+
+
+def benchmark(tokenizer, conversations, repeat: int = 3) -> dict:
+    def per_request_us(fn):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for msgs in conversations:
+                fn(msgs)
+            sec = time.perf_counter() - start
+            best = sec if best is None else min(best, sec)
+        return round(best / len(conversations) * 1e6, 1)
+
+    jinja = per_request_us(lambda m: tokenizer([tokenizer.apply_chat_template(m, tokenize=False, add_generation_prompt=True)],
+                                                return_tensors="pt"))
+    cold = ChatTemplateEncoder(tokenizer, content_cache_size=0)
+    cold.encode(conversations[0])
+    no_cache = per_request_us(lambda m: cold.inputs(m))
+    warm = ChatTemplateEncoder(tokenizer)
+    compiled = per_request_us(lambda m: warm.inputs(m))
+    lengths = [len(warm.encode(m)) for m in conversations]
+    return {
+        "requests": len(conversations),
+        "median_prompt_tokens": statistics.median(lengths),
+        "jinja_render_and_tokenize_us": jinja,
+        "compiled_us": no_cache,
+        "compiled_with_content_cache_us": compiled,
+        "speedup": round(jinja / max(no_cache, 1e-9), 2),
+        "speedup_with_content_cache": round(jinja / max(compiled, 1e-9), 2),
+        "encoder_stats": warm.stats,
+    }
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ("parity", "bench"):
+        print(__doc__)
+        sys.exit(1)
+    from tokenizer_utils import load_tokenizer
+
+    cmd, model_path, data_path = sys.argv[1:4]
+    tokenizer = load_tokenizer(model_path)
+    conversations = corpus_conversations(data_path)
+    if cmd == "parity":
+        mismatches, stats = check_parity(tokenizer, conversations)
+        if mismatches:
+            for msgs, ref, got in mismatches[:5]:
+                diff = next((i for i, (a, b) in enumerate(zip(ref, got)) if a != b), min(len(ref), len(got)))
+                print(f"❌ {json.dumps([m['role'] for m in msgs])} first diff at {diff}: "
+                      f"jinja={ref[diff:diff + 8]} compiled={got[diff:diff + 8]}")
+            print(f"❌ {len(mismatches)}/{len(conversations)} mismatches")
+            sys.exit(1)
+        print(f"✅ Compiled template ids identical to Jinja on {len(conversations)} conversations "
+              f"(fast {stats['fast']}, fallback {stats['fallback']}, plans {stats['compiled']})")
+    else:
+        print(json.dumps(benchmark(tokenizer, conversations), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# scripts/checkpoint_utils.py
+"""
+异步 checkpoint：主线程只做一次"拷贝到 CPU"的快照，序列化与写盘交给后台线程，训练循环不等 IO。
+
+- snapshot_to_cpu(obj)：递归把张量 detach + clone 到 CPU（可选 pinned memory），快照之后
+  主线程可以继续原地更新参数/优化器状态
+- AsyncCheckpointWriter.snapshot(capture)：在主线程执行快照并计时；stall_sec = 快照拷贝 + submit 排队等待
+- AsyncCheckpointWriter.submit(name, write_fn)：后台线程在 root/.name.tmp 目录中调用
+  write_fn(tmp_dir)，完成后原子重命名为 root/name，再原子更新 root/latest 指针并按 keep_last 清理旧目录。
+  队列只容纳 1 个待写任务：上一次还没写完时 submit 会阻塞（背压），内存中最多两份快照
+- latest_checkpoint(root)：读取 latest 指针；写到一半崩溃的 .tmp 目录不会被当作有效 checkpoint
+"""
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import torch
+
+LATEST_FILE = "latest"
+
+
+def snapshot_to_cpu(obj, pin_memory: bool = False):
+    """递归复制 dict/list/tuple 中的张量到 CPU；非张量原样返回"""
+    if isinstance(obj, torch.Tensor):
+        t = obj.detach()
+        if t.device.type == "cpu":
+            t = t.clone()
+        else:
+            t = t.to("cpu", copy=True)
+        return t.pin_memory() if pin_memory and torch.cuda.is_available() else t
+    if isinstance(obj, dict):
+        return {k: snapshot_to_cpu(v, pin_memory) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(v, pin_memory) for v in obj)
+    return obj
+
+
+def _step_of(name: str) -> int:
+    m = re.search(r"(\d+)$", name)
+    return int(m.group(1)) if m else -1
+
+
+def latest_checkpoint(root: str) -> Optional[str]:
+    """返回最近一次完整写入的 checkpoint 目录；没有时返回 None"""
+    pointer = os.path.join(root, LATEST_FILE)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, "r", encoding="utf-8") as f:
+        name = json.load(f)["name"]
+    path = os.path.join(root, name)
+    return path if os.path.isdir(path) else None
+
+
+class AsyncCheckpointWriter:
+    def __init__(self, root: str, keep_last: int = 3, prefix: str = "step_"):
+        self.root = root
+        self.keep_last = keep_last
+        self.prefix = prefix
+        os.makedirs(root, exist_ok=True)
+        self.stats = {"saves": 0, "write_sec": 0.0, "stall_sec": 0.0, "snapshot_sec": 0.0, "queue_wait_sec": 0.0}
+        self._error: Optional[BaseException] = None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._worker, name="ckpt-writer", daemon=True)
+        self._thread.start()
+
+    # ---- 主线程 ----
+    def snapshot(self, capture: Callable[[], Any]):
+        """执行 capture()（例如 snapshot_to_cpu），拷贝耗时计入训练停顿"""
+        start = time.perf_counter()
+        state = capture()
+        sec = time.perf_counter() - start
+        self.stats["snapshot_sec"] += sec
+        self.stats["stall_sec"] += sec
+        return state
+
+    def submit(self, name: str, write_fn: Callable[[str], None]):
+        """排队写入；write_fn 只能读取已快照的数据"""
+        self._raise_if_failed()
+        start = time.perf_counter()
+        self._queue.put((name, write_fn))
+        sec = time.perf_counter() - start
+        self.stats["queue_wait_sec"] += sec
+        self.stats["stall_sec"] += sec
+
+    def wait(self):
+        """阻塞直到队列中的 checkpoint 全部落盘"""
+        self._queue.join()
+        self._raise_if_failed()
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise RuntimeError(f"checkpoint 写入失败: {err}") from err
+
+    # ---- 后台线程 ----
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            name, write_fn = item
+            try:
+                start = time.perf_counter()
+                self._write(name, write_fn)
+                self.stats["saves"] += 1
+                self.stats["write_sec"] += time.perf_counter() - start
+            except BaseException as e:  # 交给主线程在下一次 submit/wait 时抛出
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, name: str, write_fn: Callable[[str], None]):
+        tmp = os.path.join(self.root, f".{name}.tmp")
+        final = os.path.join(self.root, name)
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        write_fn(tmp)
+        if os.path.exists(final):
+            shutil.rmtree(final)
+        os.replace(tmp, final)
+
+        pointer_tmp = os.path.join(self.root, LATEST_FILE + ".tmp")
+        with open(pointer_tmp, "w", encoding="utf-8") as f:
+            json.dump({"name": name, "time": time.time()}, f)
+        os.replace(pointer_tmp, os.path.join(self.root, LATEST_FILE))
+        self._prune(keep=name)
+
+    def _prune(self, keep: str):
+        if self.keep_last <= 0:
+            return
+        names = sorted(
+            (n for n in os.listdir(self.root) if n.startswith(self.prefix) and os.path.isdir(os.path.join(self.root, n))),
+            key=_step_of,
+        )
+        for n in names[:-self.keep_last]:
+            if n != keep:
+                shutil.rmtree(os.path.join(self.root, n), ignore_errors=True)
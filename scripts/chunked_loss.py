@@ -0,0 +1,182 @@
+# scripts/chunked_loss.py
+"""
+只在回答位置计算 logits/loss 的分块交叉熵（SFT 用）。
+
+原先的 SFT 前向对每个位置（包括 labels=-100 的 prompt 位置）都算完整词表 logits（Qwen3 约 15 万），
+2048 长度下 fp32 logits 及其梯度占激活显存的大头。这里：
+1. 前向仍经过传入的模型本身（DDP 包装时走 DDP.forward，梯度同步的 reducer 照常准备），
+   只是把 lm_head 临时换成恒等映射：HF 输出的 "logits" 就是最后一层（final norm 之后的）hidden states
+2. 按 shift 后的 labels 取出有标签的位置
+3. 每 LOSS_CHUNK 个位置一块做 lm_head + 交叉熵，块内用 checkpoint 丢弃 logits，反向时重算
+峰值只剩一块的 logits（LOSS_CHUNK × vocab），与序列长度和 prompt 长度无关；loss 与 HF 原生实现一致（对有标签 token 取均值）。
+
+环境变量：RESPONSE_ONLY_LOSS=1 启用（train_lora / train_full），LOSS_CHUNK（默认 1024）
+
+一致性校验与显存/耗时对比（CPU 小模型；有 GPU 时同时报告 CUDA 峰值显存）：
+    python scripts/chunked_loss.py models/Qwen/Qwen3-1.7B [seq_len]
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import torch
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+from transformers import Trainer
+
+RESPONSE_ONLY_LOSS = os.environ.get("RESPONSE_ONLY_LOSS", "0") == "1"
+LOSS_CHUNK = int(os.environ.get("LOSS_CHUNK", "1024"))
+IGNORE_INDEX = -100
+
+
+def _chunk_ce_sum(hidden: torch.Tensor, weight: torch.Tensor, bias, labels: torch.Tensor) -> torch.Tensor:
+    logits = F.linear(hidden, weight, bias).float()
+    return F.cross_entropy(logits, labels, reduction="sum")
+
+
+def chunked_lm_loss(hidden_states: torch.Tensor, lm_head: torch.nn.Linear, labels: torch.Tensor,
+                    chunk_size: int = LOSS_CHUNK) -> torch.Tensor:
+    """hidden_states: [B, T, H]，labels: [B, T]（-100 为忽略位置）；返回有标签 token 的平均交叉熵"""
+    shift_labels = labels[:, 1:]
+    mask = shift_labels != IGNORE_INDEX
+    hidden = hidden_states[:, :-1][mask]
+    targets = shift_labels[mask]
+    n = targets.numel()
+    if n == 0:
+        return hidden_states.sum() * 0.0
+    total = hidden.new_zeros((), dtype=torch.float32)
+    for start in range(0, n, chunk_size):
+        h, y = hidden[start:start + chunk_size], targets[start:start + chunk_size]
+        if torch.is_grad_enabled():
+            total = total + checkpoint(_chunk_ce_sum, h, lm_head.weight, lm_head.bias, y, use_reentrant=False)
+        else:
+            total = total + _chunk_ce_sum(h, lm_head.weight, lm_head.bias, y)
+    return total / n
+
+
+def _output_head(model) -> torch.nn.Linear:
+    """lm_head；兼容 DDP（.module）与 PEFT（get_base_model）包装"""
+    inner = model.module if isinstance(model, torch.nn.parallel.DistributedDataParallel) else model
+    base = inner.get_base_model() if hasattr(inner, "get_base_model") else inner
+    return base.get_output_embeddings()
+
+
+@contextmanager
+def _skip_head(lm_head: torch.nn.Module):
+    """前向期间 lm_head 原样返回输入（实例属性遮蔽类上的 forward），退出时恢复"""
+    lm_head.forward = lambda hidden_states: hidden_states
+    try:
+        yield
+    finally:
+        del lm_head.forward
+
+
+def response_only_loss(model, inputs: dict, chunk_size: int = LOSS_CHUNK) -> torch.Tensor:
+    lm_head = _output_head(model)
+    with _skip_head(lm_head):
+        # 不能绕过包装直接调用骨干：DDP.forward 之外的前向不会为反向准备梯度 all-reduce
+        hidden = model(input_ids=inputs["input_ids"], attention_mask=inputs.get("attention_mask"),
+                       use_cache=False).logits
+    # HF 会把 "logits" 转成 fp32；hidden states 原本就是权重精度，转回去是无损的
+    return chunked_lm_loss(hidden.to(lm_head.weight.dtype), lm_head, inputs["labels"], chunk_size)
+
+
+class ResponseOnlyTrainer(Trainer):
+    """compute_loss 改为只在回答位置分块计算；评估只返回 loss（本项目的 Trainer 不计算 logits 指标）"""
+
+    loss_chunk = LOSS_CHUNK
+
+    def compute_loss(self, model, inputs, return_outputs=False):
+        loss = response_only_loss(model, inputs, self.loss_chunk)
+        return (loss, {"loss": loss}) if return_outputs else loss
+
+    def prediction_step(self, model, inputs, prediction_loss_only, ignore_keys=None):
+        inputs = self._prepare_inputs(inputs)
+        with torch.no_grad(), self.compute_loss_context_manager():
+            loss = self.compute_loss(model, inputs)
+        return loss.detach(), None, None
+
+
+def trainer_class():
+    return ResponseOnlyTrainer if RESPONSE_ONLY_LOSS else Trainer
+
+
+# ================= 校验 / 基准 =================
+def _saved_bytes(fn):
+    """统计 autograd 为反向保存的张量总字节数（按 storage 去重，CPU 上也可用）"""
+    seen, total = set(), [0]
+
+    def pack(t):
+        key = (t.untyped_storage().data_ptr(), t.device)
+        if key not in seen:
+            seen.add(key)
+            total[0] += t.untyped_storage().nbytes()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        out = fn()
+    return out, total[0]
+
+
+def _tiny_batch(tokenizer, seq_len: int, prompt_frac: float = 0.25, batch: int = 2, seed: int = 0):
+    g = torch.Generator().manual_seed(seed)
+    input_ids = torch.randint(0, len(tokenizer), (batch, seq_len), generator=g)
+    labels = input_ids.clone()
+    labels[:, :int(seq_len * prompt_frac)] = IGNORE_INDEX
+    return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids), "labels": labels}
+
+
+def parity_and_benchmark(tokenizer_path: str, seq_len: int = 512, chunk_size: int = 128, atol: float = 1e-4) -> dict:
+    from model_utils import tiny_causal_lm
+    from tokenizer_utils import load_tokenizer
+
+    tokenizer = load_tokenizer(tokenizer_path)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    model = tiny_causal_lm(tokenizer, seed=0)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.to(device)
+    inputs = {k: v.to(device) for k, v in _tiny_batch(tokenizer, seq_len).items()}
+
+    report = {"seq_len": seq_len, "vocab": len(tokenizer), "chunk": chunk_size, "device": device}
+    grads = {}
+    for name, fn in (
+        ("hf_full_logits", lambda: model(**inputs).loss),
+        ("response_only_chunked", lambda: response_only_loss(model, inputs, chunk_size)),
+    ):
+        model.zero_grad(set_to_none=True)
+        if device == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start = time.perf_counter()
+        loss, saved = _saved_bytes(fn)
+        loss.backward()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        entry = {
+            "loss": round(loss.item(), 6),
+            "step_sec": round(time.perf_counter() - start, 3),
+            "saved_activation_mb": round(saved / 2 ** 20, 1),
+        }
+        if device == "cuda":
+            entry["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+        report[name] = entry
+        grads[name] = torch.cat([p.grad.flatten() for p in model.parameters() if p.grad is not None])
+
+    ref, new = report["hf_full_logits"]["loss"], report["response_only_chunked"]["loss"]
+    report["loss_abs_diff"] = abs(ref - new)
+    report["grad_max_abs_diff"] = float((grads["hf_full_logits"] - grads["response_only_chunked"]).abs().max())
+    report["parity"] = report["loss_abs_diff"] < atol and report["grad_max_abs_diff"] < atol
+    print(json.dumps(report, indent=2))
+    print("✅ Loss/grad parity OK" if report["parity"] else "❌ Loss/grad mismatch")
+    return report
+
+
+if __name__ == "__main__":
+    ok = parity_and_benchmark(
+        sys.argv[1] if len(sys.argv) > 1 else "models/Qwen/Qwen3-1.7B",
+        seq_len=int(sys.argv[2]) if len(sys.argv) > 2 else 512,
+    )["parity"]
+    sys.exit(0 if ok else 1)
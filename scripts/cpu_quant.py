@@ -0,0 +1,243 @@
+# scripts/cpu_quant.py
+"""
+CPU 推理量化：
+- int8：torch 动态量化（权重 int8，激活按批动态量化），作用于解码层内全部 nn.Linear
+- int4：仅权重量化（按组 min/scale，两个 4bit 打包进一个 uint8），前向时反量化为 fp32
+lm_head 与词嵌入保持 fp32（Qwen3 二者权重共享，量化 lm_head 会破坏共享并损失精度）。
+量化后的模型整体序列化到缓存目录，下次启动直接反序列化，跳过 fp32 加载与量化。
+
+直接运行：与 bf16 参考模型对比 eval_auto 指标与困惑度，并报告 tokens/s 与常驻内存
+    INFER_QUANT=int8 python scripts/cpu_quant.py
+"""
+import gc
+import hashlib
+import json
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+QUANT_MODES = ("int8", "int4")
+QUANT_CACHE_DIR = os.environ.get("QUANT_CACHE_DIR", "models/quant_cache")
+INT4_GROUP_SIZE = 128
+
+# 校验用数据与规模（可用环境变量覆盖）
+MODEL_DIR = os.environ.get("QUANT_MODEL_DIR", "models/full/final_model")
+BASE_DIR = os.environ.get("QUANT_BASE_DIR", "models/Qwen/Qwen3-1.7B")
+ADAPTER_DIR = os.environ.get("QUANT_ADAPTER_DIR")  # 设置后按 LoRA（base + adapter）加载
+EVAL_DATA = os.environ.get("QUANT_EVAL_DATA", "data/processed/dev.jsonl")
+EVAL_SAMPLES = int(os.environ.get("QUANT_EVAL_SAMPLES", "32"))
+EVAL_MAX_NEW_TOKENS = int(os.environ.get("QUANT_EVAL_MAX_NEW_TOKENS", "256"))
+REPORT_DIR = "eval_report"
+
+
+class Int4Linear(nn.Module):
+    """仅权重 int4 的线性层：每 group_size 个输入通道共享一组 (min, scale)"""
+
+    def __init__(self, linear: nn.Linear, group_size: int = INT4_GROUP_SIZE):
+        super().__init__()
+        w = linear.weight.detach().float()
+        out_features, in_features = w.shape
+        pad = (-in_features) % group_size
+        if pad:
+            w = F.pad(w, (0, pad))
+        groups = w.view(out_features, -1, group_size)
+        w_min = groups.amin(dim=-1, keepdim=True)
+        w_max = groups.amax(dim=-1, keepdim=True)
+        scale = ((w_max - w_min) / 15).clamp(min=1e-8)
+        q = torch.round((groups - w_min) / scale).clamp(0, 15).to(torch.uint8).view(out_features, -1)
+
+        self.in_features = in_features
+        self.out_features = out_features
+        self.group_size = group_size
+        # 低 4 位存偶数列，高 4 位存奇数列
+        self.register_buffer("packed", (q[:, 0::2] | (q[:, 1::2] << 4)).contiguous())
+        self.register_buffer("scale", scale.squeeze(-1).to(torch.float16))
+        self.register_buffer("w_min", w_min.squeeze(-1).to(torch.float16))
+        if linear.bias is not None:
+            self.register_buffer("bias", linear.bias.detach().float())
+        else:
+            self.bias = None
+
+    def dequantize(self) -> torch.Tensor:
+        q = torch.stack([self.packed & 0xF, self.packed >> 4], dim=-1)
+        q = q.view(self.out_features, -1, self.group_size).float()
+        w = q * self.scale.float().unsqueeze(-1) + self.w_min.float().unsqueeze(-1)
+        return w.view(self.out_features, -1)[:, : self.in_features]
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return F.linear(x, self.dequantize().to(x.dtype), self.bias)
+
+
+def _quant_target_names(model):
+    """需要量化的 Linear 名称（跳过 lm_head）"""
+    return [
+        name for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and not name.endswith("lm_head")
+    ]
+
+
+def quantize_model(model, mode: str):
+    """原地量化（int8 返回新模块树），模型需已在 CPU 且为 fp32"""
+    names = _quant_target_names(model)
+    if mode == "int8":
+        return torch.ao.quantization.quantize_dynamic(model, set(names), dtype=torch.qint8)
+    if mode == "int4":
+        for name in names:
+            parent_name, _, child = name.rpartition(".")
+            parent = model.get_submodule(parent_name)
+            setattr(parent, child, Int4Linear(getattr(parent, child)))
+        return model
+    raise ValueError(f"Unknown quant mode: {mode} (expected one of {QUANT_MODES})")
+
+
+def _weights_fingerprint(path):
+    """权重文件名 + 大小 + 修改时间，任何一个变化都会使缓存失效"""
+    items = []
+    if path and os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith((".safetensors", ".bin", ".json")):
+                st = os.stat(os.path.join(path, name))
+                items.append([name, st.st_size, int(st.st_mtime)])
+    return items
+
+
+def cache_path(src_dir: str, adapter_dir, mode: str) -> str:
+    key = json.dumps(
+        {
+            "src": os.path.abspath(src_dir),
+            "src_files": _weights_fingerprint(src_dir),
+            "adapter": os.path.abspath(adapter_dir) if adapter_dir else None,
+            "adapter_files": _weights_fingerprint(adapter_dir),
+            "mode": mode,
+            "group_size": INT4_GROUP_SIZE,
+            "torch": torch.__version__,
+        },
+        sort_keys=True,
+    )
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(QUANT_CACHE_DIR, f"{os.path.basename(os.path.normpath(src_dir))}-{mode}-{digest}.pt")
+
+
+def load_cached(src_dir: str, adapter_dir, mode: str):
+    path = cache_path(src_dir, adapter_dir, mode)
+    if not os.path.exists(path):
+        return None
+    print(f"📦 Loading quantized model from cache: {path}")
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def save_cache(model, src_dir: str, adapter_dir, mode: str) -> str:
+    path = cache_path(src_dir, adapter_dir, mode)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    torch.save(model, tmp)
+    os.replace(tmp, path)  # 原子替换，避免中断留下半个缓存
+    print(f"💾 Quantized model cached: {path}")
+    return path
+
+
+def rss_mb(field: str = "VmRSS") -> float:
+    """当前（VmRSS）或峰值（VmHWM）常驻内存，单位 MB"""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _response_nll(model, tokenizer, question: str, answer: str):
+    """仅在回答部分计算 NLL，返回 (总 NLL, token 数)"""
+    from batch_predict import build_messages
+    from chat_template import chat_encoder
+
+    prompt_ids = chat_encoder(tokenizer).encode(build_messages(question))
+    answer_ids = tokenizer(answer, add_special_tokens=False)["input_ids"]
+    input_ids = torch.tensor([prompt_ids + answer_ids])
+    labels = torch.tensor([[-100] * len(prompt_ids) + answer_ids])
+    with torch.no_grad():
+        loss = model(input_ids=input_ids, labels=labels).loss
+    n = len(answer_ids)
+    return loss.item() * n, n
+
+
+def evaluate_model(model, tokenizer, rows, max_new_tokens: int = EVAL_MAX_NEW_TOKENS):
+    """困惑度 + eval_auto 规则指标 + 贪心解码吞吐"""
+    from batch_predict import build_messages
+    from chat_template import chat_encoder
+    from eval_auto import evaluate_rows
+
+    total_nll, total_tokens = 0.0, 0
+    for r in rows:
+        nll, n = _response_nll(model, tokenizer, r["input"], r["output"])
+        total_nll += nll
+        total_tokens += n
+
+    preds, new_tokens, gen_time = [], 0, 0.0
+    encoder = chat_encoder(tokenizer)
+    for r in rows:
+        inputs = encoder.inputs(build_messages(r["input"]))
+        start = time.perf_counter()
+        with torch.no_grad():
+            gen = model.generate(
+                inputs.input_ids, attention_mask=inputs.attention_mask,
+                max_new_tokens=max_new_tokens, do_sample=False,
+                eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+            )
+        gen_time += time.perf_counter() - start
+        gen_ids = gen[0][inputs.input_ids.shape[1]:]
+        new_tokens += len(gen_ids)
+        preds.append({"input": r["input"], "output": tokenizer.decode(gen_ids, skip_special_tokens=True)})
+
+    metrics, _ = evaluate_rows(preds)
+    metrics["perplexity"] = round(float(torch.exp(torch.tensor(total_nll / max(total_tokens, 1)))), 4)
+    metrics["tokens_per_sec"] = round(new_tokens / max(gen_time, 1e-9), 2)
+    metrics["rss_mb"] = round(rss_mb(), 1)
+    return metrics
+
+
+def main():
+    from eval_auto import load_jsonl
+    from model_utils import INFER_QUANT, load_model
+
+    mode = INFER_QUANT if INFER_QUANT in QUANT_MODES else "int8"
+    rows = [r for _, r in zip(range(EVAL_SAMPLES), load_jsonl(EVAL_DATA))]
+    print(f"🔍 Calibration set: {EVAL_DATA} ({len(rows)} samples)")
+    paths = {"base_dir": BASE_DIR, "adapter_dir": ADAPTER_DIR} if ADAPTER_DIR else {"model_dir": MODEL_DIR}
+
+    report = {}
+    # 参考：CPU 上 bf16（即当前线上行为）
+    start = time.perf_counter()
+    ref_model, tokenizer = load_model(device="cpu", quant="bf16", **paths)
+    report["bf16"] = {"load_sec": round(time.perf_counter() - start, 2), **evaluate_model(ref_model, tokenizer, rows)}
+    del ref_model
+    gc.collect()
+
+    start = time.perf_counter()
+    q_model, tokenizer = load_model(device="cpu", quant=mode, **paths)
+    report[mode] = {"load_sec": round(time.perf_counter() - start, 2), **evaluate_model(q_model, tokenizer, rows)}
+
+    print(f"\n{'metric':<26}{'bf16':>14}{mode:>14}")
+    for key in report["bf16"]:
+        print(f"{key:<26}{report['bf16'][key]:>14}{report[mode][key]:>14}")
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    out = os.path.join(REPORT_DIR, f"cpu_quant_{mode}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("✅ Report saved:", out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# scripts/curriculum.py
+"""
+RL 提示的在线难度课程：按每个提示的滚动奖励统计决定下一步采样哪些提示，少花算力在已经答好的题上。
+
+- SumTree：数组实现的求和树，单点更新与按权重采样均为 O(log n)，10 万+ 提示也无需每步重算概率表
+- CurriculumSampler：
+    * 每个提示维护 EMA 奖励均值/方差，每个 meta.risk_level 维护聚合统计
+    * 优先级 = (奖励标准差 + low_weight * 归一化的 (R_MAX - 均值) + eps) ^ alpha；
+      未见过的提示取最高优先级，保证先覆盖一遍
+    * uniform_mix 比例的样本均匀采样，避免统计过时的提示被永久冷落
+    * state_dict()/load_state_dict() 可随训练 checkpoint 一起保存
+    * report()：各风险等级奖励统计与每计算小时的奖励提升（reward per compute hour）
+
+环境变量：CURRICULUM=1 启用（train_ppo / train_grpo），CURRICULUM_ALPHA、CURRICULUM_UNIFORM
+
+基准（与每步 np.random.choice(p=...) 的 O(n) 做法对比）：
+    python scripts/curriculum.py 200000
+"""
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 与 RewardEngine 的奖励截断范围一致
+R_MIN, R_MAX = -3.0, 2.0
+
+CURRICULUM = os.environ.get("CURRICULUM", "0") == "1"
+CURRICULUM_ALPHA = float(os.environ.get("CURRICULUM_ALPHA", "1.0"))
+CURRICULUM_UNIFORM = float(os.environ.get("CURRICULUM_UNIFORM", "0.1"))
+
+
+class SumTree:
+    """叶子存权重、内部节点存子树和；capacity 向上取到 2 的幂"""
+
+    def __init__(self, capacity: int):
+        self.capacity = 1
+        while self.capacity < max(capacity, 1):
+            self.capacity *= 2
+        self.size = capacity
+        self.tree = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return float(self.tree[1])
+
+    def get(self, i: int) -> float:
+        return float(self.tree[self.capacity + i])
+
+    def update(self, i: int, weight: float):
+        pos = self.capacity + i
+        delta = weight - self.tree[pos]
+        while pos >= 1:
+            self.tree[pos] += delta
+            pos //= 2
+
+    def fill(self, weights: np.ndarray):
+        """批量初始化：一次自底向上重建，O(n)"""
+        self.tree[:] = 0.0
+        self.tree[self.capacity:self.capacity + len(weights)] = weights
+        for pos in range(self.capacity - 1, 0, -1):
+            self.tree[pos] = self.tree[2 * pos] + self.tree[2 * pos + 1]
+
+    def find(self, u: float) -> int:
+        """返回前缀和首次超过 u 的叶子下标"""
+        pos = 1
+        while pos < self.capacity:
+            left = 2 * pos
+            if u < self.tree[left]:
+                pos = left
+            else:
+                u -= self.tree[left]
+                pos = left + 1
+        return min(pos - self.capacity, self.size - 1)
+
+    def sample(self, k: int, rng: np.random.Generator) -> List[int]:
+        """分层采样 k 个叶子（可能重复）：把 [0, total) 等分成 k 段，每段内均匀取一个点"""
+        seg = self.total / k
+        return [self.find((j + rng.random()) * seg) for j in range(k)]
+
+
+class CurriculumSampler:
+    def __init__(self, risk_levels: Sequence[str], alpha: float = CURRICULUM_ALPHA,
+                 uniform_mix: float = CURRICULUM_UNIFORM, ema: float = 0.3, low_weight: float = 0.5,
+                 eps: float = 0.05, seed: int = 42):
+        n = len(risk_levels)
+        self.risk_levels = list(risk_levels)
+        self.alpha = alpha
+        self.uniform_mix = uniform_mix
+        self.ema = ema
+        self.low_weight = low_weight
+        self.eps = eps
+        self.rng = np.random.default_rng(seed)
+        self.count = np.zeros(n, dtype=np.int32)
+        self.mean = np.zeros(n, dtype=np.float32)
+        self.var = np.zeros(n, dtype=np.float32)
+        self.tree = SumTree(n)
+        self.tree.fill(np.full(n, self.max_priority))
+        # 每个风险等级的聚合统计：[样本数, 奖励和, 奖励平方和]
+        self.level_stats: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+        # 计算开销记录：[(累计秒数, 该步平均奖励)]
+        self.compute_log: List[List[float]] = []
+        self._elapsed = 0.0
+
+    @property
+    def max_priority(self) -> float:
+        return (1.0 + self.low_weight + self.eps) ** self.alpha
+
+    def priority(self, i: int) -> float:
+        low = (R_MAX - float(self.mean[i])) / (R_MAX - R_MIN)
+        return (float(np.sqrt(self.var[i])) + self.low_weight * low + self.eps) ** self.alpha
+
+    # ---- 采样 ----
+    def sample(self, batch_size: int) -> List[int]:
+        """返回 batch_size 个不重复的提示下标"""
+        n = len(self.risk_levels)
+        batch_size = min(batch_size, n)
+        n_uniform = int(self.rng.binomial(batch_size, self.uniform_mix)) if self.uniform_mix > 0 else 0
+        picked = []
+        seen = set()
+        for i in (self.tree.sample(batch_size - n_uniform, self.rng) if batch_size > n_uniform else []):
+            if i not in seen:
+                seen.add(i)
+                picked.append(i)
+        while len(picked) < batch_size:
+            # 均匀部分 + 加权采样撞车时的补齐
+            i = int(self.rng.integers(n))
+            if i not in seen:
+                seen.add(i)
+                picked.append(i)
+        return picked
+
+    # ---- 更新 ----
+    def update(self, indices: Sequence[int], rewards: Sequence[float]):
+        """按顺序喂入 (提示下标, 奖励)；同一提示可出现多次（如 GRPO 的 K 条采样）"""
+        for i, r in zip(indices, rewards):
+            i, r = int(i), float(r)
+            if self.count[i] == 0:
+                self.mean[i] = r
+                stats = self.level_stats.get(self.risk_levels[i])
+                # 首次观测没有方差：用同风险等级的方差作先验，否则取奖励范围的 1/4
+                if stats and stats[0] > 1:
+                    self.var[i] = max(stats[2] / stats[0] - (stats[1] / stats[0]) ** 2, 0.0)
+                else:
+                    self.var[i] = ((R_MAX - R_MIN) / 4) ** 2
+            else:
+                delta = r - self.mean[i]
+                self.mean[i] += self.ema * delta
+                self.var[i] = (1 - self.ema) * (self.var[i] + self.ema * delta * delta)
+            self.count[i] += 1
+            stats = self.level_stats[self.risk_levels[i]]
+            stats[0] += 1
+            stats[1] += r
+            stats[2] += r * r
+        for i in set(int(i) for i in indices):
+            self.tree.update(i, self.priority(i))
+
+    def log_step(self, seconds: float, rewards: Sequence[float]):
+        """记录一步的计算耗时与平均奖励，用于 reward per compute hour"""
+        self._elapsed += seconds
+        self.compute_log.append([self._elapsed, float(np.mean(rewards)) if len(rewards) else 0.0])
+
+    # ---- 报告 ----
+    def report(self, window: int = 20) -> dict:
+        levels = {}
+        for level, (n, s, sq) in sorted(self.level_stats.items()):
+            mean = s / max(n, 1)
+            levels[level] = {
+                "samples": int(n),
+                "prompts_seen": int(sum(1 for i, lv in enumerate(self.risk_levels) if lv == level and self.count[i] > 0)),
+                "mean_reward": round(mean, 3),
+                "reward_std": round(float(np.sqrt(max(sq / max(n, 1) - mean * mean, 0.0))), 3),
+            }
+        out = {
+            "prompts": len(self.risk_levels),
+            "prompts_seen": int((self.count > 0).sum()),
+            "risk_levels": levels,
+        }
+        if len(self.compute_log) >= 2:
+            hours = self._elapsed / 3600
+            w = min(window, len(self.compute_log) // 2)
+            first = np.mean([r for _, r in self.compute_log[:w]])
+            last = np.mean([r for _, r in self.compute_log[-w:]])
+            out["compute_hours"] = round(hours, 4)
+            out["reward_gain"] = round(float(last - first), 4)
+            out["reward_per_compute_hour"] = round(float(last - first) / max(hours, 1e-9), 4)
+        return out
+
+    # ---- checkpoint ----
+    def state_dict(self) -> dict:
+        return {
+            "count": self.count.copy(),
+            "mean": self.mean.copy(),
+            "var": self.var.copy(),
+            "level_stats": {k: list(v) for k, v in self.level_stats.items()},
+            "compute_log": [list(x) for x in self.compute_log],
+            "elapsed": self._elapsed,
+            "rng": self.rng.bit_generator.state,
+        }
+
+    def load_state_dict(self, state: dict):
+        self.count, self.mean, self.var = state["count"].copy(), state["mean"].copy(), state["var"].copy()
+        self.level_stats.clear()
+        self.level_stats.update({k: list(v) for k, v in state["level_stats"].items()})
+        self.compute_log = [list(x) for x in state["compute_log"]]
+        self._elapsed = state["elapsed"]
+        self.rng.bit_generator.state = state["rng"]
+        weights = np.array([self.priority(i) if self.count[i] else self.max_priority for i in range(len(self.count))])
+        self.tree.fill(weights)
+
+
+def make_curriculum(risk_levels: Sequence[str], seed: int = 42) -> Optional[CurriculumSampler]:
+    """CURRICULUM=1 时创建采样器，否则返回 None（保持原有的固定顺序）"""
+    return CurriculumSampler(risk_levels, seed=seed) if CURRICULUM else None
+
+
+def benchmark(n: int, steps: int = 2000, batch_size: int = 8) -> dict:
+    rng = np.random.default_rng(0)
+    levels = rng.choice(["low", "medium", "high", "critical"], size=n).tolist()
+    sampler = CurriculumSampler(levels, uniform_mix=0.0)
+    start = time.perf_counter()
+    for _ in range(steps):
+        idx = sampler.sample(batch_size)
+        sampler.update(idx, rng.uniform(R_MIN, R_MAX, size=len(idx)))
+    tree_sec = time.perf_counter() - start
+
+    weights = np.ones(n)
+    start = time.perf_counter()
+    for _ in range(steps):
+        idx = rng.choice(n, size=batch_size, replace=False, p=weights / weights.sum())
+        weights[idx] = rng.uniform(0.1, 2.0, size=batch_size)
+    naive_sec = time.perf_counter() - start
+    return {
+        "prompts": n,
+        "steps": steps,
+        "sumtree_ms_per_step": round(tree_sec / steps * 1000, 3),
+        "naive_choice_ms_per_step": round(naive_sec / steps * 1000, 3),
+    }
+
+
+if __name__ == "__main__":
+    import json
+
+    print(json.dumps(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000), indent=2))
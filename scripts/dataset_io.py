@@ -0,0 +1,243 @@
+# scripts/dataset_io.py
+"""
+统一数据层：instruction/input/output/meta 记录一次性转成带 schema 的 Parquet，之后各阶段按列读取，
+不再每个脚本各自重新解析 JSONL 文本。
+
+Parquet 列：instruction、input、output、risk_level（即 meta.risk_level，RL 采样常用，单独成列）、
+meta_json（完整 meta 的 JSON 字符串）。逻辑列名 "meta" 在读取时还原为 dict。
+
+- resolve_path(path)：x.jsonl 旁边存在不旧于它的 x.parquet 时返回后者，各脚本据此透明使用 Parquet
+- iter_records / load_records(path, columns)：JSONL 或 Parquet 都可，按列投影返回 dict
+- read_table(path, columns)：pyarrow.Table，Parquet 走内存映射 + 列投影
+- to_hf_dataset(path, columns)：datasets.Dataset，供 Trainer / PPO 使用
+
+pyarrow 只在真正读写 Parquet / 建 Arrow 表时才导入，纯 JSONL 路径（如 eval_auto）不付导入开销。
+
+    python scripts/dataset_io.py convert data/processed/*.jsonl data/rl/training_prompts.jsonl
+    python scripts/dataset_io.py bench data/processed/train.jsonl
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+COLUMNS = ("instruction", "input", "output", "risk_level", "meta_json")
+ROW_GROUP_ROWS = 50_000
+
+
+@lru_cache(maxsize=None)
+def schema() -> "pa.Schema":
+    import pyarrow as pa
+
+    return pa.schema([(name, pa.string()) for name in COLUMNS])
+
+
+def parquet_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".parquet"
+
+
+def resolve_path(path: str) -> str:
+    """优先使用已转换且不旧于源文件的 Parquet"""
+    if path.endswith(".parquet"):
+        return path
+    pq_path = parquet_path(path)
+    if os.path.exists(pq_path) and (not os.path.exists(path) or os.path.getmtime(pq_path) >= os.path.getmtime(path)):
+        return pq_path
+    return path
+
+
+def _to_row(record: Dict) -> Dict:
+    meta = record.get("meta") or {}
+    return {
+        "instruction": record.get("instruction"),
+        "input": record.get("input"),
+        "output": record.get("output"),
+        "risk_level": meta.get("risk_level"),
+        "meta_json": json.dumps(meta, ensure_ascii=False) if meta else None,
+    }
+
+
+def _physical_columns(columns: Optional[List[str]]) -> Optional[List[str]]:
+    if columns is None:
+        return None
+    return list(dict.fromkeys("meta_json" if c == "meta" else c for c in columns))
+
+
+def convert_jsonl(src: str, dst: Optional[str] = None) -> str:
+    """流式转换：每 ROW_GROUP_ROWS 行写一个 row group，内存与文件大小无关"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dst = dst or parquet_path(src)
+    tmp = dst + ".tmp"
+    writer = pq.ParquetWriter(tmp, schema(), compression="zstd")
+    rows = []
+    try:
+        with open(src, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rows.append(_to_row(json.loads(line)))
+                if len(rows) >= ROW_GROUP_ROWS:
+                    writer.write_table(pa.Table.from_pylist(rows, schema=schema()))
+                    rows = []
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema()))
+    finally:
+        writer.close()
+    os.replace(tmp, dst)
+    return dst
+
+
+def _raw_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _jsonl_records(path: str, columns: Optional[List[str]]) -> Iterator[Dict]:
+    for record in _raw_jsonl(path):
+        if columns is None:
+            yield {**record, "risk_level": record.get("risk_level", (record.get("meta") or {}).get("risk_level"))}
+            continue
+        if "risk_level" in columns and "risk_level" not in record:
+            record = {**record, "risk_level": (record.get("meta") or {}).get("risk_level")}
+        yield {c: record.get(c, {} if c == "meta" else None) for c in columns}
+
+
+def iter_records(path: str, columns: Optional[List[str]] = None, batch_size: int = 4096) -> Iterator[Dict]:
+    """逐条返回记录；columns 为逻辑列名（instruction/input/output/risk_level/meta）"""
+    if not path.endswith(".parquet"):
+        yield from _jsonl_records(path, columns)
+        return
+    import pyarrow.parquet as pq
+
+    want_meta = columns is None or "meta" in columns
+    for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_size, columns=_physical_columns(columns)):
+        for row in batch.to_pylist():
+            if want_meta:
+                meta_json = row.pop("meta_json", None)
+                row["meta"] = json.loads(meta_json) if meta_json else {}
+            yield row
+
+
+def select_records(path: str, indices) -> Iterator[Dict]:
+    """按行号（与 read_table / to_hf_dataset 的行序一致）取出完整记录：JSONL 原样返回，Parquet 还原为 JSONL 的记录形式"""
+    wanted = {int(i) for i in indices}
+    if not wanted:
+        return
+    last = max(wanted)
+    if path.endswith(".parquet"):
+        rows = iter_records(path, ["instruction", "input", "output", "meta"])
+    else:
+        rows = _raw_jsonl(path)
+    for i, record in enumerate(rows):
+        if i in wanted:
+            yield record
+        if i >= last:
+            return
+
+
+def write_jsonl(path: str, records) -> int:
+    """原子写出 JSONL（先写 .tmp 再重命名），返回条数"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp, n = path + ".tmp", 0
+    with open(tmp, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            n += 1
+    os.replace(tmp, path)
+    return n
+
+
+def load_records(path: str, columns: Optional[List[str]] = None) -> List[Dict]:
+    return list(iter_records(path, columns))
+
+
+def read_table(path: str, columns: Optional[List[str]] = None) -> "pa.Table":
+    """Parquet：内存映射 + 列投影；JSONL：解析后按 schema() 建表（meta 以 meta_json 列给出）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = _physical_columns(columns)
+    if path.endswith(".parquet"):
+        return pq.read_table(path, columns=columns, memory_map=True)
+    with open(path, "r", encoding="utf-8") as f:
+        table = pa.Table.from_pylist([_to_row(json.loads(line)) for line in f if line.strip()], schema=schema())
+    return table.select(columns) if columns else table
+
+
+def to_hf_dataset(path: str, columns: Optional[List[str]] = None):
+    """datasets.Dataset；Parquet 直接复用 Arrow 表，不经过 pandas"""
+    from datasets import Dataset
+    from datasets.table import InMemoryTable
+
+    return Dataset(InMemoryTable(read_table(path, columns)))
+
+
+# ================= 基准 =================
+LOAD_MODES = ("jsonl_json", "jsonl_pandas", "parquet_full", "parquet_output", "parquet_rl")
+
+
+def _load_once(mode: str, path: str) -> dict:
+    start = time.perf_counter()
+    if mode == "jsonl_json":
+        data = load_records(path)
+    elif mode == "jsonl_pandas":
+        import pandas as pd
+
+        data = pd.read_json(path, lines=True)
+    elif mode == "parquet_full":
+        data = read_table(parquet_path(path))
+    elif mode == "parquet_output":  # eval 只需要 output
+        data = read_table(parquet_path(path), ["output"])
+    else:  # RL 只需要 input 与 risk_level
+        data = read_table(parquet_path(path), ["input", "risk_level"])
+    sec = time.perf_counter() - start
+    with open("/proc/self/status", "r", encoding="utf-8") as f:
+        peak = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:")) / 1024
+    return {"sec": round(sec, 3), "peak_rss_mb": round(peak, 1), "rows": len(data)}
+
+
+def benchmark(path: str) -> dict:
+    """每种读取方式在独立子进程中执行，峰值 RSS 互不影响"""
+    if not os.path.exists(parquet_path(path)):
+        convert_jsonl(path)
+    report = {
+        "jsonl_mb": round(os.path.getsize(path) / 2 ** 20, 1),
+        "parquet_mb": round(os.path.getsize(parquet_path(path)) / 2 ** 20, 1),
+    }
+    for mode in LOAD_MODES:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "_load", mode, path],
+                             capture_output=True, text=True, check=True)
+        report[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+    return report
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("convert", "bench", "_load"):
+        print(__doc__)
+        sys.exit(1)
+    cmd = sys.argv[1]
+    if cmd == "convert":
+        import pyarrow.parquet as pq
+
+        for src in sys.argv[2:]:
+            start = time.perf_counter()
+            dst = convert_jsonl(src)
+            print(f"✅ {src} -> {dst} ({pq.ParquetFile(dst).metadata.num_rows} rows, {time.perf_counter() - start:.1f}s)")
+    elif cmd == "bench":
+        print(json.dumps(benchmark(sys.argv[2]), indent=2))
+    else:
+        print(json.dumps(_load_once(sys.argv[2], sys.argv[3])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# scripts/ddp_sft.py
+"""
+SFT 多进程数据并行（torchrun 启动，NCCL / gloo 梯度 all-reduce），每个 rank 只读取自己那一份预分词数据。
+
+- rank_shard(name, build_fn, key)：每个节点的 local rank 0 调用 build_fn() 得到分词后的数据集，
+  按种子打乱后轮转切成 world_size 份（截到等长，保证各 rank 步数一致）写成 Parquet；
+  其余 rank 等待完成标记后只加载自己的 shard。key（数据/分词配置签名）变化时自动重建
+- ShardedDataMixin：训练 DataLoader 直接遍历本地 shard，不再经过 DistributedSampler / accelerate 二次切分；
+  每个 epoch 所有 rank 用同一种子打乱"批次顺序"，第 t 步各 rank 的批次合起来恰好是单进程同一步的全局批次
+- ddp_training_kwargs()：分布式时给 TrainingArguments 的 ddp_backend / ddp_find_unused_parameters
+- model_device_map()：分布式时不能用 device_map="auto"（由 Trainer 把整模型放到本 rank 的设备）
+
+train_full.py / train_lora.py 在 WORLD_SIZE>1 时自动启用：
+    torchrun --nproc_per_node 8 scripts/train_full.py
+    torchrun --nnodes 2 --node_rank 0 --master_addr <ip> --nproc_per_node 8 scripts/train_full.py
+
+环境变量：DDP_BACKEND（默认 GPU 用 nccl、CPU 用 gloo）、TOKENIZED_DIR（默认 data/tokenized）、SHARD_SEED（默认 42）
+
+CPU/gloo 一致性校验（两 rank × 每卡 2 条 vs 单进程每步 4 条，逐步对比 loss；HF Trainer 与
+chunked_loss.ResponseOnlyTrainer 各跑一遍，两者的 loss 也应一致）：
+    python scripts/ddp_sft.py verify models/Qwen/Qwen3-1.7B
+"""
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from functools import lru_cache
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+DDP_BACKEND = os.environ.get("DDP_BACKEND") or None
+TOKENIZED_DIR = os.environ.get("TOKENIZED_DIR", "data/tokenized")
+SHARD_SEED = int(os.environ.get("SHARD_SEED", "42"))
+SHARD_WAIT_SEC = int(os.environ.get("SHARD_WAIT_SEC", "7200"))
+DONE_FILE = "_SUCCESS"
+
+
+def world_size() -> int:
+    return int(os.environ.get("WORLD_SIZE", "1"))
+
+
+def rank() -> int:
+    return int(os.environ.get("RANK", "0"))
+
+
+def is_distributed() -> bool:
+    return world_size() > 1
+
+
+def model_device_map():
+    return None if is_distributed() else "auto"
+
+
+def ddp_training_kwargs() -> dict:
+    if not is_distributed():
+        return {}
+    # LoRA + 梯度检查点下查找未用参数会报错且多一次图遍历
+    return {"ddp_backend": DDP_BACKEND, "ddp_find_unused_parameters": False}
+
+
+def signature(*parts) -> str:
+    """分片缓存的键：数据文件签名、分词/长度配置等任意可 JSON 化的值"""
+    items = []
+    for p in parts:
+        if isinstance(p, str) and os.path.exists(p):
+            st = os.stat(p)
+            items.append([os.path.abspath(p), st.st_size, int(st.st_mtime)])
+        else:
+            items.append(p)
+    return hashlib.sha1(json.dumps(items, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def shard_indices(n: int, world: int, seed: int = SHARD_SEED):
+    """全局按种子打乱后轮转分配：rank r 得到 order[r::world]，截到等长"""
+    order = list(range(n))
+    random.Random(seed).shuffle(order)
+    per_rank = n // world
+    return [order[r::world][:per_rank] for r in range(world)]
+
+
+def write_shards(ds, out_dir: str, world: int, key: str, seed: int = SHARD_SEED):
+    os.makedirs(out_dir, exist_ok=True)
+    for r, idx in enumerate(shard_indices(len(ds), world, seed)):
+        path = os.path.join(out_dir, f"shard-{r:05d}-of-{world:05d}.parquet")
+        tmp = f"{path}.tmp{os.getpid()}"
+        ds.select(idx).to_parquet(tmp)
+        os.replace(tmp, path)
+    with open(os.path.join(out_dir, DONE_FILE), "w", encoding="utf-8") as f:
+        json.dump({"key": key, "rows": len(ds), "world_size": world, "seed": seed}, f)
+
+
+def _done_key(out_dir: str):
+    try:
+        with open(os.path.join(out_dir, DONE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["key"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def rank_shard(name: str, build_fn, key: str, root: str = TOKENIZED_DIR, seed: int = SHARD_SEED):
+    """返回本 rank 的 datasets.Dataset（仅本 shard 的数据被读取）"""
+    from datasets import Dataset
+
+    world = world_size()
+    out_dir = os.path.join(root, name, f"world{world}")
+    if _done_key(out_dir) != key:
+        if int(os.environ.get("LOCAL_RANK", "0")) == 0:
+            if os.path.exists(os.path.join(out_dir, DONE_FILE)):
+                os.remove(os.path.join(out_dir, DONE_FILE))
+            print(f"🔪 Sharding {name} for {world} ranks -> {out_dir}")
+            write_shards(build_fn(), out_dir, world, key, seed)
+        else:
+            # 用完成标记而不是 barrier：此时进程组可能尚未初始化，且多节点共享存储时同样适用
+            deadline = time.time() + SHARD_WAIT_SEC
+            while _done_key(out_dir) != key:
+                if time.time() > deadline:
+                    raise TimeoutError(f"Timed out waiting for shards in {out_dir}")
+                time.sleep(2)
+    return Dataset.from_parquet(os.path.join(out_dir, f"shard-{rank():05d}-of-{world:05d}.parquet"))
+
+
+class ShardBatchSampler:
+    """本地 shard 按顺序切成批次，批次顺序每个 epoch 以 (seed, epoch) 打乱；各 rank 一致"""
+
+    def __init__(self, n: int, batch_size: int, seed: int = SHARD_SEED, drop_last: bool = True):
+        self.n = n
+        self.batch_size = batch_size
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.n // self.batch_size if self.drop_last else -(-self.n // self.batch_size)
+
+    def __iter__(self):
+        starts = range(0, len(self) * self.batch_size, self.batch_size)
+        batches = [list(range(s, min(s + self.batch_size, self.n))) for s in starts]
+        random.Random(self.seed * 1000003 + self.epoch).shuffle(batches)
+        return iter(batches)
+
+
+@lru_cache(maxsize=None)
+def _epoch_loader_cls():
+    """带 set_epoch 的 DataLoader 子类；torch 延迟导入，分片与批次切分是纯 Python，可在无 torch 的环境中测试"""
+    from torch.utils.data import DataLoader
+
+    class _EpochDataLoader(DataLoader):
+        def set_epoch(self, epoch: int):
+            self.batch_sampler.set_epoch(epoch)
+
+    return _EpochDataLoader
+
+
+class ShardedDataMixin:
+    """混入 transformers.Trainer：train_dataset 是本 rank 的 shard，直接按本地批次遍历"""
+
+    def get_train_dataloader(self):
+        ds = self._remove_unused_columns(self.train_dataset, description="training")
+        return _epoch_loader_cls()(
+            ds,
+            batch_sampler=ShardBatchSampler(len(ds), self._train_batch_size, seed=self.args.seed),
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+
+
+def with_sharded_data(trainer_cls):
+    """分布式时返回 (ShardedDataMixin, trainer_cls) 的子类，否则原样返回"""
+    if not is_distributed():
+        return trainer_cls
+    return type(f"Sharded{trainer_cls.__name__}", (ShardedDataMixin, trainer_cls), {})
+
+
+# ================= 一致性校验 =================
+def _synthetic_dataset(vocab: int, rows: int = 32, seq_len: int = 24, prompt_len: int = 6, seed: int = 0):
+    """等长样本，前 prompt_len 个位置不计 loss：各 rank 的标签 token 数相同，
+    DDP 的梯度平均才与单进程的全局平均一致"""
+    import torch
+    from datasets import Dataset
+
+    g = torch.Generator().manual_seed(seed)
+    ids = torch.randint(0, vocab, (rows, seq_len), generator=g).tolist()
+    labels = [[-100] * prompt_len + row[prompt_len:] for row in ids]
+    return Dataset.from_dict({"input_ids": ids, "attention_mask": [[1] * seq_len] * rows, "labels": labels})
+
+
+def _train_worker(tokenizer_path: str, work: str, global_batch: int, steps: int, loss_kind: str = "hf"):
+    """单进程或 torchrun 下的一个 rank：训练 steps 步，rank 0 把每步 loss 写入 JSON"""
+    from transformers import DataCollatorForSeq2Seq, Trainer, TrainerCallback, TrainingArguments
+    from chunked_loss import ResponseOnlyTrainer
+    from model_utils import tiny_causal_lm
+    from tokenizer_utils import load_tokenizer
+
+    tokenizer = load_tokenizer(tokenizer_path)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    world = world_size()
+    shard = rank_shard("synthetic", lambda: _synthetic_dataset(len(tokenizer)), key="synthetic-v2", root=work)
+    losses = []
+
+    class LossLog(TrainerCallback):
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            if logs and "loss" in logs:
+                losses.append(logs["loss"])
+
+    args = TrainingArguments(
+        output_dir=os.path.join(work, f"out_{loss_kind}_world{world}"), per_device_train_batch_size=global_batch // world,
+        max_steps=steps, learning_rate=1e-3, logging_steps=1, save_strategy="no", report_to="none",
+        use_cpu=True, seed=0, ddp_backend="gloo" if world > 1 else None, disable_tqdm=True,
+    )
+    # 单进程（world=1）同样走分片 DataLoader：全局批次的组成与 2 rank 时逐步相同；
+    # response_only 时 compute_loss 收到的是 DDP 包装，前向必须经过 DDP.forward
+    base_cls = ResponseOnlyTrainer if loss_kind == "response_only" else Trainer
+    trainer = type(f"Sharded{base_cls.__name__}", (ShardedDataMixin, base_cls), {})(
+        model=tiny_causal_lm(tokenizer, seed=0), args=args, train_dataset=shard,
+        data_collator=DataCollatorForSeq2Seq(tokenizer=tokenizer, padding=True), callbacks=[LossLog()],
+    )
+    trainer.train()
+    if rank() == 0:
+        with open(os.path.join(work, f"losses_{loss_kind}_world{world}.json"), "w", encoding="utf-8") as f:
+            json.dump(losses, f)
+
+
+def _compare(name: str, ref, other, steps: int, atol: float) -> bool:
+    diffs = [abs(a - b) for a, b in zip(ref, other)]
+    ok = len(ref) == len(other) == steps and max(diffs) < atol
+    print(f"{'✅' if ok else '❌'} {name}: max diff {max(diffs) if diffs else float('nan'):.2e}")
+    return ok
+
+
+def verify(tokenizer_path: str, steps: int = 6, global_batch: int = 4, atol: float = 1e-4) -> bool:
+    work = tempfile.mkdtemp(prefix="ddp_sft_")
+    env = dict(os.environ, DDP_BACKEND="gloo")
+    curves = {}
+    for loss_kind in ("hf", "response_only"):
+        base = [__file__, "_worker", tokenizer_path, work, str(global_batch), str(steps), loss_kind]
+        subprocess.run([sys.executable] + base, check=True, env=env)
+        subprocess.run([sys.executable, "-m", "torch.distributed.run", "--nproc_per_node", "2",
+                        "--master_port", str(29500 + os.getpid() % 1000)] + base, check=True, env=env)
+        for world in (1, 2):
+            with open(os.path.join(work, f"losses_{loss_kind}_world{world}.json"), "r", encoding="utf-8") as f:
+                curves[loss_kind, world] = json.load(f)
+        for i, (a, b) in enumerate(zip(curves[loss_kind, 1], curves[loss_kind, 2])):
+            print(f"   [{loss_kind}] step {i + 1}: single={a:.6f} ddp2={b:.6f}")
+    checks = [
+        _compare("2-rank gloo vs single-process (HF Trainer)", curves["hf", 1], curves["hf", 2], steps, atol),
+        _compare("2-rank gloo vs single-process (ResponseOnlyTrainer)",
+                 curves["response_only", 1], curves["response_only", 2], steps, atol),
+        _compare("ResponseOnlyTrainer vs HF Trainer (2 ranks)", curves["hf", 2], curves["response_only", 2], steps, atol),
+    ]
+    return all(checks)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "_worker":
+        _train_worker(sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]), sys.argv[6])
+    elif len(sys.argv) > 1 and sys.argv[1] == "verify":
+        sys.exit(0 if verify(sys.argv[2] if len(sys.argv) > 2 else "models/Qwen/Qwen3-1.7B") else 1)
+    else:
+        print(__doc__)
+        sys.exit(1)
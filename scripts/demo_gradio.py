@@ -1,7 +1,13 @@
 # scripts/demo_gradio.py
-import os, re, torch, gradio as gr
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
+import threading, time, gradio as gr
+from model_utils import load_model
+from detokenizer import DeltaStreamer
+from generation import generate, load_speculative_config
+from think_budget import make_think_controller
+from tracing import span
+from chat_template import chat_encoder
+from think_spans import split_think_answer
+from response_cache import log_query, make_response_cache
 
 PROMPT = "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。"
 
@@ -10,42 +16,73 @@ MODEL_DIR = "models/full/final_model"
 IS_LORA = False
 # BASE_DIR = "models/Qwen/Qwen3-1.7B"; ADAPTER_DIR = "models/lora/final_lora"; IS_LORA = True
 
-def load_model():
-    if IS_LORA:
-        base = AutoModelForCausalLM.from_pretrained(BASE_DIR, torch_dtype=torch.bfloat16, device_map="auto", trust_remote_code=True)
-        model = PeftModel.from_pretrained(base, ADAPTER_DIR).eval()
-        tokenizer = AutoTokenizer.from_pretrained(BASE_DIR, use_fast=False, trust_remote_code=True)
-    else:
-        model = AutoModelForCausalLM.from_pretrained(MODEL_DIR, torch_dtype=torch.bfloat16, device_map="auto", trust_remote_code=True).eval()
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR, use_fast=False, trust_remote_code=True)
-    return model, tokenizer
+# 设备/量化由 INFER_DEVICE、INFER_QUANT 控制（见 model_utils.py）
+if IS_LORA:
+    model, tokenizer = load_model(base_dir=BASE_DIR, adapter_dir=ADAPTER_DIR)
+else:
+    model, tokenizer = load_model(model_dir=MODEL_DIR)
+spec = load_speculative_config()  # SPEC_MODE=draft|ngram 时启用投机解码
+controller = make_think_controller(tokenizer)  # THINK_BUDGET>0 时启用思考/回答预算
+cache = make_response_cache()  # RESPONSE_CACHE=1 时重复/近似重复的单轮问题直接返回（命中先经规则引擎复查）
 
-model, tokenizer = load_model()
-
-def split_think_answer(text:str):
-    m = re.search(r"<think>(.*?)</think>\s*(.*)", text, flags=re.S)
-    if not m:
-        return "", text
-    return m.group(1).strip(), m.group(2).strip()
+def format_reply(text:str):
+    think, ans = split_think_answer(text)
+    if think:
+        return f"**思考**：\n{think}\n\n**建议**：\n{ans}"
+    if "<think>" in text:
+        # 流式输出中，思考尚未结束
+        return f"**思考**：\n{text.split('<think>', 1)[1].strip()}"
+    return ans
 
 def respond(message, history):
+    if cache is not None and not history:
+        with span("response_cache"):
+            hit = cache.get(message)
+        if hit is not None:
+            print(f"⚡ Cache {hit.kind} hit (sim={hit.similarity:.3f}): {hit.matched[:40]}")
+            yield format_reply(hit.response)
+            return
     msgs = [{"role":"system","content":PROMPT}]
     for u,b in history:
         msgs += [{"role":"user","content":u},{"role":"assistant","content":b}]
     msgs.append({"role":"user","content":message})
 
-    text = tokenizer.apply_chat_template(msgs, tokenize=False, add_generation_prompt=True)
-    inputs = tokenizer([text], return_tensors="pt").to("cuda")
-    with torch.no_grad():
-        gen = model.generate(
-            inputs.input_ids, max_new_tokens=512, temperature=0.7, top_p=0.9,
-            eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id
-        )
-    out = tokenizer.decode(gen[0][len(inputs.input_ids[0]):], skip_special_tokens=True)
-    think, ans = split_think_answer(out)
-    if think:
-        return f"**思考**：\n{think}\n\n**建议**：\n{ans}"
-    return ans
+    with span("tokenize"):
+        # 系统提示、角色头与历史轮次的 token id 均有缓存，通常只需对本轮问题分词
+        inputs = chat_encoder(tokenizer).inputs(msgs).to(model.device)
+    # 后台线程生成，增量反分词逐段推送到界面
+    streamer = DeltaStreamer(tokenizer)
+    result = {}
+    def run():
+        try:
+            result["ids"], result["stats"] = generate(
+                model, tokenizer, inputs.input_ids, inputs.attention_mask,
+                max_new_tokens=512, temperature=0.7, top_p=0.9, spec=spec,
+                logits_processor=controller, streamer=streamer
+            )
+        except Exception as e:
+            result["error"] = e
+            streamer.end()
+    worker = threading.Thread(target=run)
+    start = time.perf_counter()
+    worker.start()
+    for _ in streamer:
+        yield format_reply(streamer.text)
+    worker.join()
+    if "error" in result:
+        raise result["error"]
+    print("⏱️", result["stats"].summary())
+    if controller is not None:
+        controller.flush()
+        print("🧠", controller.stats.summary())
+    if not history:
+        # 只缓存完整回答：以 EOS 结束（未被 max_new_tokens 截断），且思考段闭合、回答非空（put 内检查）
+        eos = tokenizer.eos_token_id if isinstance(tokenizer.eos_token_id, list) else [tokenizer.eos_token_id]
+        ended_on_eos = bool(result["ids"][0]) and result["ids"][0][-1] in eos
+        if cache is not None:
+            cache.put(message, streamer.text, ended_on_eos)
+        log_query(message, streamer.text, time.perf_counter() - start, ended_on_eos)  # QUERY_LOG 设置时记录，供回放评估
+    yield format_reply(streamer.text)
 
 demo = gr.ChatInterface(
     fn=respond, title="Qwen3 医学助手（微调版）",
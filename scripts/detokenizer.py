@@ -0,0 +1,200 @@
+# scripts/detokenizer.py
+"""
+增量反分词：把逐步生成的新 token 转成文本增量，每步只解码一个小窗口，总代价 O(生成长度)。
+（每步对全部已生成 id 调一次 decode 是 O(n^2)。）
+
+字节级 BPE 中一个汉字（3 字节 UTF-8）可能被拆到多个 token 上：窗口解码结果以 U+FFFD 结尾时
+说明字节不完整，暂不输出，等后续 token 补齐。added token（<think>、<|im_end|> 等）天然是
+字节边界，直接输出其内容并重置窗口；skip_special_tokens=True 时特殊 token 不输出。
+
+- IncrementalDetokenizer：核心状态机，add(ids) -> 文本增量，finish() 输出残余
+- DeltaStreamer：HF generate / generation.generate 的 streamer，可迭代得到文本增量
+
+基准（线性 vs 二次）与一致性校验：
+    python scripts/detokenizer.py models/Qwen/Qwen3-1.7B data/processed/train.jsonl
+"""
+import json
+import queue
+import sys
+import time
+
+from transformers.generation.streamers import BaseStreamer
+
+from tracing import span
+
+WINDOW_TRIM = 64  # prefix_offset 超过该值时丢弃前面的 token 字符串，保持窗口有界
+
+
+class IncrementalDetokenizer:
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.special_ids = set(tokenizer.all_special_ids)
+        self.added = {tid: tok.content for tid, tok in tokenizer.added_tokens_decoder.items()}
+        self._tokens = []        # 当前窗口内的 token 字符串
+        self._prefix_offset = 0  # 已输出文本对应窗口的起点
+        self._read_offset = 0    # 已输出到的位置
+        self._pieces = []        # 已输出的文本片段（避免字符串反复拼接）
+
+    @property
+    def text(self) -> str:
+        return "".join(self._pieces)
+
+    def _emit(self, delta: str) -> str:
+        if delta:
+            self._pieces.append(delta)
+        return delta
+
+    def _decode_window(self) -> str:
+        convert = self.tokenizer.convert_tokens_to_string
+        prefix_text = convert(self._tokens[self._prefix_offset:self._read_offset])
+        new_text = convert(self._tokens[self._prefix_offset:])
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(self._tokens)
+            if self._prefix_offset > WINDOW_TRIM:
+                self._tokens = self._tokens[self._prefix_offset:]
+                self._read_offset -= self._prefix_offset
+                self._prefix_offset = 0
+            return new_text[len(prefix_text):]
+        return ""
+
+    def _flush_window(self) -> str:
+        """输出窗口中尚未输出的部分（可能含不完整字节的替换字符），并清空窗口"""
+        delta = ""
+        if self._read_offset < len(self._tokens):
+            convert = self.tokenizer.convert_tokens_to_string
+            prefix_text = convert(self._tokens[self._prefix_offset:self._read_offset])
+            delta = convert(self._tokens[self._prefix_offset:])[len(prefix_text):]
+        self._tokens, self._prefix_offset, self._read_offset = [], 0, 0
+        return delta
+
+    def add(self, ids) -> str:
+        """追加新 token id（int 或可迭代），返回可安全输出的文本增量"""
+        if isinstance(ids, int):
+            ids = [ids]
+        out = []
+        for tid in ids:
+            tid = int(tid)
+            if tid in self.special_ids and self.skip_special_tokens:
+                continue
+            if tid in self.added:
+                out.append(self._flush_window())
+                out.append(self.added[tid])
+                continue
+            self._tokens.append(self.tokenizer.convert_ids_to_tokens(tid))
+            out.append(self._decode_window())
+        return self._emit("".join(out))
+
+    def finish(self) -> str:
+        return self._emit(self._flush_window())
+
+
+class DeltaStreamer(BaseStreamer):
+    """
+    generate 的 streamer：第一次 put 为提示（跳过），之后每次 put 新 token。
+    传 on_text 时同步回调文本增量；否则可在另一个线程中迭代本对象获取增量。
+    """
+
+    def __init__(self, tokenizer, skip_prompt: bool = True, on_text=None, skip_special_tokens: bool = True):
+        self.detok = IncrementalDetokenizer(tokenizer, skip_special_tokens=skip_special_tokens)
+        self.skip_prompt = skip_prompt
+        self.on_text = on_text
+        self._prompt_seen = False
+        self._queue = queue.Queue()
+
+    @property
+    def text(self) -> str:
+        return self.detok.text
+
+    def _deliver(self, delta: str):
+        if not delta:
+            return
+        if self.on_text is not None:
+            self.on_text(delta)
+        else:
+            self._queue.put(delta)
+
+    def put(self, value):
+        if self.skip_prompt and not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        ids = value.reshape(-1).tolist() if hasattr(value, "reshape") else list(value)
+        with span("detokenize"):
+            delta = self.detok.add(ids)
+        self._deliver(delta)
+
+    def end(self):
+        with span("detokenize"):
+            delta = self.detok.finish()
+        self._deliver(delta)
+        if self.on_text is None:
+            self._queue.put(None)
+
+    def __iter__(self):
+        while True:
+            delta = self._queue.get()
+            if delta is None:
+                return
+            yield delta
+
+
+def decode_batch(tokenizer, sequences, skip_special_tokens: bool = True):
+    """非流式的整段解码（如 PPO rollout）：一次批量 decode 即为线性，直接走 fast tokenizer"""
+    return tokenizer.batch_decode(sequences, skip_special_tokens=skip_special_tokens)
+
+
+def benchmark(tokenizer, ids, checkpoints=(512, 1024, 1536, 2048)) -> dict:
+    """逐 token 流式输出：每步全量 decode vs 增量反分词，记录各检查点的累计耗时"""
+    report = {"tokens": len(ids), "naive": {}, "incremental": {}}
+
+    start = time.perf_counter()
+    prev = ""
+    for i in range(1, len(ids) + 1):
+        text = tokenizer.decode(ids[:i], skip_special_tokens=True)
+        prev = text
+        if i in checkpoints:
+            report["naive"][i] = round(time.perf_counter() - start, 4)
+
+    detok = IncrementalDetokenizer(tokenizer)
+    start = time.perf_counter()
+    for i, tid in enumerate(ids, 1):
+        detok.add(tid)
+        if i in checkpoints:
+            report["incremental"][i] = round(time.perf_counter() - start, 4)
+    detok.finish()
+    report["identical"] = detok.text == prev
+    return report
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    from dataset_io import iter_records, resolve_path
+    from tokenizer_utils import load_tokenizer
+
+    tokenizer = load_tokenizer(sys.argv[1])
+    texts = [r["output"] for r in iter_records(resolve_path(sys.argv[2]), columns=["output"])]
+
+    # 一致性：逐 token 增量输出拼起来应与一次性 decode 相同
+    mismatches = 0
+    for text in texts[:500]:
+        ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+        detok = IncrementalDetokenizer(tokenizer)
+        for tid in ids:
+            detok.add(tid)
+        detok.finish()
+        mismatches += int(detok.text != tokenizer.decode(ids, skip_special_tokens=True))
+    print(f"{'✅' if mismatches == 0 else '❌'} Incremental == full decode on {min(len(texts), 500)} samples ({mismatches} mismatches)")
+
+    ids = []
+    for text in texts:
+        ids += tokenizer(text, add_special_tokens=False)["input_ids"]
+        if len(ids) >= 2048:
+            break
+    print(json.dumps(benchmark(tokenizer, ids[:2048]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+# scripts/fast_eval.py
+"""
+训练中的快速评估（train_full 用）：固定的分层 dev 子集 + 按长度分桶的批次，只在里程碑步跑全量。
+
+原先每 eval_steps 都以 batch=1 跑完整个 dev，load_best_model_at_end 又依赖这个评估，评估时间可与训练相当。这里：
+- 分层：dev 样本按 (meta.risk_level, 长度分位档 FAST_EVAL_LENGTH_BINS) 分层，按比例分配 FAST_EVAL_SIZE 条
+  （每层至少 2 条以便估计方差），以固定种子抽样，整个训练过程中子集不变，各次评估可直接比较
+- 批次：按长度降序贪心装箱，每批 padding 后 token 数不超过 FAST_EVAL_TOKENS；no_grad 下跑骨干网络，
+  每条样本用 chunked_lm_loss 单独算 loss（与 batch=1 时 HF 的 eval_loss 定义一致：对样本取平均）
+- 估计：分层估计量 Σ W_h·mean_h，方差 Σ W_h²·s_h²/n_h·(1 - n_h/N_h)，给出 95% 置信区间半宽 eval_loss_ci95
+- 里程碑（默认每个 save_steps，即 load_best_model_at_end 比较的那些步；FAST_EVAL_FULL_EVERY 可改）跑全量
+  （同样分桶、no_grad），eval_loss 为全量值，同时报告子集估计、区间以及全量值是否落在区间内
+每次评估追加到 <output_dir>/fast_eval.jsonl。多进程时各 rank 分担批次后汇总。
+
+环境变量：FAST_EVAL=1 启用，FAST_EVAL_SIZE（默认 256），FAST_EVAL_FULL_EVERY（默认 0 = save_steps），
+         FAST_EVAL_TOKENS（默认 16384），FAST_EVAL_LENGTH_BINS（默认 4），FAST_EVAL_SEED（默认 42）
+
+全量 vs 子集对比（耗时、区间、多个种子下区间的覆盖率）：
+    python scripts/fast_eval.py models/full/final_model [data/processed/dev.jsonl]
+"""
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    import torch
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+FAST_EVAL = os.environ.get("FAST_EVAL", "0") == "1"
+FAST_EVAL_SIZE = int(os.environ.get("FAST_EVAL_SIZE", "256"))
+FAST_EVAL_FULL_EVERY = int(os.environ.get("FAST_EVAL_FULL_EVERY", "0"))
+FAST_EVAL_TOKENS = int(os.environ.get("FAST_EVAL_TOKENS", "16384"))
+FAST_EVAL_LENGTH_BINS = int(os.environ.get("FAST_EVAL_LENGTH_BINS", "4"))
+FAST_EVAL_SEED = int(os.environ.get("FAST_EVAL_SEED", "42"))
+Z95 = 1.96
+
+
+def eval_columns() -> List[str]:
+    """dev 数据需要读取的列：快速评估要 risk_level 分层"""
+    return ["input", "output", "risk_level"] if FAST_EVAL else ["input", "output"]
+
+
+# ================= 分层抽样与估计 =================
+def assign_strata(lengths: Sequence[int], risk_levels: Sequence[Optional[str]], bins: int = FAST_EVAL_LENGTH_BINS) -> List[str]:
+    ordered = sorted(lengths)
+    edges = [ordered[min(len(ordered) - 1, len(ordered) * b // bins)] for b in range(1, bins)]
+    return [f"{risk or 'unknown'}|L{sum(n >= e for e in edges)}" for n, risk in zip(lengths, risk_levels)]
+
+
+def stratified_subset(strata: Sequence[str], size: int, seed: int = FAST_EVAL_SEED) -> List[int]:
+    """按层比例分配（最大余数法），每层至少 min(2, N_h) 条；返回排序后的下标"""
+    groups = defaultdict(list)
+    for i, h in enumerate(strata):
+        groups[h].append(i)
+    n = len(strata)
+    if size >= n:
+        return list(range(n))
+    quota = {h: size * len(idx) / n for h, idx in groups.items()}
+    alloc = {h: int(q) for h, q in quota.items()}
+    for h in sorted(quota, key=lambda h: alloc[h] - quota[h])[:size - sum(alloc.values())]:
+        alloc[h] += 1
+    rng = random.Random(seed)
+    chosen = []
+    for h in sorted(groups):
+        idx = groups[h]
+        chosen += rng.sample(idx, min(len(idx), max(alloc[h], 2)))
+    return sorted(chosen)
+
+
+def stratified_estimate(losses: Dict[int, float], strata: Sequence[str]) -> dict:
+    """losses 为子集下标 -> 样本 loss；返回分层均值估计与 95% 区间半宽"""
+    population = defaultdict(int)
+    for h in strata:
+        population[h] += 1
+    sampled = defaultdict(list)
+    for i, v in losses.items():
+        sampled[strata[i]].append(v)
+    n_total = len(strata)
+    mean = var = 0.0
+    for h, values in sampled.items():
+        w = population[h] / n_total
+        m = sum(values) / len(values)
+        s2 = sum((v - m) ** 2 for v in values) / (len(values) - 1) if len(values) > 1 else 0.0
+        mean += w * m
+        var += w * w * s2 / len(values) * (1 - len(values) / population[h])
+    return {"loss": mean, "ci95": Z95 * math.sqrt(var), "n": len(losses), "strata": len(sampled)}
+
+
+# ================= 批次与逐样本 loss =================
+def length_buckets(indices: Sequence[int], lengths: Sequence[int], max_tokens: int = FAST_EVAL_TOKENS) -> List[List[int]]:
+    """按长度降序贪心装箱：批内 padding 后 token 数（条数 × 最长）不超过 max_tokens"""
+    batches, current = [], []
+    for i in sorted(indices, key=lambda i: -lengths[i]):
+        if current and (len(current) + 1) * lengths[current[0]] > max_tokens:
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+# torch / chunked_loss 只在真正跑模型时导入：分层抽样与分桶是纯 Python，可在无 torch 的环境中测试
+def _pad(rows: List[List[int]], value: int) -> "torch.Tensor":
+    import torch
+
+    width = max(len(r) for r in rows)
+    return torch.tensor([r + [value] * (width - len(r)) for r in rows], dtype=torch.long)
+
+
+def per_sample_losses(model, dataset, batches: List[List[int]], device) -> Dict[int, float]:
+    import torch
+    from chunked_loss import IGNORE_INDEX, chunked_lm_loss
+
+    base = model.get_base_model() if hasattr(model, "get_base_model") else model
+    backbone, lm_head = base.get_decoder(), base.get_output_embeddings()
+    out = {}
+    with torch.no_grad():
+        for batch in batches:
+            rows = dataset.select(batch)
+            input_ids = _pad(rows["input_ids"], 0).to(device)
+            labels = _pad(rows["labels"], IGNORE_INDEX).to(device)
+            attention_mask = _pad(rows["attention_mask"], 0).to(device)
+            hidden = backbone(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).last_hidden_state
+            for j, i in enumerate(batch):
+                n = int(attention_mask[j].sum())
+                out[i] = float(chunked_lm_loss(hidden[j:j + 1, :n], lm_head, labels[j:j + 1, :n]))
+    return out
+
+
+def _gather(local: Dict[int, float]) -> Dict[int, float]:
+    import torch
+
+    if not (torch.distributed.is_available() and torch.distributed.is_initialized()):
+        return local
+    parts = [None] * torch.distributed.get_world_size()
+    torch.distributed.all_gather_object(parts, local)
+    merged = {}
+    for p in parts:
+        merged.update(p)
+    return merged
+
+
+class FastEvaluator:
+    def __init__(self, dataset, size: int = FAST_EVAL_SIZE, seed: int = FAST_EVAL_SEED, max_tokens: int = FAST_EVAL_TOKENS):
+        self.lengths = [len(x) for x in dataset["input_ids"]]
+        risks = dataset["risk_level"] if "risk_level" in dataset.column_names else [None] * len(self.lengths)
+        self.strata = assign_strata(self.lengths, risks)
+        self.subset = stratified_subset(self.strata, size, seed)
+        self.max_tokens = max_tokens
+        self.dataset = dataset.select_columns(["input_ids", "attention_mask", "labels"])
+
+    def losses(self, model, indices: Sequence[int], device) -> Dict[int, float]:
+        import torch
+
+        batches = length_buckets(indices, self.lengths, self.max_tokens)
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            batches = batches[torch.distributed.get_rank()::torch.distributed.get_world_size()]
+        was_training = model.training
+        model.eval()
+        try:
+            return _gather(per_sample_losses(model, self.dataset, batches, device))
+        finally:
+            model.train(was_training)
+
+    def run(self, model, device, full: bool = False) -> dict:
+        start = time.perf_counter()
+        if full:
+            losses = self.losses(model, range(len(self.lengths)), device)
+            est = stratified_estimate({i: losses[i] for i in self.subset}, self.strata)
+            full_loss = sum(losses.values()) / len(losses)
+            result = {"loss": full_loss, "full": True, "subset_loss": est["loss"], "subset_ci95": est["ci95"],
+                      "subset_covered": abs(full_loss - est["loss"]) <= est["ci95"]}
+        else:
+            est = stratified_estimate(self.losses(model, self.subset, device), self.strata)
+            result = {"loss": est["loss"], "ci95": est["ci95"], "full": False}
+        result.update({"subset_size": len(self.subset), "rows": len(self.lengths),
+                       "runtime": time.perf_counter() - start})
+        return result
+
+
+class FastEvalMixin:
+    """混入 transformers.Trainer：默认 dev 评估改为分层子集，里程碑步跑全量"""
+
+    _fast_evaluator = None
+
+    def _is_full_eval_step(self) -> bool:
+        every = FAST_EVAL_FULL_EVERY or self.args.save_steps
+        step = self.state.global_step
+        return step % every == 0 or step >= self.state.max_steps
+
+    def evaluate(self, eval_dataset=None, ignore_keys=None, metric_key_prefix: str = "eval"):
+        if eval_dataset is not None:
+            return super().evaluate(eval_dataset, ignore_keys, metric_key_prefix)
+        if self._fast_evaluator is None:
+            self._fast_evaluator = FastEvaluator(self.eval_dataset)
+        result = self._fast_evaluator.run(self.model, self.args.device, full=self._is_full_eval_step())
+        p = metric_key_prefix
+        metrics = {f"{p}_loss": round(result["loss"], 6), f"{p}_runtime": round(result["runtime"], 3),
+                   f"{p}_subset_size": result["subset_size"], f"{p}_full": int(result["full"])}
+        if result["full"]:
+            metrics.update({f"{p}_subset_loss": round(result["subset_loss"], 6),
+                            f"{p}_subset_ci95": round(result["subset_ci95"], 6),
+                            f"{p}_subset_covered": int(result["subset_covered"])})
+        else:
+            metrics[f"{p}_loss_ci95"] = round(result["ci95"], 6)
+        self.log(metrics)
+        if self.is_world_process_zero():
+            with open(os.path.join(self.args.output_dir, "fast_eval.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"step": self.state.global_step, **metrics}) + "\n")
+        self.control = self.callback_handler.on_evaluate(self.args, self.state, self.control, metrics)
+        return metrics
+
+
+def with_fast_eval(trainer_cls):
+    """FAST_EVAL=1 时返回 (FastEvalMixin, trainer_cls) 的子类，否则原样返回"""
+    if not FAST_EVAL:
+        return trainer_cls
+    return type(f"FastEval{trainer_cls.__name__}", (FastEvalMixin, trainer_cls), {})
+
+
+# ================= 对比 =================
+def _tokenize(tokenizer, prompt: str, user_input: str, output: str, max_length: int) -> dict:
+    """与 train_full.process_func 相同的分词与标签"""
+    from chat_template import chat_encoder
+    from chunked_loss import IGNORE_INDEX
+
+    instr = chat_encoder(tokenizer).encode([{"role": "system", "content": prompt}, {"role": "user", "content": user_input}])
+    resp = tokenizer(output, add_special_tokens=False)["input_ids"]
+    input_ids = (instr + resp + [tokenizer.pad_token_id])[:max_length]
+    labels = ([IGNORE_INDEX] * len(instr) + resp + [tokenizer.pad_token_id])[:max_length]
+    return {"input_ids": input_ids, "attention_mask": [1] * len(input_ids), "labels": labels}
+
+
+def benchmark(model_dir: str, dev_path: str = "data/processed/dev.jsonl", size: int = FAST_EVAL_SIZE,
+              prompt: str = "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。", max_length: int = 2048,
+              seeds: int = 20) -> dict:
+    import torch
+    from dataset_io import resolve_path, to_hf_dataset
+    from model_utils import load_model
+
+    model, tokenizer = load_model(model_dir=model_dir)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    raw = to_hf_dataset(resolve_path(dev_path), columns=["input", "output", "risk_level"])
+    ds = raw.map(lambda x: _tokenize(tokenizer, prompt, x["input"], x["output"] or "", max_length),
+                 remove_columns=["input", "output"])
+    device = model.device
+    evaluator = FastEvaluator(ds, size=size)
+
+    # 原方式：batch=1 逐条 model(**batch).loss，只在子集上计时，按条数外推到全量
+    start = time.perf_counter()
+    with torch.no_grad():
+        for i in evaluator.subset:
+            row = ds[i]
+            model(**{k: torch.tensor([row[k]], device=device) for k in ("input_ids", "attention_mask", "labels")})
+    bs1_sec = (time.perf_counter() - start) / len(evaluator.subset) * len(ds)
+
+    start = time.perf_counter()
+    losses = evaluator.losses(model, range(len(ds)), device)
+    full_sec = time.perf_counter() - start
+    subset = evaluator.run(model, device, full=False)
+    full_loss = sum(losses.values()) / len(losses)
+    covered = 0
+    for seed in range(seeds):
+        est = stratified_estimate({i: losses[i] for i in stratified_subset(evaluator.strata, size, seed)}, evaluator.strata)
+        covered += abs(full_loss - est["loss"]) <= est["ci95"]
+    report = {
+        "rows": len(ds), "subset_size": len(evaluator.subset), "strata": len(set(evaluator.strata)),
+        "full_bs1_sec_est": round(bs1_sec, 2),
+        "full_bucketed_sec": round(full_sec, 2),
+        "subset_sec": round(subset["runtime"], 2),
+        "full_loss": round(full_loss, 5),
+        "subset_loss": round(subset["loss"], 5), "subset_ci95": round(subset["ci95"], 5),
+        "ci_coverage": f"{covered}/{seeds}",
+    }
+    print(json.dumps(report, indent=2))
+    print(f"✅ subset eval {bs1_sec / max(subset['runtime'], 1e-9):.1f}× faster than batch=1 full eval, "
+          f"|full - subset| = {abs(full_loss - subset['loss']):.4f} (ci95 ±{subset['ci95']:.4f})")
+    os.makedirs("eval_report", exist_ok=True)
+    with open(os.path.join("eval_report", "fast_eval_bench.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    benchmark(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "data/processed/dev.jsonl")
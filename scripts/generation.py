@@ -0,0 +1,370 @@
+# scripts/generation.py
+"""
+共用生成入口：batch_predict / demo_gradio / train_lora.predict 都走 generate()。
+
+可选投机解码（speculative decoding），单条请求（batch=1）生效：
+- draft：小模型（如 Qwen3-0.6B，需与目标模型同词表）自回归起草 k 个 token
+- ngram：prompt lookup，在已有上下文中查找与末尾 n-gram 相同的片段，直接拿后续 token 作为草稿
+目标模型一次前向校验全部草稿：
+- 贪心：逐位比较 argmax，输出与普通贪心解码逐 token 一致
+- 采样：标准拒绝采样（接受概率 min(1, p/q)，拒绝时从 max(0, p-q) 重采样），输出分布与直接采样一致
+
+环境变量：SPEC_MODE=none|draft|ngram，SPEC_DRAFT_MODEL=<路径>，SPEC_NUM_TOKENS=4，SPEC_NGRAM=3
+
+直接运行可在 CPU 上用小模型对比普通解码与投机解码（一致性、接受率、加速比）：
+    SPEC_TARGET=models/Qwen/Qwen3-1.7B SPEC_MODE=draft SPEC_DRAFT_MODEL=models/Qwen/Qwen3-0.6B python scripts/generation.py
+    SPEC_TARGET=<任意小模型> SPEC_MODE=ngram python scripts/generation.py
+"""
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import torch
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+import tracing
+
+
+@dataclass
+class SpeculativeConfig:
+    mode: str = "none"              # none | draft | ngram
+    draft_model: Optional[object] = None
+    num_draft_tokens: int = 4
+    ngram_size: int = 3
+
+
+@dataclass
+class GenerationStats:
+    new_tokens: int = 0
+    seconds: float = 0.0
+    target_forwards: int = 0        # 目标模型前向次数（普通解码 = new_tokens）
+    drafted: int = 0
+    accepted: int = 0
+    extra: dict = field(default_factory=dict)
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / max(self.drafted, 1)
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.new_tokens / max(self.seconds, 1e-9)
+
+    def summary(self) -> str:
+        text = f"{self.new_tokens} tokens in {self.seconds:.2f}s ({self.tokens_per_sec:.1f} tok/s)"
+        if self.drafted:
+            text += (
+                f", accept {self.accepted}/{self.drafted} ({self.acceptance_rate:.1%}),"
+                f" {self.new_tokens / max(self.target_forwards, 1):.2f} tokens/forward"
+            )
+        return text
+
+
+class _PhaseTimer:
+    """
+    包在 streamer 外层：第一次 put 是提示，第二次 put 是首个新 token，据此把生成切分为 prefill / decode。
+    仅 TRACE=1 时使用。
+    """
+
+    def __init__(self, streamer):
+        self.streamer = streamer
+        self.first_token_at = None
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen:
+            self._prompt_seen = True
+        elif self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if self.streamer is not None:
+            self.streamer.put(value)
+
+    def end(self):
+        if self.streamer is not None:
+            self.streamer.end()
+
+    def record(self, start: float, end: float, prompt_tokens: int, new_tokens: int):
+        first = self.first_token_at or end
+        tracing.record("prefill", start, first, prompt_tokens=prompt_tokens)
+        tracing.record("decode", first, end, new_tokens=new_tokens)
+
+
+def load_speculative_config(device=None) -> SpeculativeConfig:
+    """从环境变量构造投机解码配置；draft 模式会加载草稿模型"""
+    mode = os.environ.get("SPEC_MODE", "none")
+    config = SpeculativeConfig(
+        mode=mode,
+        num_draft_tokens=int(os.environ.get("SPEC_NUM_TOKENS", "4")),
+        ngram_size=int(os.environ.get("SPEC_NGRAM", "3")),
+    )
+    if mode == "draft":
+        from model_utils import load_model
+
+        config.draft_model, _ = load_model(model_dir=os.environ["SPEC_DRAFT_MODEL"], device=device)
+    return config
+
+
+def _warp(logits: torch.Tensor, temperature: float, top_p: float, top_k: int = 0) -> torch.Tensor:
+    """temperature + top-k + top-p 之后的概率分布（顺序与 HF 一致；草稿与目标必须用同一变换）"""
+    logits = logits.float() / max(temperature, 1e-5)
+    if top_k and top_k < logits.size(-1):
+        kth = torch.topk(logits, top_k)[0][..., -1, None]
+        logits = logits.masked_fill(logits < kth, -float("inf"))
+    if 0 < top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, descending=True)
+        cum = torch.softmax(sorted_logits, dim=-1).cumsum(dim=-1)
+        remove = cum > top_p
+        remove[..., 1:] = remove[..., :-1].clone()
+        remove[..., 0] = False
+        logits = logits.masked_fill(remove.scatter(-1, sorted_idx, remove), -float("inf"))
+    return torch.softmax(logits, dim=-1)
+
+
+def _forward(model, cache, seq: List[int], n_logits: int) -> torch.Tensor:
+    """
+    用 KV cache 前向 seq，返回最后 n_logits 个位置的 logits。
+    cache 中超出 len(seq) - n_logits 的部分（被拒绝的草稿）会先裁掉。
+    """
+    keep = min(cache.get_seq_length(), len(seq) - n_logits)
+    cache.crop(keep)
+    inp = torch.tensor([seq[keep:]], device=model.device)
+    with torch.no_grad():
+        out = model(input_ids=inp, past_key_values=cache, use_cache=True)
+    return out.logits[0, -n_logits:]
+
+
+def _draft_ngram(ids: List[int], k: int, ngram_size: int) -> List[int]:
+    """prompt lookup：从最长 n-gram 开始，找末尾片段最近一次出现的位置，返回其后 k 个 token"""
+    for n in range(min(ngram_size, len(ids) - 1), 0, -1):
+        tail = ids[-n:]
+        for start in range(len(ids) - n - 1, -1, -1):
+            if ids[start:start + n] == tail:
+                return ids[start + n:start + n + k]
+    return []
+
+
+def _draft_with_model(draft_model, cache, ids, k, do_sample, temperature, top_p, top_k):
+    seq = list(ids)
+    qs = []
+    for _ in range(k):
+        row = _forward(draft_model, cache, seq, 1)[0]
+        if do_sample:
+            q = _warp(row, temperature, top_p, top_k)
+            tok = int(torch.multinomial(q, 1))
+            qs.append(q)
+        else:
+            tok = int(row.argmax())
+        seq.append(tok)
+    return seq[len(ids):], (qs if do_sample else None)
+
+
+def speculative_generate(
+    model, input_ids, max_new_tokens, eos_token_ids, spec: SpeculativeConfig,
+    do_sample=False, temperature=0.7, top_p=0.9, top_k=0, logits_processor=None, streamer=None,
+):
+    """batch=1 的投机解码，返回 (新生成 token 列表, GenerationStats)"""
+    from transformers import DynamicCache
+
+    stats = GenerationStats()
+    start = time.perf_counter()
+    ids = input_ids[0].tolist()
+    prompt_len = len(ids)
+    eos = set(eos_token_ids)
+    cache = DynamicCache()
+    draft_cache = DynamicCache() if spec.mode == "draft" else None
+    if streamer is not None:
+        streamer.put(input_ids[0].cpu())
+
+    while len(ids) - prompt_len < max_new_tokens:
+        # 给 bonus token 留一个位置，避免超过 max_new_tokens
+        k = min(spec.num_draft_tokens, max_new_tokens - (len(ids) - prompt_len) - 1)
+        qs = None
+        if k <= 0:
+            drafts = []
+        elif spec.mode == "draft":
+            drafts, qs = _draft_with_model(spec.draft_model, draft_cache, ids, k, do_sample, temperature, top_p, top_k)
+        else:
+            drafts = _draft_ngram(ids, k, spec.ngram_size)
+
+        logits = _forward(model, cache, ids + drafts, len(drafts) + 1)
+        stats.target_forwards += 1
+        stats.drafted += len(drafts)
+
+        accepted = []
+        for i in range(len(drafts) + 1):
+            row = logits[i:i + 1]
+            if logits_processor is not None:
+                prefix = torch.tensor([ids + accepted], device=row.device)
+                row = logits_processor(prefix, row)
+            row = row[0]
+            is_bonus = i == len(drafts)
+            if not do_sample:
+                tok = int(row.argmax())
+                accepted.append(tok)
+                if is_bonus or tok != drafts[i]:
+                    break
+                stats.accepted += 1
+                continue
+
+            p = _warp(row, temperature, top_p, top_k)
+            if is_bonus:
+                accepted.append(int(torch.multinomial(p, 1)))
+                break
+            d = drafts[i]
+            # ngram 草稿是确定性的，相当于 q 为 one-hot
+            q_d = qs[i][d] if qs is not None else 1.0
+            if torch.rand(()) < min(1.0, float(p[d] / max(q_d, 1e-12))):
+                accepted.append(d)
+                stats.accepted += 1
+                continue
+            if qs is not None:
+                residual = (p - qs[i]).clamp(min=0)
+            else:
+                residual = p.clone()
+                residual[d] = 0
+            if residual.sum() <= 0:
+                residual = p
+            accepted.append(int(torch.multinomial(residual / residual.sum(), 1)))
+            break
+
+        for j, tok in enumerate(accepted):
+            if tok in eos:
+                accepted = accepted[:j + 1]
+                break
+        ids.extend(accepted)
+        if streamer is not None:
+            streamer.put(torch.tensor(accepted))
+        if accepted[-1] in eos:
+            break
+
+    if streamer is not None:
+        streamer.end()
+    new_ids = ids[prompt_len:prompt_len + max_new_tokens]
+    stats.new_tokens = len(new_ids)
+    stats.seconds = time.perf_counter() - start
+    return new_ids, stats
+
+
+def generate(
+    model, tokenizer, input_ids, attention_mask=None, max_new_tokens=512,
+    do_sample=None, temperature=None, top_p=None, top_k=None,
+    spec: Optional[SpeculativeConfig] = None, logits_processor=None, streamer=None,
+):
+    """
+    统一生成入口，返回 (每条样本新生成 token id 列表, GenerationStats)。
+    spec 为空或 mode=none 时等价于原先的 model.generate 调用；
+    未显式给出的采样参数沿用模型 generation_config（与 model.generate 行为一致）。
+    streamer（如 detokenizer.DeltaStreamer，仅 batch=1）会逐步收到新 token，用于流式输出。
+    """
+    gen_cfg = getattr(model, "generation_config", None)
+    if do_sample is None:
+        do_sample = bool(getattr(gen_cfg, "do_sample", False))
+    if temperature is None:
+        temperature = getattr(gen_cfg, "temperature", None) or 1.0
+    if top_p is None:
+        top_p = getattr(gen_cfg, "top_p", None) or 1.0
+    if top_k is None:
+        top_k = getattr(gen_cfg, "top_k", None) or 0
+    eos_ids = tokenizer.eos_token_id if isinstance(tokenizer.eos_token_id, list) else [tokenizer.eos_token_id]
+    if hasattr(logits_processor, "begin"):
+        # 有状态的处理器（如 think_budget.ThinkBudgetProcessor）需要知道提示长度
+        logits_processor.begin(input_ids.shape[1])
+    timer = _PhaseTimer(streamer) if tracing.enabled() else None
+    if timer is not None:
+        streamer = timer
+    if spec is not None and spec.mode != "none" and input_ids.shape[0] == 1:
+        start = time.perf_counter()
+        new_ids, stats = speculative_generate(
+            model, input_ids, max_new_tokens, eos_ids, spec,
+            do_sample=do_sample, temperature=temperature, top_p=top_p, top_k=top_k,
+            logits_processor=logits_processor, streamer=streamer,
+        )
+        if timer is not None:
+            timer.record(start, time.perf_counter(), input_ids.shape[1], stats.new_tokens)
+        return [new_ids], stats
+
+    stats = GenerationStats()
+    start = time.perf_counter()
+    kwargs = {"do_sample": do_sample}
+    if do_sample:
+        kwargs.update(temperature=temperature, top_p=top_p, top_k=top_k)
+    if logits_processor is not None:
+        from transformers import LogitsProcessorList
+
+        kwargs["logits_processor"] = LogitsProcessorList([logits_processor])
+    with torch.no_grad():
+        gen = model.generate(
+            input_ids, attention_mask=attention_mask, max_new_tokens=max_new_tokens,
+            eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+            streamer=streamer, **kwargs,
+        )
+    prompt_len = input_ids.shape[1]
+    new_ids = [row[prompt_len:].tolist() for row in gen]
+    if tokenizer.pad_token_id is not None:
+        # 批量生成时，提前结束的样本会以 pad 补齐
+        new_ids = [_strip_pad(row, tokenizer.pad_token_id, eos_ids) for row in new_ids]
+    stats.seconds = time.perf_counter() - start
+    stats.new_tokens = sum(len(row) for row in new_ids)
+    stats.target_forwards = max((len(row) for row in new_ids), default=0)
+    if timer is not None:
+        timer.record(start, start + stats.seconds, prompt_len * input_ids.shape[0], stats.new_tokens)
+    return new_ids, stats
+
+
+def _strip_pad(row, pad_id, eos_ids):
+    for j, tok in enumerate(row):
+        if tok in eos_ids:
+            return row[:j + 1]
+    while row and row[-1] == pad_id:
+        row = row[:-1]
+    return row
+
+
+def main():
+    """CPU 上对比普通解码与投机解码"""
+    from model_utils import load_model
+
+    target_dir = os.environ.get("SPEC_TARGET", "models/Qwen/Qwen3-1.7B")
+    max_new_tokens = int(os.environ.get("SPEC_MAX_NEW_TOKENS", "128"))
+    device = os.environ.get("INFER_DEVICE", "cpu")
+    model, tokenizer = load_model(model_dir=target_dir, device=device)
+    spec = load_speculative_config(device=device)
+    if spec.mode == "none":
+        spec.mode = "ngram"
+
+    questions = ["感冒了怎么办？", "两岁小孩发热39.5℃该如何处理？", "餐后上腹痛伴反酸应该注意什么？"]
+    from batch_predict import build_messages
+    from chat_template import chat_encoder
+
+    encoder = chat_encoder(tokenizer)
+    for do_sample in (False, True):
+        plain_t, spec_t, drafted, accepted, mismatch = 0.0, 0.0, 0, 0, 0
+        for q in questions:
+            inputs = encoder.inputs(build_messages(q)).to(model.device)
+            torch.manual_seed(0)
+            base_ids, base_stats = generate(model, tokenizer, inputs.input_ids, inputs.attention_mask,
+                                            max_new_tokens=max_new_tokens, do_sample=do_sample)
+            torch.manual_seed(0)
+            spec_ids, spec_stats = generate(model, tokenizer, inputs.input_ids, inputs.attention_mask,
+                                            max_new_tokens=max_new_tokens, do_sample=do_sample, spec=spec)
+            plain_t += base_stats.seconds
+            spec_t += spec_stats.seconds
+            drafted += spec_stats.drafted
+            accepted += spec_stats.accepted
+            mismatch += int(base_ids[0] != spec_ids[0])
+        label = "sample" if do_sample else "greedy"
+        print(
+            f"[{spec.mode}/{label}] plain {plain_t:.2f}s, speculative {spec_t:.2f}s, "
+            f"speedup {plain_t / max(spec_t, 1e-9):.2f}x, acceptance {accepted / max(drafted, 1):.1%}"
+        )
+        if not do_sample:
+            print(f"   greedy outputs identical: {mismatch == 0} ({len(questions) - mismatch}/{len(questions)})")
+
+
+if __name__ == "__main__":
+    main()
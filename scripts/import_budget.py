@@ -0,0 +1,95 @@
+# scripts/import_budget.py
+"""
+CPU 工具冷启动预算：用 python -X importtime 记录各入口的导入开销，并检查重依赖没有被提前导入。
+
+每个入口在独立子进程中执行（重复 REPEAT 次取最小值），冷启动耗时 = 子进程墙钟 - 空解释器墙钟。
+超出预算或导入了禁止的重依赖（torch / pandas / openai / pyarrow / numpy / transformers / modelscope / datasets）
+时返回非零退出码，可直接放进 CI；报告写入 eval_report/import_time.json 以便追踪变化。
+
+    python scripts/import_budget.py
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+REPEAT = int(os.environ.get("IMPORT_BENCH_REPEAT", "5"))
+HEAVY_MODULES = ("torch", "pandas", "openai", "pyarrow", "numpy", "transformers", "modelscope", "datasets")
+
+# 入口 -> (执行的代码, 冷启动预算 ms)
+TARGETS = {
+    "eval_auto": ("import eval_auto", 150),
+    "reward_rules": (
+        "from reward_fn import RewardEngine\n"
+        "RewardEngine().get_rule_rewards(['<think>胸痛需要评估</think> 建议立即就医。'], ['胸痛怎么办'])",
+        150,
+    ),
+    "dataset_io": ("import dataset_io", 100),
+    "prepare_rl_data": ("import prepare_rl_data", 150),
+    "tracing": ("import tracing", 80),
+}
+
+
+def _run(code: str):
+    env = dict(os.environ, PYTHONPATH=script_dir + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                         cwd=script_dir, env=env)
+    wall = (time.perf_counter() - start) * 1000
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1])
+    return wall, out.stderr
+
+
+def _parse_importtime(stderr: str):
+    """返回 [(模块名, 累计 µs)]（仅顶层导入）以及全部被导入的模块名"""
+    top, modules = [], set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip().split(".")[0])
+        if not name.startswith("  "):  # 缩进表示嵌套导入
+            top.append((name.strip(), int(cumulative)))
+    return top, modules
+
+
+def measure(code: str) -> dict:
+    baseline = min(_run("pass")[0] for _ in range(REPEAT))
+    best, best_err = None, ""
+    for _ in range(REPEAT):
+        wall, err = _run(code)
+        if best is None or wall < best:
+            best, best_err = wall, err
+    top, modules = _parse_importtime(best_err)
+    top.sort(key=lambda x: -x[1])
+    return {
+        "cold_start_ms": round(best - baseline, 1),
+        "import_ms": round(sum(us for _, us in top) / 1000, 1),
+        "heaviest": [[name, round(us / 1000, 1)] for name, us in top[:8]],
+        "heavy_modules": sorted(m for m in HEAVY_MODULES if m in modules),
+    }
+
+
+def main() -> int:
+    report, failed = {}, []
+    for name, (code, budget) in TARGETS.items():
+        result = measure(code)
+        result["budget_ms"] = budget
+        result["ok"] = result["cold_start_ms"] <= budget and not result["heavy_modules"]
+        report[name] = result
+        mark = "✅" if result["ok"] else "❌"
+        print(f"{mark} {name:<16} {result['cold_start_ms']:>7.1f} ms (budget {budget} ms)"
+              + (f"  heavy: {', '.join(result['heavy_modules'])}" if result["heavy_modules"] else ""))
+        if not result["ok"]:
+            failed.append(name)
+    os.makedirs("eval_report", exist_ok=True)
+    with open(os.path.join("eval_report", "import_time.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# scripts/length_filter.py
+"""
+训练前的 token 长度过滤/截断阶段：在 process_func 之前按长度处理超长样本，
+可以避免 MAX_LENGTH 硬截断切掉整段回答和末尾的 pad/EOS 标签，也不再为之后会被丢弃的样本做完整分词。
+只作用于训练集；验证集保持原样（process_func 的截断已限制长度），eval_loss 与原先可比。
+
+- token_lengths(...)：批量（fast tokenizer）计算每条样本的 prompt / 输出 / 思考段 token 数，
+  结果按 (数据文件, 分词器, PROMPT, 聊天模板) 缓存为 npz，数据不变时二次运行直接命中
+- apply_length_policy(ds, ...)：超过 max_length 的样本按 LENGTH_POLICY 处理：
+    truncate        保留，由 process_func 硬截断（默认，与原先的训练集一致；只统计与出报告）
+    drop            直接丢弃
+    truncate_think  只截短 <think> 段（保留开头），回答保持完整；思考段不够截时丢弃
+    long_bucket     (max_length, LONG_MAX_LENGTH] 的样本按源文件的完整记录（含 instruction / meta）写入
+                    <name>_long.jsonl，留给长上下文阶段，更长的丢弃
+- 长度直方图与各处理方式计数写入 eval_report/length_report_<name>.json
+
+环境变量：LENGTH_POLICY、LONG_MAX_LENGTH（默认 8192）、LENGTH_CACHE_DIR（默认 data/cache/lengths）
+
+    python scripts/length_filter.py data/processed/train.jsonl models/Qwen/Qwen3-1.7B [max_length]
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chat_template import chat_encoder
+from think_spans import CLOSE_TAG, OPEN_TAG, parse_spans
+
+LENGTH_POLICY = os.environ.get("LENGTH_POLICY", "truncate")
+LONG_MAX_LENGTH = int(os.environ.get("LONG_MAX_LENGTH", "8192"))
+LENGTH_CACHE_DIR = os.environ.get("LENGTH_CACHE_DIR", "data/cache/lengths")
+POLICIES = ("truncate", "drop", "truncate_think", "long_bucket")
+HIST_BUCKETS = (0, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192)
+REPORT_DIR = "eval_report"
+
+
+def prompt_messages(prompt: str, user_input: str) -> List[dict]:
+    """与 train_lora / train_full 的 process_func 相同的 prompt 消息（经同一个编译后的聊天模板编码）"""
+    return [{"role": "system", "content": prompt}, {"role": "user", "content": user_input}]
+
+
+def _cache_file(data_path: str, tokenizer, prompt: str) -> str:
+    st = os.stat(data_path)
+    key = json.dumps([os.path.abspath(data_path), st.st_size, int(st.st_mtime),
+                      tokenizer.name_or_path, len(tokenizer), prompt, getattr(tokenizer, "chat_template", None)])
+    name = os.path.splitext(os.path.basename(data_path))[0]
+    return os.path.join(LENGTH_CACHE_DIR, f"{name}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.npz")
+
+
+def _count(tokenizer, texts, batch_size: int = 1024) -> np.ndarray:
+    out = []
+    for start in range(0, len(texts), batch_size):
+        out += [len(x) for x in tokenizer(texts[start:start + batch_size], add_special_tokens=False)["input_ids"]]
+    return np.array(out, dtype=np.int32)
+
+
+def token_lengths(ds, tokenizer, prompt: str, data_path: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """
+    返回 {"prompt", "output", "think"} 三个 int32 数组；训练序列长度 = prompt + output + 1（末尾 pad/EOS）。
+    data_path 给出时按文件签名缓存。
+    """
+    cache = _cache_file(data_path, tokenizer, prompt) if data_path else None
+    if cache and os.path.exists(cache):
+        with np.load(cache) as f:
+            lengths = {k: f[k] for k in f.files}
+        if len(lengths["output"]) == len(ds):
+            return lengths
+
+    outputs = ds.data.column("output")
+    spans = parse_spans(outputs)
+    texts = [t or "" for t in outputs.to_pylist()]
+    think_cs = spans.column("think_char_start").to_numpy()
+    think_n = spans.column("think_chars").to_numpy()
+    lengths = {
+        "prompt": np.array(chat_encoder(tokenizer).lengths([prompt_messages(prompt, x) for x in ds["input"]]),
+                           dtype=np.int32),
+        "output": _count(tokenizer, texts),
+        "think": _count(tokenizer, [t[s:s + n] for t, s, n in zip(texts, think_cs, think_n)]),
+    }
+    if cache:
+        os.makedirs(LENGTH_CACHE_DIR, exist_ok=True)
+        tmp = cache + f".tmp{os.getpid()}.npz"
+        np.savez(tmp, **lengths)
+        os.replace(tmp, cache)
+    return lengths
+
+
+def truncate_think(text: str, tokenizer, drop_tokens: int) -> Optional[str]:
+    """从 <think> 段末尾删掉 drop_tokens 个 token；思考段不够删时返回 None"""
+    start = text.find(OPEN_TAG)
+    end = text.find(CLOSE_TAG, start + len(OPEN_TAG)) if start >= 0 else -1
+    if end < 0:
+        return None
+    body = start + len(OPEN_TAG)
+    ids = tokenizer(text[body:end], add_special_tokens=False)["input_ids"]
+    if drop_tokens >= len(ids):
+        return None
+    return text[:body] + tokenizer.decode(ids[:len(ids) - drop_tokens]) + text[end:]
+
+
+def length_histogram(total: np.ndarray) -> Dict[str, int]:
+    bins = list(HIST_BUCKETS) + [max(int(total.max()) + 1 if len(total) else 0, HIST_BUCKETS[-1] + 1)]
+    counts = np.histogram(total, bins=bins)[0]
+    return {f"{lo}-{hi}": int(c) for lo, hi, c in zip(bins[:-1], bins[1:], counts)}
+
+
+def apply_length_policy(ds, tokenizer, prompt: str, max_length: int, policy: str = LENGTH_POLICY,
+                        data_path: Optional[str] = None, long_max_length: int = LONG_MAX_LENGTH,
+                        report_name: Optional[str] = None) -> Tuple[object, dict]:
+    """
+    返回 (处理后的 datasets.Dataset, 报告)。除 truncate 外，处理后每条样本 prompt + output + 1 <= max_length，
+    process_func 的截断不会再触发。
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown LENGTH_POLICY: {policy} (expected one of {POLICIES})")
+    start = time.perf_counter()
+    lengths = token_lengths(ds, tokenizer, prompt, data_path)
+    total = lengths["prompt"] + lengths["output"] + 1
+    over = np.flatnonzero(total > max_length)
+    keep = np.ones(len(ds), dtype=bool)
+    keep[over] = False
+    report = {
+        "rows": len(ds),
+        "max_length": max_length,
+        "policy": policy,
+        "over_length": int(len(over)),
+        "histogram": length_histogram(total),
+        "p50": float(np.percentile(total, 50)) if len(total) else 0.0,
+        "p99": float(np.percentile(total, 99)) if len(total) else 0.0,
+    }
+
+    if policy == "truncate":
+        keep[:] = True
+        report["process_func_truncated"] = int(len(over))
+    elif policy == "truncate_think" and len(over):
+        # 只对超长样本重新分词思考段；重新编码可能与原切分差一两个 token，截完再量一次
+        outputs = ds.select(over)["output"]
+        fixed = {}
+        for i, text in zip(over.tolist(), outputs):
+            excess = int(total[i]) - max_length
+            new = truncate_think(text, tokenizer, excess + 8) if excess < lengths["think"][i] else None
+            if new is not None and lengths["prompt"][i] + len(tokenizer(new, add_special_tokens=False)["input_ids"]) + 1 <= max_length:
+                fixed[i] = new
+        report["truncated_think"] = len(fixed)
+        if fixed:
+            fixed_idx = sorted(fixed)
+            keep[fixed_idx] = True
+            ds = ds.map(lambda ex, idx: {"output": fixed.get(idx, ex["output"])}, with_indices=True)
+    elif policy == "long_bucket" and len(over):
+        long_idx = over[total[over] <= long_max_length]
+        report["long_bucket"] = int(len(long_idx))
+        if len(long_idx) and data_path:
+            from dataset_io import select_records, write_jsonl
+
+            # ds 只投影了 input / output；从源文件取完整记录，长上下文阶段可直接作为训练数据读取
+            long_path = os.path.splitext(data_path)[0] + "_long.jsonl"
+            write_jsonl(long_path, select_records(data_path, long_idx))
+            report["long_bucket_path"] = long_path
+
+    report["dropped"] = int((~keep).sum())
+    report["kept"] = int(keep.sum())
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    if report_name:
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        with open(os.path.join(REPORT_DIR, f"length_report_{report_name}.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📏 {report_name or 'dataset'}: {report['kept']}/{report['rows']} kept, "
+          f"{report['over_length']} over {max_length} tokens (policy={policy})")
+    return (ds.select(np.flatnonzero(keep)) if report["dropped"] else ds), report
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    from dataset_io import resolve_path, to_hf_dataset
+    from tokenizer_utils import PROMPT, load_tokenizer
+
+    data_path = resolve_path(sys.argv[1])
+    max_length = int(sys.argv[3]) if len(sys.argv) > 3 else 2048
+    tokenizer = load_tokenizer(sys.argv[2])
+    ds = to_hf_dataset(data_path, columns=["input", "output"])
+    name = os.path.splitext(os.path.basename(data_path))[0]
+    for attempt in ("cold", "cached"):
+        start = time.perf_counter()
+        _, report = apply_length_policy(ds, tokenizer, PROMPT, max_length, data_path=data_path, report_name=name)
+        print(f"   {attempt}: {time.perf_counter() - start:.2f}s")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
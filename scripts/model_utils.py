@@ -0,0 +1,122 @@
+# scripts/model_utils.py
+"""
+推理脚本共用的模型加载：
+- GPU（默认有 CUDA 时）：bf16 + device_map="auto"，与原有行为一致
+- CPU：默认 fp32 计算（CPU 上 bf16 多为软件模拟），可选 int8 / int4 量化，量化产物走磁盘缓存
+环境变量：
+    INFER_DEVICE=cuda|cpu
+    INFER_QUANT=none|bf16|int8|int4   （仅 CPU 生效；bf16 用于和线上行为对齐做参考）
+"""
+import os
+import sys
+
+import torch
+from transformers import AutoModelForCausalLM
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+import cpu_quant
+from tokenizer_utils import load_tokenizer
+
+INFER_DEVICE = os.environ.get("INFER_DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+INFER_QUANT = os.environ.get("INFER_QUANT", "none")
+
+
+def _load_hf(model_dir, base_dir, adapter_dir, dtype, device_map):
+    if adapter_dir:
+        from peft import PeftModel
+
+        base = AutoModelForCausalLM.from_pretrained(base_dir, torch_dtype=dtype, device_map=device_map, trust_remote_code=True)
+        return PeftModel.from_pretrained(base, adapter_dir)
+    return AutoModelForCausalLM.from_pretrained(model_dir, torch_dtype=dtype, device_map=device_map, trust_remote_code=True)
+
+
+def load_model(model_dir=None, base_dir=None, adapter_dir=None, device=None, quant=None):
+    """
+    加载推理模型与分词器，全参传 model_dir，LoRA 传 base_dir + adapter_dir。
+    返回 (model, tokenizer)，模型已 eval()；输入张量请用 .to(model.device)
+    """
+    device = device or INFER_DEVICE
+    quant = quant or INFER_QUANT
+    src_dir = base_dir if adapter_dir else model_dir
+    tokenizer = load_tokenizer(src_dir)
+
+    if device != "cpu":
+        model = _load_hf(model_dir, base_dir, adapter_dir, torch.bfloat16, "auto")
+        return model.eval(), tokenizer
+
+    if quant in cpu_quant.QUANT_MODES:
+        cached = cpu_quant.load_cached(src_dir, adapter_dir, quant)
+        if cached is not None:
+            return cached.eval(), tokenizer
+
+    dtype = torch.bfloat16 if quant == "bf16" else torch.float32
+    model = _load_hf(model_dir, base_dir, adapter_dir, dtype, None)
+    if adapter_dir:
+        # CPU 上先合并 LoRA，省去每层额外的两次小矩阵乘，也保证量化覆盖到增量权重
+        model = model.merge_and_unload()
+    if quant in cpu_quant.QUANT_MODES:
+        print(f"⚙️  Quantizing to {quant} on CPU...")
+        model = cpu_quant.quantize_model(model, quant)
+        cpu_quant.save_cache(model, src_dir, adapter_dir, quant)
+    return model.eval(), tokenizer
+
+
+def load_rl_policy(base_model_path: str, sft_adapter_path=None, lora_config=None, dtype=torch.bfloat16, device_map="auto"):
+    """
+    RL 策略模型：SFT adapter 先合并进基座，再挂一个新的可训练 LoRA。
+    关闭 adapter 即得到 SFT 模型本身，可直接充当参考模型而无需复制；新 LoRA 的 B 初始化为 0，
+    训练起点与 SFT 完全一致。
+    """
+    from peft import LoraConfig, PeftModel, TaskType, get_peft_model
+
+    base = AutoModelForCausalLM.from_pretrained(base_model_path, torch_dtype=dtype, device_map=device_map, trust_remote_code=True)
+    if sft_adapter_path and os.path.exists(sft_adapter_path):
+        base = PeftModel.from_pretrained(base, sft_adapter_path).merge_and_unload()
+        if lora_config is None:
+            lora_config = LoraConfig.from_pretrained(sft_adapter_path)
+            lora_config.inference_mode = False
+    if lora_config is None:
+        lora_config = LoraConfig(
+            task_type=TaskType.CAUSAL_LM, r=64, lora_alpha=128, lora_dropout=0.1,
+            target_modules=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+        )
+    return get_peft_model(base, lora_config)
+
+
+def param_bytes(*modules) -> int:
+    """多个模块的参数总字节数，共享同一存储的张量只计一次"""
+    seen, total = set(), 0
+    for module in modules:
+        for p in module.parameters():
+            key = (p.device, p.data_ptr())
+            if key not in seen:
+                seen.add(key)
+                total += p.numel() * p.element_size()
+    return total
+
+
+def tiny_causal_lm(tokenizer, seed: int = 0, hidden_size: int = 64, num_layers: int = 2):
+    """
+    随机初始化的 Qwen2 结构小模型（共享真实分词器的词表），用于 CPU 上的训练流程/一致性校验。
+    同一 seed 得到完全相同的权重。
+    """
+    from transformers import Qwen2Config
+
+    config = Qwen2Config(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=1024,
+        tie_word_embeddings=True,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    torch.manual_seed(seed)
+    return AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
@@ -1,10 +1,12 @@
-from modelscope.msdatasets import MsDataset
 import json
 import random
 
 random.seed(42)
 
 def main():
+    # modelscope 导入需数秒，只在真正下载数据时导入
+    from modelscope.msdatasets import MsDataset
+
     ds = MsDataset.load('krisfu/delicate_medical_r1_data', subset_name='default', split='train')
     data_list = list(ds)
     random.shuffle(data_list)
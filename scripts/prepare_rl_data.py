@@ -1,9 +1,28 @@
+"""
+RL 提示集构建（流式）：每个数据源只顺序读一遍，内存与训练集大小无关。
+
+- 去重：以 input 的 8 字节 blake2b 摘要为键，存于开放寻址的紧凑哈希集合（每条约 16 字节）
+- 训练集采样：按 meta.risk_level 分层的蓄水池抽样，高风险组（high/critical）占 60%，其余 40%；
+  组内名额按各风险等级的实际条数分配；蓄水池只保存原始行文本
+- 同一 seed 输出完全一致
+
+基准（合成 N 行训练集，对比原先整表加载的做法）：
+    python scripts/prepare_rl_data.py --bench 500000
+"""
+import array
+import hashlib
 import json
 import os
 import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from dataset_io import iter_records, resolve_path
 
-# 确保随机性可控
-random.seed(42)
+SEED = int(os.environ.get("RL_DATA_SEED", "42"))
 
 INPUT_FILES = {
     "gold": "data/processed/gold_set.jsonl",
@@ -20,93 +39,237 @@ SAFETY_FOCUS_SAMPLING = {
     "high_risk_ratio": 0.6,        # 60%高风险样本
     "general_ratio": 0.4           # 40%一般样本
 }
+HIGH_RISK_LEVELS = ("high", "critical")
 
-def load_jsonl(path):
+
+def iter_source(path):
+    """逐条读取 (原始行, 解析后的 dict)；已转换为 Parquet 时按 row group 流式读取；文件不存在时为空"""
+    path = resolve_path(path)
     if not os.path.exists(path):
-        return []
+        return
+    if path.endswith(".parquet"):
+        for item in iter_records(path, columns=["instruction", "input", "output", "meta"]):
+            yield json.dumps(item, ensure_ascii=False), item
+        return
     with open(path, "r", encoding="utf-8") as f:
-        return [json.loads(line) for line in f]
+        for line in f:
+            if line.strip():
+                yield line.rstrip("\n"), json.loads(line)
+
+
+def text_digest(text: str) -> int:
+    d = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    return d or 1  # 0 留作空槽
+
+
+class CompactHashSet:
+    """8 字节整数键的开放寻址哈希集合（array('Q') 存储，负载因子 ≤ 0.5）"""
+
+    def __init__(self, capacity: int = 1 << 16):
+        size = 1
+        while size < capacity:
+            size *= 2
+        self._slots = array.array("Q", bytes(8 * size))
+        self._mask = size - 1
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return self._slots.itemsize * len(self._slots)
+
+    def _probe(self, key: int) -> int:
+        i = key & self._mask
+        while True:
+            slot = self._slots[i]
+            if slot == 0 or slot == key:
+                return i
+            i = (i + 1) & self._mask
+
+    def __contains__(self, key: int) -> bool:
+        return self._slots[self._probe(key)] == key
+
+    def add(self, key: int) -> bool:
+        """插入；已存在返回 False"""
+        i = self._probe(key)
+        if self._slots[i] == key:
+            return False
+        self._slots[i] = key
+        self._count += 1
+        if self._count * 2 > len(self._slots):
+            self._grow()
+        return True
+
+    def _grow(self):
+        old = self._slots
+        self._slots = array.array("Q", bytes(16 * len(old)))
+        self._mask = len(self._slots) - 1
+        for key in old:
+            if key:
+                self._slots[self._probe(key)] = key
+
+
+class StratifiedReservoir:
+    """每个风险等级一个容量为 capacity 的蓄水池（Algorithm R），并记录各等级总条数"""
+
+    def __init__(self, capacity: int, rng: random.Random):
+        self.capacity = capacity
+        self.rng = rng
+        self.seen = defaultdict(int)
+        self.pools = defaultdict(list)
+
+    def add(self, level: str, line: str):
+        self.seen[level] += 1
+        pool = self.pools[level]
+        if len(pool) < self.capacity:
+            pool.append(line)
+        else:
+            j = self.rng.randrange(self.seen[level])
+            if j < self.capacity:
+                pool[j] = line
+
+    def draw(self, levels, quota: int):
+        """从若干等级中按条数比例分配 quota，返回抽到的行（总量不足时全取）"""
+        levels = sorted(lv for lv in levels if self.seen[lv])
+        total = sum(self.seen[lv] for lv in levels)
+        if total <= quota:
+            return [line for lv in levels for line in self.pools[lv]]
+        # 最大余数法分配名额
+        shares = {lv: quota * self.seen[lv] / total for lv in levels}
+        alloc = {lv: int(shares[lv]) for lv in levels}
+        for lv in sorted(levels, key=lambda lv: shares[lv] - alloc[lv], reverse=True)[:quota - sum(alloc.values())]:
+            alloc[lv] += 1
+        out = []
+        for lv in levels:
+            out += self.rng.sample(self.pools[lv], min(alloc[lv], len(self.pools[lv])))
+        return out
+
+
+def build_prompts(input_files=INPUT_FILES, output_file=OUTPUT_FILE, target_size=TARGET_SIZE, seed=SEED) -> dict:
+    rng = random.Random(seed)
+    seen = CompactHashSet()
+    risk_stats = defaultdict(int)
+    counts = defaultdict(int)
+
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    tmp = output_file + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as out:
+        def emit(line, item):
+            out.write(line + "\n")
+            risk_stats[(item.get("meta") or {}).get("risk_level", "unknown")] += 1
+
+        # 1. 安全红队（原先的重复过采样在去重后只保留一份）、红队、Gold：全部保留
+        for name in ("safety_red", "red", "gold"):
+            for line, item in iter_source(input_files[name]):
+                counts[name] += 1
+                if seen.add(text_digest(item["input"])):
+                    emit(line, item)
+        needed = max(0, target_size - sum(risk_stats.values()))
+
+        # 2. 训练集：一遍流式扫描，分层蓄水池抽样
+        if needed > 0:
+            high_count = int(needed * SAFETY_FOCUS_SAMPLING["high_risk_ratio"])
+            general_count = needed - high_count
+            reservoir = StratifiedReservoir(max(high_count, general_count), rng)
+            for line, item in iter_source(input_files["train"]):
+                counts["train"] += 1
+                if not seen.add(text_digest(item["input"])):
+                    continue
+                reservoir.add((item.get("meta") or {}).get("risk_level") or "unknown", line)
+
+            high_levels = [lv for lv in reservoir.seen if lv in HIGH_RISK_LEVELS]
+            general_levels = [lv for lv in reservoir.seen if lv not in HIGH_RISK_LEVELS]
+            sampled_high = reservoir.draw(high_levels, high_count)
+            sampled_general = reservoir.draw(general_levels, general_count)
+            for line in sampled_high + sampled_general:
+                emit(line, json.loads(line))
+            counts["sampled_high"], counts["sampled_general"] = len(sampled_high), len(sampled_general)
+    os.replace(tmp, output_file)
+    return {"counts": dict(counts), "risk_stats": dict(risk_stats), "dedup_set_bytes": seen.nbytes}
+
 
 def main():
-    print("🔄 Loading source datasets...")
-    gold = load_jsonl(INPUT_FILES["gold"])
-    red = load_jsonl(INPUT_FILES["red"])
-    safety_red = load_jsonl(INPUT_FILES["safety_red"])
-    train = load_jsonl(INPUT_FILES["train"])
-    
-    print(f"   Gold: {len(gold)}, Red: {len(red)}, Safety-Red: {len(safety_red)}, Train: {len(train)}")
-    
-    # 新策略（针对合规安全目标）：
-    # 1. 安全红队样本 × 3 (过采样，强化安全性学习)
-    # 2. 一般红队样本 (原有高风险场景)
-    # 3. Gold Set 样本 (高质量锚点)
-    # 4. 从 Train 中按风险等级采样：60%高风险 + 40%一般
-    
-    dataset = []
-    
-    # 安全红队样本过采样（重复3次强化训练）
-    oversampling_times = SAFETY_FOCUS_SAMPLING["safety_red_oversampling"]
-    for _ in range(oversampling_times):
-        dataset.extend(safety_red)
-    
-    # 添加其他高优先级样本
-    dataset.extend(red)
-    dataset.extend(gold)
-    
-    # 去重 (以 input 为 key)
-    seen = set()
-    unique_dataset = []
+    print("🔄 Streaming source datasets...")
+    report = build_prompts()
+    counts, risk_stats = report["counts"], report["risk_stats"]
+    print(f"   Gold: {counts.get('gold', 0)}, Red: {counts.get('red', 0)}, "
+          f"Safety-Red: {counts.get('safety_red', 0)}, Train: {counts.get('train', 0)}")
+    if "sampled_high" in counts:
+        print(f"   📊 Sampling from train: {counts['sampled_high']} high-risk + {counts['sampled_general']} general")
+
+    total = sum(risk_stats.values())
+    print(f"\n✅ Generated {total} RL prompts at {OUTPUT_FILE}")
+    print(f"   📊 Risk Level Distribution:")
+    for risk, count in sorted(risk_stats.items()):
+        print(f"      {risk}: {count} ({count/max(total, 1)*100:.1f}%)")
+    print(f"   🎯 Strategy: Safety-focused (60% high-risk + oversampled safety cases)")
+
+
+# ================= 基准 =================
+def _legacy_build(input_files, output_file, target_size, seed):
+    """原先的整表加载实现，仅用于基准对比"""
+    rnd = random.Random(seed)
+
+    def load(path):
+        return [json.loads(line) for line in open(path, encoding="utf-8")] if os.path.exists(path) else []
+
+    train = load(input_files["train"])
+    dataset = load(input_files["safety_red"]) * 3 + load(input_files["red"]) + load(input_files["gold"])
+    seen, unique = set(), []
     for item in dataset:
         if item["input"] not in seen:
-            unique_dataset.append(item)
+            unique.append(item)
             seen.add(item["input"])
-            
-    current_count = len(unique_dataset)
-    needed = max(0, TARGET_SIZE - current_count)
-    
-    if needed > 0 and len(train) > 0:
-        # 过滤掉已存在的
-        train_filtered = [x for x in train if x["input"] not in seen]
-        
-        # 按风险等级分组
-        high_risk_train = [x for x in train_filtered 
-                          if x.get("meta", {}).get("risk_level") in ["high", "critical"]]
-        general_train = [x for x in train_filtered 
-                        if x.get("meta", {}).get("risk_level") not in ["high", "critical"]]
-        
-        # 计算采样数量
-        high_risk_count = int(needed * SAFETY_FOCUS_SAMPLING["high_risk_ratio"])
-        general_count = needed - high_risk_count
-        
-        # 采样
-        sampled_high = random.sample(high_risk_train, min(len(high_risk_train), high_risk_count))
-        sampled_general = random.sample(general_train, min(len(general_train), general_count))
-        
-        unique_dataset.extend(sampled_high)
-        unique_dataset.extend(sampled_general)
-        
-        print(f"   📊 Sampling from train: {len(sampled_high)} high-risk + {len(sampled_general)} general")
-        
-    # 简化字段，RL 只需要 prompt (input)
-    # 但为了兼容性，我们保留原始结构
-    
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        for item in unique_dataset:
+    needed = max(0, target_size - len(unique))
+    train_filtered = [x for x in train if x["input"] not in seen]
+    high = [x for x in train_filtered if x.get("meta", {}).get("risk_level") in HIGH_RISK_LEVELS]
+    general = [x for x in train_filtered if x.get("meta", {}).get("risk_level") not in HIGH_RISK_LEVELS]
+    high_count = int(needed * 0.6)
+    unique += rnd.sample(high, min(len(high), high_count)) + rnd.sample(general, min(len(general), needed - high_count))
+    with open(output_file, "w", encoding="utf-8") as f:
+        for item in unique:
             f.write(json.dumps(item, ensure_ascii=False) + "\n")
-    
-    # 统计最终构成
-    risk_stats = {}
-    for item in unique_dataset:
-        risk = item.get("meta", {}).get("risk_level", "unknown")
-        risk_stats[risk] = risk_stats.get(risk, 0) + 1
-            
-    print(f"\n✅ Generated {len(unique_dataset)} RL prompts at {OUTPUT_FILE}")
-    print(f"   📊 Risk Level Distribution:")
-    for risk, count in sorted(risk_stats.items()):
-        print(f"      {risk}: {count} ({count/len(unique_dataset)*100:.1f}%)")
-    print(f"   🎯 Strategy: Safety-focused (60% high-risk + oversampled safety cases)")
+
+
+def benchmark(n: int) -> dict:
+    work = tempfile.mkdtemp(prefix="rl_prompts_bench_")
+    files = {k: os.path.join(work, f"{k}.jsonl") for k in INPUT_FILES}
+    rnd = random.Random(0)
+    levels = ["low", "medium", "high", "critical"]
+    with open(files["train"], "w", encoding="utf-8") as f:
+        for i in range(n):
+            item = {
+                "instruction": "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。",
+                "input": f"患者问题 {rnd.randrange(n)}：最近{rnd.choice(['头痛', '咳嗽', '胸闷', '腹痛'])}，该怎么办？",
+                "output": "<think>" + "分析" * 60 + "</think> 建议及时就医。",
+                "meta": {"risk_level": rnd.choice(levels)},
+            }
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    with open(files["red"], "w", encoding="utf-8") as f:
+        f.write(json.dumps({"input": "我想自己买抗生素吃", "meta": {"risk_level": "high"}}, ensure_ascii=False) + "\n")
+
+    report = {"rows": n, "train_mb": round(os.path.getsize(files["train"]) / 2 ** 20, 1)}
+    for name, fn in (("legacy", _legacy_build), ("streaming", build_prompts)):
+        out = os.path.join(work, f"out_{name}.jsonl")
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn(files, out, TARGET_SIZE, SEED)
+        sec = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[name] = {"sec": round(sec, 2), "peak_python_mb": round(peak / 2 ** 20, 1)}
+
+    again = os.path.join(work, "out_streaming_again.jsonl")
+    build_prompts(files, again, TARGET_SIZE, SEED)
+    with open(os.path.join(work, "out_streaming.jsonl"), "rb") as a, open(again, "rb") as b:
+        report["deterministic"] = a.read() == b.read()
+    return report
+
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 2 and sys.argv[1] == "--bench":
+        print(json.dumps(benchmark(int(sys.argv[2])), ensure_ascii=False, indent=2))
+    else:
+        main()
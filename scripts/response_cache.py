@@ -0,0 +1,285 @@
+# scripts/response_cache.py
+"""
+demo 的语义响应缓存（可选）：重复 / 近似重复的单轮问题直接返回已生成的回答，不再跑完整的 512 token 生成。
+
+- 精确命中：问题归一化（NFKC、小写、去空白与标点，数字间的小数点保留）后作为键
+- 近似命中：字符 1~3-gram 经 crc32 哈希到 RESPONSE_CACHE_DIM 维、L2 归一化的向量，
+  存在预分配的 NumPy 矩阵里，一次矩阵-向量乘得到与全部条目的余弦相似度（向量化暴力检索，
+  条目数 ≤ 容量，数千条时亚毫秒）；相似度 ≥ RESPONSE_CACHE_THRESHOLD 且两个问题中的数字完全相同
+  （"39.5℃" 与 "38℃" 不互相命中）才算命中
+- TTL（RESPONSE_CACHE_TTL 秒）与 LRU（容量 RESPONSE_CACHE_SIZE，满了淘汰最久未用）
+- 命中后先用规则引擎（RewardEngine.check_safety_violations）以"当前问题 + 缓存回答"复查，有违规则视为未命中并丢弃该条目；
+  写入时同样只缓存对自身问题无违规的完整回答：生成以 EOS 结束（不是被 max_new_tokens 截断）、
+  <think> 段已闭合且其后有非空回答（complete_response）
+- 只缓存无历史的单轮对话（多轮回答依赖上下文）
+
+环境变量：RESPONSE_CACHE=1 启用（demo_gradio.py），RESPONSE_CACHE_SIZE（默认 2048），RESPONSE_CACHE_TTL（默认 86400），
+         RESPONSE_CACHE_THRESHOLD（默认 0.9），RESPONSE_CACHE_DIM（默认 2048），
+         QUERY_LOG=<path.jsonl> 时 demo 逐条记录 {question, output, gen_sec, ended_on_eos} 供回放
+
+回放查询日志，报告命中率（精确 / 近似 / 规则拒绝）、查找延迟与有效延迟（命中 = 查找耗时，未命中 = 日志里的生成耗时）：
+    python scripts/response_cache.py replay logs/queries.jsonl
+    python scripts/response_cache.py synthetic data/processed/dev.jsonl logs/synthetic_queries.jsonl   # 按 Zipf 分布和表面改写生成回放日志
+"""
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+from think_spans import has_think, split_think_answer
+
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.9"))
+RESPONSE_CACHE_DIM = int(os.environ.get("RESPONSE_CACHE_DIM", "2048"))
+QUERY_LOG = os.environ.get("QUERY_LOG", "")
+NGRAMS = (1, 2, 3)
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize(question: str) -> str:
+    text = unicodedata.normalize("NFKC", question).lower()
+    out = []
+    for i, ch in enumerate(text):
+        cat = unicodedata.category(ch)
+        if ch == "." and 0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit():
+            out.append(ch)
+        elif not (cat[0] in "PZ" or ch.isspace()):
+            out.append(ch)
+    return "".join(out)
+
+
+def numbers(normalized: str) -> tuple:
+    return tuple(_NUMBER.findall(normalized))
+
+
+def embed(normalized: str, dim: int = RESPONSE_CACHE_DIM) -> np.ndarray:
+    """字符 n-gram 哈希向量（L2 归一化）"""
+    vec = np.zeros(dim, dtype=np.float32)
+    for n in NGRAMS:
+        for i in range(len(normalized) - n + 1):
+            vec[zlib.crc32(normalized[i:i + n].encode("utf-8")) % dim] += 1.0
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+def complete_response(text: str, ended_on_eos: bool = True) -> bool:
+    """以 EOS 结束、思考段闭合且回答非空；截断的生成不能缓存（否则之后每次命中都返回半截回答）"""
+    return ended_on_eos and has_think(text) and bool(split_think_answer(text)[1])
+
+
+@dataclass
+class CacheHit:
+    response: str
+    kind: str  # exact | semantic
+    similarity: float
+    matched: str
+
+
+class ResponseCache:
+    def __init__(self, capacity: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 threshold: float = RESPONSE_CACHE_THRESHOLD, dim: int = RESPONSE_CACHE_DIM,
+                 validator: Optional[Callable[[str, str], bool]] = None, clock: Callable[[], float] = time.time):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.threshold = threshold
+        self.dim = dim
+        self.validator = validator
+        self.clock = clock
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.expires = np.full(capacity, -np.inf)  # 空槽视为已过期，不参与检索
+        self.slots: List[Optional[dict]] = [None] * capacity
+        self.lru: "OrderedDict[str, int]" = OrderedDict()  # 归一化问题 -> 槽位，末尾为最近使用
+        self.free = list(range(capacity - 1, -1, -1))
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "rejected": 0, "expired": 0,
+                      "evicted": 0, "stored": 0, "not_stored": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.lru)
+
+    # ---- 内部 ----
+    def _drop(self, slot: int):
+        entry = self.slots[slot]
+        self.lru.pop(entry["key"], None)
+        self.slots[slot] = None
+        self.expires[slot] = -np.inf
+        self.free.append(slot)
+
+    def _valid(self, question: str, response: str) -> bool:
+        return self.validator is None or self.validator(question, response)
+
+    def _lookup(self, key: str, now: float):
+        slot = self.lru.get(key)
+        if slot is not None:
+            if self.expires[slot] > now:
+                return slot, "exact", 1.0
+            self.stats["expired"] += 1
+            self._drop(slot)
+        if not self.lru:
+            return None
+        sims = self.vectors @ embed(key, self.dim)
+        sims[self.expires <= now] = -1.0
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold or numbers(self.slots[best]["key"]) != numbers(key):
+            return None
+        return best, "semantic", float(sims[best])
+
+    # ---- 对外 ----
+    def get(self, question: str) -> Optional[CacheHit]:
+        key = normalize(question)
+        with self._lock:
+            found = self._lookup(key, self.clock())
+            if found is None:
+                self.stats["misses"] += 1
+                return None
+            slot, kind, sim = found
+            entry = self.slots[slot]
+            if not self._valid(question, entry["response"]):
+                # 缓存回答对当前问题触发规则违规（例如当前问题涉及孕妇/急症）：不提供，并移出缓存
+                self.stats["rejected"] += 1
+                self.stats["misses"] += 1
+                self._drop(slot)
+                return None
+            self.lru.move_to_end(entry["key"])
+            self.stats["exact_hits" if kind == "exact" else "semantic_hits"] += 1
+            return CacheHit(entry["response"], kind, sim, entry["question"])
+
+    def put(self, question: str, response: str, ended_on_eos: bool = True) -> bool:
+        """ended_on_eos：生成是否以 EOS 结束（generate 返回的最后一个 id）"""
+        key = normalize(question)
+        if not key or not complete_response(response, ended_on_eos) or not self._valid(question, response):
+            self.stats["not_stored"] += 1
+            return False
+        with self._lock:
+            if key in self.lru:
+                self._drop(self.lru[key])
+            if not self.free:
+                self._drop(next(iter(self.lru.values())))  # 最久未用
+                self.stats["evicted"] += 1
+            slot = self.free.pop()
+            self.slots[slot] = {"key": key, "question": question, "response": response}
+            self.vectors[slot] = embed(key, self.dim)
+            self.expires[slot] = self.clock() + self.ttl
+            self.lru[key] = slot
+            self.stats["stored"] += 1
+        return True
+
+    def hit_rate(self) -> float:
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        return hits / max(hits + self.stats["misses"], 1)
+
+
+def rule_validator() -> Callable[[str, str], bool]:
+    """规则引擎复查：当前问题 + 回答没有任何安全违规才可提供 / 缓存"""
+    from reward_fn import RewardEngine
+
+    engine = RewardEngine(teacher_mode="mock")
+    return lambda question, response: not engine.check_safety_violations(question, response)["violations"]
+
+
+def make_response_cache() -> Optional[ResponseCache]:
+    """RESPONSE_CACHE=1 时返回带规则复查的缓存，否则 None"""
+    return ResponseCache(validator=rule_validator()) if RESPONSE_CACHE else None
+
+
+def log_query(question: str, output: str, gen_sec: float, ended_on_eos: bool = True, path: str = QUERY_LOG):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"question": question, "output": output, "gen_sec": round(gen_sec, 3),
+                            "ended_on_eos": ended_on_eos, "time": time.time()}, ensure_ascii=False) + "\n")
+
+
+# ================= 回放 =================
+def _pct(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def replay(log_path: str, cache: Optional[ResponseCache] = None) -> dict:
+    """按日志顺序回放：未命中时把日志里的回答写入缓存（等同于 demo 生成后写入）"""
+    cache = cache or ResponseCache(validator=rule_validator())
+    with open(log_path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    lookup_us, served, baseline = [], [], []
+    for r in records:
+        gen_sec = r.get("gen_sec")
+        start = time.perf_counter()
+        hit = cache.get(r["question"])
+        took = time.perf_counter() - start
+        lookup_us.append(took * 1e6)
+        if gen_sec is not None:
+            baseline.append(gen_sec)
+            served.append(took if hit else took + gen_sec)
+        if hit is None:
+            cache.put(r["question"], r["output"], r.get("ended_on_eos", True))
+    report = {
+        "queries": len(records),
+        "hit_rate": round(cache.hit_rate(), 4),
+        **cache.stats,
+        "entries": len(cache),
+        "lookup_us_p50": round(_pct(lookup_us, 0.5), 1),
+        "lookup_us_p99": round(_pct(lookup_us, 0.99), 1),
+    }
+    if baseline:
+        report["mean_latency_sec_no_cache"] = round(statistics.mean(baseline), 3)
+        report["mean_latency_sec_with_cache"] = round(statistics.mean(served), 3)
+        report["p50_latency_sec_with_cache"] = round(_pct(served, 0.5), 3)
+    return report
+
+
+_VARIANTS = (lambda q: q, lambda q: q + "？", lambda q: q.rstrip("？?") + "呢？", lambda q: " " + q + " ",
+             lambda q: "请问" + q, lambda q: q.replace("？", "?"))
+
+
+def synthetic_log(data_path: str, out_path: str, n: int = 5000, seed: int = 0, zipf_s: float = 1.1) -> str:
+    """按 Zipf 分布抽取 dev 问题并做表面改写，回答取数据集中的 output（无 gen_sec，只评估命中率与查找延迟）"""
+    from dataset_io import iter_records, resolve_path
+
+    rows = [r for r in iter_records(resolve_path(data_path), columns=["input", "output"]) if r["input"] and r["output"]]
+    rng = random.Random(seed)
+    weights = [1 / (k + 1) ** zipf_s for k in range(len(rows))]
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        for r in rng.choices(rows, weights=weights, k=n):
+            f.write(json.dumps({"question": rng.choice(_VARIANTS)(r["input"]), "output": r["output"]},
+                               ensure_ascii=False) + "\n")
+    return out_path
+
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "replay":
+        report = replay(sys.argv[2])
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"✅ Hit rate {report['hit_rate']:.1%} ({report['exact_hits']} exact, {report['semantic_hits']} semantic, "
+              f"{report['rejected']} rejected by rules), lookup p50 {report['lookup_us_p50']} µs")
+        os.makedirs("eval_report", exist_ok=True)
+        with open(os.path.join("eval_report", "response_cache_replay.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    elif len(sys.argv) >= 4 and sys.argv[1] == "synthetic":
+        print(f"✅ Synthetic query log: {synthetic_log(sys.argv[2], sys.argv[3])}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,25 @@
-import re
-import torch
 import os
 import sys
-from typing import List
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    import torch
 
 # 添加脚本目录到路径，以便导入同目录下的模块
 script_dir = os.path.dirname(os.path.abspath(__file__))
 if script_dir not in sys.path:
     sys.path.insert(0, script_dir)
 
-from deepseek_teacher import DeepSeekTeacher
+from deepseek_teacher import DeepSeekTeacher, MockTeacher
+from think_spans import has_think, split_think_answer
+from tracing import traced
 
 class RewardEngine:
-    def __init__(self, teacher_mode="mock", safety_weight=0.5):
-        # 初始化教师模型
-        self.teacher = DeepSeekTeacher()
-        # 编译正则表达式
-        self.think_pattern = re.compile(r"<think>(.*?)</think>", re.DOTALL)
+    def __init__(self, teacher_mode="deepseek", safety_weight=0.5):
+        # 教师模型：mock 为离线确定性打分（本地调试 / 续训校验），其余走 DeepSeek；
+        # 首次需要教师打分时才创建，只用规则打分（get_rule_rewards）时不导入 openai
+        self.teacher_mode = teacher_mode
+        self._teacher = None
         
         # 安全性权重（针对合规安全目标）
         self.safety_weight = safety_weight
@@ -70,6 +73,12 @@ class RewardEngine:
             "qualified_statement": ["可能", "需要评估", "具体情况", "因人而异"]
         }
     
+    @property
+    def teacher(self):
+        if self._teacher is None:
+            self._teacher = MockTeacher() if self.teacher_mode == "mock" else DeepSeekTeacher()
+        return self._teacher
+
     def check_safety_violations(self, prompt: str, completion: str) -> dict:
         """
         检查合规安全违规
@@ -145,19 +154,20 @@ class RewardEngine:
         # 上限0.6分
         return min(0.6, bonus)
         
-    def get_rule_rewards(self, completions: List[str], prompts: List[str] = None) -> List[float]:
-        """计算规则部分的奖励（包含合规安全检查）"""
+    @traced("rule_scoring")
+    def get_rule_rewards(self, completions: List[str], prompts: List[str] = None, details: list = None) -> List[float]:
+        """计算规则部分的奖励（包含合规安全检查）；传入 details 列表时逐条追加命中的违规项"""
         rewards = []
         
         for idx, text in enumerate(completions):
             score = 0.0
+            violations = []
             
             # === 基础规则 ===
             # 1. 格式奖励：包含 <think> 标签
-            think_match = self.think_pattern.search(text)
-            if think_match:
+            think_content, response_only = split_think_answer(text)
+            if has_think(text):
                 score += 0.2
-                think_content = think_match.group(1).strip()
                 # 思考过程不能太短
                 if len(think_content) > 20:
                     score += 0.1
@@ -170,8 +180,8 @@ class RewardEngine:
                 score += 0.1
                 
             # 3. 长度惩罚
-            # 移除 think 标签后计算回复长度
-            response_only = self.think_pattern.sub("", text).strip()
+            # 只计 </think> 之后的回答长度
+            response_only = response_only.strip()
             if len(response_only) < 10:
                 score -= 0.5
             elif len(response_only) < 30:
@@ -184,14 +194,18 @@ class RewardEngine:
                 # 安全违规惩罚
                 safety_check = self.check_safety_violations(prompt, text)
                 score += safety_check["penalty"] * self.safety_weight
+                violations = safety_check["violations"]
                 
                 # 正向安全加分
                 safety_bonus = self.check_safety_positives(text)
                 score += safety_bonus * self.safety_weight
                 
             rewards.append(score)
+            if details is not None:
+                details.append(violations)
         return rewards
 
+    @traced("teacher_scoring")
     def get_teacher_rewards(self, prompts: List[str], completions: List[str]) -> List[float]:
         """调用 DeepSeek 教师打分"""
         rewards = []
@@ -205,21 +219,31 @@ class RewardEngine:
             rewards.append(res["overall_score"])
         return rewards
 
-    def compute_rewards(self, prompts: List[str], completions: List[str]) -> List[torch.Tensor]:
+    def compute_rewards_detailed(self, prompts: List[str], completions: List[str]):
         """
         组合奖励（针对合规安全优化）：
         Total = 0.5 * Rule(含安全检查) + 0.5 * Teacher(安全性40%权重)
         安全性整体权重提升
+        返回: (总奖励列表, 每条的拆解 {"rule", "teacher", "violations"})
         """
-        rule_scores = self.get_rule_rewards(completions, prompts)  # 传入prompts用于安全检查
+        violations = []
+        rule_scores = self.get_rule_rewards(completions, prompts, details=violations)  # 传入prompts用于安全检查
         teacher_scores = self.get_teacher_rewards(prompts, completions)
         
-        final_rewards = []
-        for r, t in zip(rule_scores, teacher_scores):
+        totals, breakdown = [], []
+        for r, t, v in zip(rule_scores, teacher_scores, violations):
             # 组合公式（安全性导向：规则和教师各50%）
             total = 0.5 * r + 0.5 * t
             # 截断范围，避免梯度爆炸
             total = max(-3.0, min(2.0, total))  # 允许更大惩罚（-3.0）以强化安全性
-            final_rewards.append(torch.tensor(total))
+            totals.append(total)
+            breakdown.append({"rule": r, "teacher": t, "violations": v})
             
-        return final_rewards
+        return totals, breakdown
+
+    def compute_rewards(self, prompts: List[str], completions: List[str]) -> List["torch.Tensor"]:
+        """组合奖励，返回 PPOTrainer.step 需要的张量列表"""
+        import torch
+
+        totals, _ = self.compute_rewards_detailed(prompts, completions)
+        return [torch.tensor(total) for total in totals]
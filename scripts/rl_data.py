@@ -0,0 +1,92 @@
+# scripts/rl_data.py
+"""
+RL 训练（train_ppo / train_grpo）共用的数据准备：提示模板、种子数据、分词、collate 与确定性批次顺序。
+"""
+import json
+import os
+from typing import Any, Dict, List
+
+import torch
+
+from dataset_io import resolve_path, to_hf_dataset
+
+SYSTEM_PROMPT = "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。"
+
+SEED_DATA = [
+    {
+        "instruction": SYSTEM_PROMPT,
+        "input": "我爸突然剧烈胸痛出冷汗，还呼吸困难，该怎么办？",
+        "output": "<think>评估急性冠脉综合征/主动脉夹层/肺栓塞红旗...</think> 请立即拨打120并保持安静体位，等待急救。",
+    },
+    {
+        "instruction": SYSTEM_PROMPT,
+        "input": "两岁孩子持续高烧40度，还抽搐了怎么办？",
+        "output": "<think>儿童高热惊厥，高风险；需紧急就医。</think> 侧卧位防误吸，立即急诊或拨打120。",
+    },
+    {
+        "instruction": SYSTEM_PROMPT,
+        "input": "头痛三天了，可以吃阿莫西林吗？",
+        "output": "<think>头痛病因复杂，抗生素滥用风险。</think> 不建议自行用阿莫西林，若持续或有红旗症状请就医。",
+    },
+    {
+        "instruction": SYSTEM_PROMPT,
+        "input": "我正在怀孕，能不能吃布洛芬？",
+        "output": "<think>孕期药物需谨慎。</think> 布洛芬孕早晚期需避免，建议咨询产科医生或用对乙酰氨基酚。",
+    },
+    {
+        "instruction": SYSTEM_PROMPT,
+        "input": "感觉心慌胸闷，需要去医院吗？",
+        "output": "<think>需排除心血管风险。</think> 若伴胸痛/出汗/呼吸困难请立即就医，必要时拨打120。",
+    },
+]
+
+
+def write_seed_data(data_path: str, repeat: int = 1):
+    os.makedirs(os.path.dirname(data_path) or ".", exist_ok=True)
+    with open(data_path, "w", encoding="utf-8") as f:
+        for _ in range(repeat):
+            for it in SEED_DATA:
+                json.dump(it, f, ensure_ascii=False)
+                f.write("\n")
+
+
+def build_dataset(tokenizer, data_path: str):
+    # RL 只需要 input 与 risk_level 两列；已转换为 Parquet 时按列读取
+    dataset = to_hf_dataset(resolve_path(data_path), columns=["input", "risk_level"])
+
+    def tokenize(sample):
+        prompt_text = (
+            f"<|im_start|>system\n{SYSTEM_PROMPT}<|im_end|>\n"
+            f"<|im_start|>user\n{sample['input']}<|im_end|>\n"
+            f"<|im_start|>assistant\n"
+        )
+        tokenized = tokenizer(prompt_text, add_special_tokens=False)
+        return {
+            "input_ids": tokenized["input_ids"],
+            "attention_mask": tokenized["attention_mask"],
+            "query_text": sample["input"],  # 原始用户问题，用于奖励
+            "risk_level": sample["risk_level"] or "unknown",
+        }
+
+    return dataset.map(tokenize, batched=False, remove_columns=dataset.column_names)
+
+
+def make_collate_fn(tokenizer):
+    def collate_fn(features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # 将列表形式的 input_ids/attention_mask pad 成张量，同时保留原始 query_text
+        batch = tokenizer.pad(
+            {k: [f[k] for f in features] for k in ["input_ids", "attention_mask"]},
+            padding=True,
+            return_tensors="pt",
+        )
+        batch["query_text"] = [f["query_text"] for f in features]
+        batch["risk_level"] = [f["risk_level"] for f in features]
+        return batch
+
+    return collate_fn
+
+
+def batch_order(num_rows: int, batch_size: int, seed: int) -> List[List[int]]:
+    """由 seed 唯一确定的样本顺序（丢弃不足一个 batch 的尾部），续训时据此定位到下一个 batch"""
+    order = torch.randperm(num_rows, generator=torch.Generator().manual_seed(seed)).tolist()
+    return [order[i:i + batch_size] for i in range(0, num_rows - batch_size + 1, batch_size)]
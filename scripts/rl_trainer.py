@@ -0,0 +1,97 @@
+# scripts/rl_trainer.py
+"""
+项目内的 PPOTrainer 扩展。
+注意：需在 train_ppo.py 完成 transformers.top_k_top_p_filtering 兼容补丁之后再导入（依赖 trl）。
+
+环境变量：SHARED_REF_FORWARD=0 关闭策略/参考同批前向（退回 TRL 原先的两次前向）
+"""
+import os
+
+import torch
+from trl import PPOTrainer
+
+SHARED_REF_FORWARD = os.environ.get("SHARED_REF_FORWARD", "1") != "0"
+
+
+class MedicalPPOTrainer(PPOTrainer):
+    """
+    1. 在 step() 的第一次无梯度前向（旧策略 logprobs）中顺带记录每条回答 token 的 logprob，
+       供 rollout_store 持久化，不增加额外前向。
+    2. 策略为 PEFT 模型时，参考模型就是关闭 adapter 的同一基座（TRL 不再复制一份）。
+       shared_ref_forward 开启时，step() 中策略与参考的两次无梯度前向合并为一次：
+       每个微批前半行走 adapter、后半行走 "__base__"（PEFT 混合 adapter batch），
+       参考结果暂存，TRL 随后请求参考 logprobs 时直接返回。
+    """
+
+    last_response_logprobs = None
+    shared_ref_forward = SHARED_REF_FORWARD
+    _record_next = False
+    _fuse_next = False
+    _ref_stash = None
+
+    def step(self, queries, responses, scores, response_masks=None):
+        self._record_next = True
+        self._fuse_next = self.shared_ref_forward and self.is_peft_model
+        self._ref_stash = None
+        try:
+            return super().step(queries, responses, scores, response_masks=response_masks)
+        finally:
+            self._fuse_next = False
+            self._ref_stash = None
+
+    def batched_forward_pass(self, model, queries, responses, model_inputs, return_logits=False, response_masks=None):
+        if self._ref_stash is not None and not torch.is_grad_enabled():
+            out, self._ref_stash = self._ref_stash, None
+            return out
+        if self._fuse_next and not torch.is_grad_enabled():
+            self._fuse_next = False
+            out, self._ref_stash = self.fused_policy_ref_pass(
+                model, queries, responses, model_inputs, return_logits=return_logits, response_masks=response_masks
+            )
+        else:
+            out = super().batched_forward_pass(
+                model, queries, responses, model_inputs, return_logits=return_logits, response_masks=response_masks
+            )
+        if self._record_next and not torch.is_grad_enabled():
+            logprobs, _, _, masks = out
+            self.last_response_logprobs = [lp[m.bool()].float().cpu().tolist() for lp, m in zip(logprobs, masks)]
+            self._record_next = False
+        return out
+
+    def fused_policy_ref_pass(self, model, queries, responses, model_inputs, return_logits=False, response_masks=None):
+        """
+        一次前向同时得到策略与参考（adapter 关闭）的 (logprobs, logits, values, masks)。
+        PEFT 的混合 adapter batch 只能在 eval 模式下使用，因此该前向不带 dropout。
+        """
+        n = len(queries)
+        fbs = self.config.mini_batch_size
+        order, is_ref = [], []
+        for start in range(0, n, fbs):
+            rows = list(range(start, min(start + fbs, n)))
+            order += rows + rows
+            is_ref += [False] * len(rows) + [True] * len(rows)
+
+        adapter = self.accelerator.unwrap_model(model).pretrained_model.active_adapter
+        fused_inputs = {k: v[order] for k, v in model_inputs.items()}
+        fused_inputs["adapter_names"] = ["__base__" if r else adapter for r in is_ref]
+        fused_masks = [response_masks[i] for i in order] if response_masks is not None else None
+
+        was_training = model.training
+        model.eval()
+        self.config.mini_batch_size = 2 * fbs
+        try:
+            outputs = super().batched_forward_pass(
+                model, [queries[i] for i in order], [responses[i] for i in order], fused_inputs,
+                return_logits=return_logits, response_masks=fused_masks,
+            )
+        finally:
+            self.config.mini_batch_size = fbs
+            model.train(was_training)
+
+        policy_idx = torch.tensor([i for i, r in enumerate(is_ref) if not r])
+        ref_idx = torch.tensor([i for i, r in enumerate(is_ref) if r])
+
+        def pick(idx):
+            return tuple(t[idx.to(t.device)] if t is not None else None for t in outputs)
+
+        return pick(policy_idx), pick(ref_idx)
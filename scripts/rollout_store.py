@@ -0,0 +1,140 @@
+# scripts/rollout_store.py
+"""
+PPO rollout 持久化与经验回放。
+
+每个 PPO batch 的 (query ids, response ids, reward, 策略 logprobs, 奖励拆解) 追加写入
+Parquet 分片（列式 + zstd 压缩，token 列为 list<int32>），生成与教师打分只付一次费用：
+- sample()：按优先级（低奖励 / 高风险）重采样，供额外 PPO 轮次复用，不再生成、不再调教师
+- iter_batches()：按列投影、分批读取，做离线分析时内存有界
+优先级只读取 reward / risk_level 两列；取样本时只读命中的分片。
+
+注意：回放样本是旧策略的输出，TRL 的 step 会用当前策略重算 old logprobs，
+因此回放等价于把旧样本当作当前样本做一次更新；REPLAY_EVERY 不宜过密。
+"""
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCHEMA = pa.schema([
+    ("step", pa.int32()),
+    ("query_ids", pa.list_(pa.int32())),
+    ("response_ids", pa.list_(pa.int32())),
+    ("reward", pa.float32()),
+    ("logprobs", pa.list_(pa.float32())),
+    ("rule_reward", pa.float32()),
+    ("teacher_reward", pa.float32()),
+    ("violations", pa.list_(pa.string())),
+    ("risk_level", pa.string()),
+    ("query_text", pa.string()),
+    ("response_text", pa.string()),
+])
+
+# 高风险样本在回放中的额外权重
+RISK_BOOST = {"critical": 3.0, "high": 2.0}
+
+
+class RolloutStore:
+    def __init__(self, root: str, rows_per_shard: int = 512):
+        self.root = root
+        self.rows_per_shard = rows_per_shard
+        os.makedirs(root, exist_ok=True)
+        self._buffer: List[Dict] = []
+        self._shards = sorted(f for f in os.listdir(root) if f.endswith(".parquet"))
+
+    # ---- 写入 ----
+    def add_batch(self, step: int, query_ids, response_ids, rewards, logprobs=None,
+                  breakdown=None, risk_levels=None, query_texts=None, response_texts=None):
+        n = len(query_ids)
+        for i in range(n):
+            detail = breakdown[i] if breakdown else {}
+            self._buffer.append({
+                "step": step,
+                "query_ids": [int(x) for x in query_ids[i]],
+                "response_ids": [int(x) for x in response_ids[i]],
+                "reward": float(rewards[i]),
+                "logprobs": [float(x) for x in logprobs[i]] if logprobs is not None else None,
+                "rule_reward": detail.get("rule"),
+                "teacher_reward": detail.get("teacher"),
+                "violations": detail.get("violations", []),
+                "risk_level": risk_levels[i] if risk_levels else "unknown",
+                "query_text": query_texts[i] if query_texts else None,
+                "response_text": response_texts[i] if response_texts else None,
+            })
+        if len(self._buffer) >= self.rows_per_shard:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        name = f"part-{len(self._shards):05d}.parquet"
+        tmp = os.path.join(self.root, name + ".tmp")
+        pq.write_table(pa.Table.from_pylist(self._buffer, schema=SCHEMA), tmp, compression="zstd")
+        os.replace(tmp, os.path.join(self.root, name))
+        self._shards.append(name)
+        self._buffer = []
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._shards)
+
+    def truncate(self, num_shards: int):
+        """断点续训：删除 checkpoint 之后写出的分片并丢弃缓冲，使存储与恢复的训练步一致"""
+        for name in self._shards[num_shards:]:
+            os.remove(os.path.join(self.root, name))
+        self._shards = self._shards[:num_shards]
+        self._buffer = []
+
+    # ---- 读取 ----
+    def __len__(self):
+        on_disk = sum(pq.ParquetFile(os.path.join(self.root, s)).metadata.num_rows for s in self._shards)
+        return on_disk + len(self._buffer)
+
+    def iter_batches(self, columns: Optional[List[str]] = None, batch_size: int = 1024):
+        """按列投影分批读取（pyarrow.RecordBatch），内存占用与 batch_size 成正比"""
+        for shard in self._shards:
+            pf = pq.ParquetFile(os.path.join(self.root, shard))
+            yield from pf.iter_batches(batch_size=batch_size, columns=columns)
+        if self._buffer:
+            table = pa.Table.from_pylist(self._buffer, schema=SCHEMA)
+            yield from (table.select(columns) if columns else table).to_batches(batch_size)
+
+    def priorities(self, alpha: float = 1.0, eps: float = 0.05) -> np.ndarray:
+        """优先级 = (max_reward - reward + eps)^alpha * 风险权重，只读 reward/risk_level 两列"""
+        rewards, boosts = [], []
+        for batch in self.iter_batches(columns=["reward", "risk_level"]):
+            rewards.append(batch.column("reward").to_numpy(zero_copy_only=False))
+            boosts.append(np.array([RISK_BOOST.get(r, 1.0) for r in batch.column("risk_level").to_pylist()]))
+        if not rewards:
+            return np.zeros(0)
+        rewards = np.concatenate(rewards).astype(np.float64)
+        gap = rewards.max() - rewards + eps
+        return np.power(gap, alpha) * np.concatenate(boosts)
+
+    def sample(self, n: int, alpha: float = 1.0, seed: Optional[int] = None) -> Dict[str, list]:
+        """按优先级无放回采样 n 条，返回 {列名: 列表}"""
+        prio = self.priorities(alpha)
+        if len(prio) == 0:
+            return {}
+        rng = np.random.default_rng(seed)
+        picked = np.sort(rng.choice(len(prio), size=min(n, len(prio)), replace=False, p=prio / prio.sum()))
+
+        columns = ["query_ids", "response_ids", "reward", "risk_level"]
+        out = {c: [] for c in columns}
+        offset = 0
+        tables = [(s, None) for s in self._shards] + ([(None, self._buffer)] if self._buffer else [])
+        for shard, rows in tables:
+            num = pq.ParquetFile(os.path.join(self.root, shard)).metadata.num_rows if shard else len(rows)
+            local = picked[(picked >= offset) & (picked < offset + num)] - offset
+            if len(local):
+                if shard:
+                    table = pq.read_table(os.path.join(self.root, shard), columns=columns, memory_map=True)
+                else:
+                    table = pa.Table.from_pylist(rows, schema=SCHEMA).select(columns)
+                part = table.take(pa.array(local))
+                for c in columns:
+                    out[c].extend(part.column(c).to_pylist())
+            offset += num
+        return out
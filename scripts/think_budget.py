@@ -0,0 +1,195 @@
+# scripts/think_budget.py
+"""
+<think> 结构感知的生成控制（LogitsProcessor，可用于 HF generate / generation.generate / PPO rollout）：
+1. 思考预算：<think> 内 token 数达到 think_budget 仍未闭合时，强制输出 </think>
+2. 回答预算：</think> 之后再生成 answer_budget 个 token 即强制 EOS，保证回答不会被思考挤掉
+3. 领域停止序列：回答中出现停止序列（如模型开始续写下一轮对话）时强制 EOS
+按样本逐行处理，批量生成时每行独立计数；统计信息用于评估截断比例与每个有效回答的 token 开销。
+
+环境变量：THINK_BUDGET（默认 0 = 关闭）、ANSWER_BUDGET（默认 256）
+"""
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import torch
+
+# 模型开始续写下一轮对话/模板标记时立即停止
+DEFAULT_STOP_SEQUENCES = ("<|im_start|>", "<|endoftext|>", "\n用户：", "\nuser\n")
+STOP_WINDOW_TOKENS = 8
+
+
+@dataclass
+class _RowState:
+    length: int = 0          # 已处理的生成 token 数
+    opened: bool = False
+    closed: bool = False
+    think_len: int = 0
+    answer_len: int = 0
+    forced_close: bool = False
+    answer_truncated: bool = False
+    stopped: bool = False
+    done: bool = False
+    tail: List[int] = field(default_factory=list)
+
+
+@dataclass
+class ThinkBudgetStats:
+    rows: int = 0
+    forced_close: int = 0
+    answer_truncated: int = 0
+    stop_hits: int = 0
+    think_tokens: List[int] = field(default_factory=list)
+    answer_tokens: List[int] = field(default_factory=list)
+
+    def summary(self) -> dict:
+        def pct(values, q):
+            if not values:
+                return 0
+            s = sorted(values)
+            return s[min(len(s) - 1, int(q * len(s)))]
+
+        totals = [t + a for t, a in zip(self.think_tokens, self.answer_tokens)]
+        useful = sum(1 for a in self.answer_tokens if a > 0)
+        return {
+            "rows": self.rows,
+            "forced_close": self.forced_close,
+            "answer_truncated": self.answer_truncated,
+            "stop_hits": self.stop_hits,
+            "mean_think_tokens": round(sum(self.think_tokens) / max(self.rows, 1), 1),
+            "mean_answer_tokens": round(sum(self.answer_tokens) / max(self.rows, 1), 1),
+            "p50_total_tokens": pct(totals, 0.5),
+            "p95_total_tokens": pct(totals, 0.95),
+            "tokens_per_useful_answer": round(sum(totals) / max(useful, 1), 1),
+        }
+
+
+class ThinkBudgetProcessor:
+    """
+    实现 LogitsProcessor 协议（__call__(input_ids, scores) -> scores）。
+    状态按行增量更新；输入长度与上次不连续时（投机解码回退草稿）对该行整体重扫。
+    调用 begin(prompt_len) 固定提示长度（到下一次 flush 为止）；未调用时（如外部直接调 model.generate）
+    自动把长度不连续的调用视为新一轮 generate。这一启发式在新一轮的提示长度恰好等于上一轮结束长度 + 1 时会误判，
+    能拿到提示长度的调用方都应先调用 begin。
+    """
+
+    def __init__(self, tokenizer, think_budget: int = 384, answer_budget: int = 256,
+                 stop_sequences=DEFAULT_STOP_SEQUENCES):
+        self.tokenizer = tokenizer
+        self.think_budget = think_budget
+        self.answer_budget = answer_budget
+        self.stop_sequences = tuple(stop_sequences or ())
+        self.open_ids = tokenizer.encode("<think>", add_special_tokens=False)
+        self.close_ids = tokenizer.encode("</think>", add_special_tokens=False)
+        eos = tokenizer.eos_token_id
+        self.eos_id = eos[0] if isinstance(eos, list) else eos
+        self.stats = ThinkBudgetStats()
+        self._prompt_len: Optional[int] = None
+        self._fixed = False
+        self._last_len = -1
+        self._rows: List[_RowState] = []
+
+    # ---- 生命周期 ----
+    def begin(self, prompt_len: int):
+        self.flush()
+        self._prompt_len = prompt_len
+        self._fixed = True
+        self._last_len = prompt_len - 1
+
+    def flush(self):
+        """把当前一轮各行的计数并入 stats，并结束这一轮（begin 固定的提示长度随之失效）"""
+        self._fixed = False
+        for st in self._rows:
+            self.stats.rows += 1
+            self.stats.forced_close += int(st.forced_close)
+            self.stats.answer_truncated += int(st.answer_truncated)
+            self.stats.stop_hits += int(st.stopped)
+            self.stats.think_tokens.append(st.think_len)
+            self.stats.answer_tokens.append(st.answer_len)
+        self._rows = []
+
+    # ---- 状态更新 ----
+    def _push(self, st: _RowState, tok: int):
+        st.length += 1
+        st.tail.append(tok)
+        if len(st.tail) > STOP_WINDOW_TOKENS:
+            st.tail.pop(0)
+        if not st.opened and not st.closed:
+            if st.tail[-len(self.open_ids):] == self.open_ids:
+                st.opened = True
+            elif st.length > len(self.open_ids) + 2:
+                # 没有以 <think> 开头，直接视为回答
+                st.closed = True
+            return
+        if st.opened and not st.closed:
+            if st.tail[-len(self.close_ids):] == self.close_ids:
+                st.closed = True
+                st.think_len -= len(self.close_ids) - 1
+            else:
+                st.think_len += 1
+            return
+        if tok == self.eos_id:
+            st.done = True
+            return
+        st.answer_len += 1
+        if self.stop_sequences and st.answer_len > 0:
+            text = self.tokenizer.decode(st.tail, skip_special_tokens=False)
+            if any(text.endswith(s) for s in self.stop_sequences):
+                st.stopped = True
+                st.done = True
+
+    def _sync_row(self, b: int, row_ids: torch.Tensor):
+        gen_len = row_ids.shape[0] - self._prompt_len
+        st = self._rows[b]
+        if gen_len == st.length + 1:
+            self._push(st, int(row_ids[-1]))
+        elif gen_len != st.length:
+            # 非连续（草稿被拒后回退），整行重扫
+            kept = (st.forced_close, st.answer_truncated)
+            st = self._rows[b] = _RowState()
+            st.forced_close, st.answer_truncated = kept
+            for tok in row_ids[self._prompt_len:].tolist():
+                self._push(st, tok)
+        return st
+
+    def _force(self, scores: torch.Tensor, b: int, tok: int):
+        scores[b, :] = -float("inf")
+        scores[b, tok] = 0.0
+
+    def __call__(self, input_ids: torch.Tensor, scores: torch.Tensor) -> torch.Tensor:
+        batch, cur_len = input_ids.shape
+        if not self._fixed and cur_len != self._last_len + 1:
+            self.flush()
+            self._prompt_len = cur_len
+        self._last_len = cur_len
+        if len(self._rows) != batch:
+            self._rows = [_RowState() for _ in range(batch)]
+
+        for b in range(batch):
+            st = self._sync_row(b, input_ids[b])
+            if st.done:
+                self._force(scores, b, self.eos_id)
+            elif st.opened and not st.closed and st.think_len >= self.think_budget:
+                # 已输出的 </think> 前缀长度（多 token 时逐个补齐）
+                k = 0
+                for n in range(len(self.close_ids) - 1, 0, -1):
+                    if st.tail[-n:] == self.close_ids[:n]:
+                        k = n
+                        break
+                st.forced_close = True
+                self._force(scores, b, self.close_ids[k])
+            elif st.closed and st.answer_len >= self.answer_budget:
+                st.answer_truncated = True
+                self._force(scores, b, self.eos_id)
+        return scores
+
+
+def make_think_controller(tokenizer, think_budget=None, answer_budget=None) -> Optional[ThinkBudgetProcessor]:
+    """按参数或环境变量创建控制器；think_budget 为 0 时返回 None（不启用）"""
+    if think_budget is None:
+        think_budget = int(os.environ.get("THINK_BUDGET", "0"))
+    if answer_budget is None:
+        answer_budget = int(os.environ.get("ANSWER_BUDGET", "256"))
+    if think_budget <= 0:
+        return None
+    return ThinkBudgetProcessor(tokenizer, think_budget=think_budget, answer_budget=answer_budget)
@@ -0,0 +1,233 @@
+# scripts/think_spans.py
+"""
+<think>…</think> 结构的批量解析：直接在 Arrow 字符串数组上计算思考/回答区间，不拷贝子串。
+
+- parse_spans(array)：pc.find_substring 得到标签的字节偏移；对数据缓冲区按"非 UTF-8 续字节"做前缀和，
+  把字节偏移换算成字符偏移/长度。返回 pyarrow.Table，每行：
+  has_think、unclosed_think、think_char_start、think_chars、answer_char_start、answer_chars、
+  think_byte_start/end、answer_byte_start/end、total_chars
+  （取第一个 <think> 及其后第一个 </think>；没有完整 <think>…</think> 时整段视为回答；回答区间不去除首尾空白）
+- span_stats(spans)：覆盖率、未闭合比例、字符长度分位数与直方图；可附带 token 长度分布
+- token_lengths(tokenizer, array, spans)：按区间切出思考/回答，fast tokenizer 批量计数
+- split_think_answer(text) / has_think(text)：单条文本版本，与 parse_spans 的区间规则一致
+  （demo、eval_auto、reward_fn 与 examples 共用）
+
+numpy / pyarrow 只在批量解析时才导入，只用单条版本的脚本不付导入开销。
+
+统计报告（写入 eval_report/think_stats_<name>.json）与逐条正则的耗时对比：
+    python scripts/think_spans.py data/processed/train.jsonl [models/Qwen/Qwen3-1.7B]
+    python scripts/think_spans.py --bench data/processed/train.jsonl
+"""
+import json
+import os
+import re
+import sys
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pyarrow as pa
+
+OPEN_TAG, CLOSE_TAG = "<think>", "</think>"
+CHUNK_ROWS = 65536  # 每块的前缀和数组为 int32，块内字节数需 < 2GB
+LENGTH_BUCKETS = (0, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _find_span(text: str) -> Tuple[int, int]:
+    """第一个 <think> 的位置及其后第一个 </think> 的位置；不完整时 (-1, -1)"""
+    start = text.find(OPEN_TAG)
+    end = text.find(CLOSE_TAG, start + len(OPEN_TAG)) if start >= 0 else -1
+    return (start, end) if end >= 0 else (-1, -1)
+
+
+def has_think(text: str) -> bool:
+    return _find_span(text)[0] >= 0
+
+
+def split_think_answer(text: str) -> Tuple[str, str]:
+    """返回 (思考, 回答)，均去除首尾空白；没有完整 <think>…</think> 时返回 ("", 原文)"""
+    start, end = _find_span(text)
+    if start < 0:
+        return "", text
+    return text[start + len(OPEN_TAG):end].strip(), text[end + len(CLOSE_TAG):].strip()
+
+
+def _chunk_spans(chunk: "pa.Array") -> Dict[str, "np.ndarray"]:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if chunk.null_count:
+        chunk = pc.fill_null(chunk, "")
+    n = len(chunk)
+    offset_type = np.int64 if pa.types.is_large_string(chunk.type) else np.int32
+    offsets = np.frombuffer(chunk.buffers()[1], dtype=offset_type)[chunk.offset:chunk.offset + n + 1].astype(np.int64)
+    data_buf = chunk.buffers()[2]
+    data = np.frombuffer(data_buf, dtype=np.uint8) if data_buf is not None else np.zeros(0, dtype=np.uint8)
+
+    open_b = pc.find_substring(chunk, OPEN_TAG).to_numpy(zero_copy_only=False).astype(np.int64)
+    close_b = pc.find_substring(chunk, CLOSE_TAG).to_numpy(zero_copy_only=False).astype(np.int64)
+    byte_len = np.diff(offsets)
+    # find_substring 只给出各自第一次出现的位置；</think> 出现在第一个 <think> 之前的少数行，
+    # 在该行字节上从 <think> 之后重新查找
+    for i in np.flatnonzero((open_b >= 0) & (close_b >= 0) & (close_b < open_b)):
+        row = data[offsets[i]:offsets[i + 1]].tobytes()
+        close_b[i] = row.find(CLOSE_TAG.encode("utf-8"), open_b[i] + len(OPEN_TAG))
+    has = (open_b >= 0) & (close_b > open_b)
+
+    think_bs = np.where(has, open_b + len(OPEN_TAG), 0)
+    think_be = np.where(has, close_b, 0)
+    answer_bs = np.where(has, close_b + len(CLOSE_TAG.encode("utf-8")), 0)
+    answer_be = byte_len
+
+    # 字节偏移 -> 字符偏移：非续字节（不是 10xxxxxx）的前缀和
+    lo, hi = int(offsets[0]), int(offsets[-1])
+    cum = np.zeros(hi - lo + 1, dtype=np.int32)
+    np.cumsum((data[lo:hi] & 0xC0) != 0x80, out=cum[1:])
+    base = offsets[:-1] - lo
+    row_start = cum[base]
+
+    def char_pos(byte_pos):
+        return cum[base + byte_pos] - row_start
+
+    think_cs, answer_cs = char_pos(think_bs), char_pos(answer_bs)
+    return {
+        "has_think": has,
+        "unclosed_think": (open_b >= 0) & ~has,
+        "think_char_start": think_cs,
+        "think_chars": char_pos(think_be) - think_cs,
+        "answer_char_start": answer_cs,
+        "answer_chars": char_pos(answer_be) - answer_cs,
+        "total_chars": char_pos(byte_len),
+        "think_byte_start": think_bs,
+        "think_byte_end": think_be,
+        "answer_byte_start": answer_bs,
+        "answer_byte_end": answer_be,
+    }
+
+
+def parse_spans(array) -> "pa.Table":
+    """array：pa.StringArray / ChunkedArray / 字符串列表"""
+    import numpy as np
+    import pyarrow as pa
+
+    if isinstance(array, list):
+        array = pa.array(array, type=pa.string())
+    chunks = array.chunks if isinstance(array, pa.ChunkedArray) else [array]
+    parts = []
+    for chunk in chunks:
+        for start in range(0, len(chunk), CHUNK_ROWS):
+            parts.append(_chunk_spans(chunk.slice(start, CHUNK_ROWS)))
+    if not parts:
+        parts = [_chunk_spans(pa.array([], type=pa.string()))]
+    return pa.table({k: np.concatenate([p[k] for p in parts]) for k in parts[0]})
+
+
+def token_lengths(tokenizer, array, spans: "pa.Table", batch_size: int = 1024) -> Dict[str, "np.ndarray"]:
+    """思考/回答的 token 数（需要切出子串交给分词器，按批进行）"""
+    import numpy as np
+    import pyarrow as pa
+
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    think_cs = spans.column("think_char_start").to_numpy()
+    think_n = spans.column("think_chars").to_numpy()
+    answer_cs = spans.column("answer_char_start").to_numpy()
+    answer_n = spans.column("answer_chars").to_numpy()
+    think_tok, answer_tok = [], []
+    for start in range(0, len(array), batch_size):
+        texts = [t or "" for t in array.slice(start, batch_size).to_pylist()]
+        idx = range(start, start + len(texts))
+        thinks = [t[think_cs[i]:think_cs[i] + think_n[i]] for t, i in zip(texts, idx)]
+        answers = [t[answer_cs[i]:answer_cs[i] + answer_n[i]] for t, i in zip(texts, idx)]
+        think_tok += [len(x) for x in tokenizer(thinks, add_special_tokens=False)["input_ids"]]
+        answer_tok += [len(x) for x in tokenizer(answers, add_special_tokens=False)["input_ids"]]
+    return {"think_tokens": np.array(think_tok, dtype=np.int32), "answer_tokens": np.array(answer_tok, dtype=np.int32)}
+
+
+def _distribution(values: "np.ndarray") -> dict:
+    import numpy as np
+
+    if len(values) == 0:
+        return {}
+    pct = np.percentile(values, [50, 90, 99]).round(1).tolist()
+    hist = np.histogram(values, bins=list(LENGTH_BUCKETS) + [max(int(values.max()) + 1, LENGTH_BUCKETS[-1] + 1)])[0]
+    return {
+        "mean": round(float(values.mean()), 1),
+        "p50": pct[0], "p90": pct[1], "p99": pct[2],
+        "max": int(values.max()),
+        "histogram": {f">={b}": int(c) for b, c in zip(LENGTH_BUCKETS, hist)},
+    }
+
+
+def span_stats(spans: "pa.Table", tokens: Optional[Dict[str, "np.ndarray"]] = None) -> dict:
+    has = spans.column("has_think").to_numpy(zero_copy_only=False)
+    n = len(has)
+    think_chars = spans.column("think_chars").to_numpy()
+    answer_chars = spans.column("answer_chars").to_numpy()
+    report = {
+        "rows": n,
+        "think_coverage": round(float(has.mean()), 4) if n else 0.0,
+        "unclosed_think": int(spans.column("unclosed_think").to_numpy(zero_copy_only=False).sum()),
+        "empty_answer": int((answer_chars == 0).sum()),
+        "think_chars": _distribution(think_chars[has]),
+        "answer_chars": _distribution(answer_chars),
+        "total_chars": _distribution(spans.column("total_chars").to_numpy()),
+    }
+    for key, values in (tokens or {}).items():
+        report[key] = _distribution(values)
+    return report
+
+
+def benchmark(array) -> dict:
+    texts = array.to_pylist() if hasattr(array, "to_pylist") else list(array)
+    pattern = re.compile(r"<think>(.*?)</think>\s*(.*)", re.S)  # 原先各脚本逐条使用的正则
+    start = time.perf_counter()
+    regex_has = sum(1 for t in texts if pattern.search(t or ""))
+    regex_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    spans = parse_spans(array)
+    arrow_sec = time.perf_counter() - start
+    return {
+        "rows": len(texts),
+        "regex_sec": round(regex_sec, 3),
+        "arrow_sec": round(arrow_sec, 3),
+        "speedup": round(regex_sec / max(arrow_sec, 1e-9), 1),
+        "same_coverage": regex_has == int(spans.column("has_think").to_numpy(zero_copy_only=False).sum()),
+    }
+
+
+def main():
+    from dataset_io import read_table, resolve_path
+
+    args = [a for a in sys.argv[1:] if a != "--bench"]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    path = resolve_path(args[0])
+    column = read_table(path, ["output"]).column("output")
+    if "--bench" in sys.argv:
+        print(json.dumps(benchmark(column), indent=2))
+        return
+
+    start = time.perf_counter()
+    spans = parse_spans(column)
+    tokens = None
+    if len(args) > 1:
+        from tokenizer_utils import load_tokenizer
+
+        tokens = token_lengths(load_tokenizer(args[1]), column, spans)
+    report = span_stats(spans, tokens)
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    os.makedirs("eval_report", exist_ok=True)
+    name = os.path.splitext(os.path.basename(path))[0]
+    out = os.path.join("eval_report", f"think_stats_{name}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"✅ Saved: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# scripts/tokenizer_utils.py
+"""
+分词器加载（默认 Rust 实现的 fast tokenizer）+ 本地序列化缓存 + 与 slow 版本的一致性校验/基准。
+
+- load_tokenizer(path)：USE_FAST_TOKENIZER=0 时退回原先的 slow（纯 Python）实现
+- 首次加载后把 fast tokenizer 序列化到 TOKENIZER_CACHE_DIR（单个 tokenizer.json），
+  之后直接从缓存反序列化，跳过 vocab/merges 解析与 slow->fast 转换
+- 源目录文件变化时缓存自动失效
+
+一致性校验（语料 + 聊天模板 + 特殊 token）与编解码吞吐基准：
+    python scripts/tokenizer_utils.py parity models/Qwen/Qwen3-1.7B data/processed/train.jsonl
+    python scripts/tokenizer_utils.py bench  models/Qwen/Qwen3-1.7B data/processed/train.jsonl
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+from transformers import AutoTokenizer
+
+USE_FAST_TOKENIZER = os.environ.get("USE_FAST_TOKENIZER", "1") != "0"
+TOKENIZER_CACHE_DIR = os.environ.get("TOKENIZER_CACHE_DIR", "models/tokenizer_cache")
+PROMPT = "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。"
+TOKENIZER_FILES = ("tokenizer.json", "tokenizer_config.json", "vocab.json", "merges.txt", "special_tokens_map.json", "added_tokens.json")
+
+
+def _cache_dir(path: str) -> str:
+    items = [os.path.abspath(path)]
+    for name in TOKENIZER_FILES:
+        f = os.path.join(path, name)
+        if os.path.exists(f):
+            st = os.stat(f)
+            items.append([name, st.st_size, int(st.st_mtime)])
+    digest = hashlib.sha1(json.dumps(items).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(TOKENIZER_CACHE_DIR, f"{os.path.basename(os.path.normpath(path))}-{digest}")
+
+
+def load_tokenizer(path: str, use_fast=None):
+    """加载分词器；fast 模式优先命中本地序列化缓存"""
+    use_fast = USE_FAST_TOKENIZER if use_fast is None else use_fast
+    if not use_fast:
+        return AutoTokenizer.from_pretrained(path, use_fast=False, trust_remote_code=True)
+
+    cache = _cache_dir(path)
+    if os.path.exists(os.path.join(cache, "tokenizer.json")):
+        return AutoTokenizer.from_pretrained(cache, use_fast=True, trust_remote_code=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(path, use_fast=True, trust_remote_code=True)
+    if tokenizer.is_fast:
+        tmp = f"{cache}.tmp{os.getpid()}"
+        tokenizer.save_pretrained(tmp, legacy_format=False)
+        try:
+            os.replace(tmp, cache)  # 并发写入时先到者生效
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return tokenizer
+
+
+def _corpus_texts(data_path: str, limit: int = 0):
+    """语料中需要分词的全部字符串：input、output，以及训练时拼出的完整模板串"""
+    from dataset_io import iter_records, resolve_path
+
+    texts = []
+    for i, r in enumerate(iter_records(resolve_path(data_path), columns=["input", "output"])):
+        if limit and i >= limit:
+            break
+        texts.append(r["input"])
+        texts.append(r["output"])
+        texts.append(
+            f"<|im_start|>system\n{PROMPT}<|im_end|>\n"
+            f"<|im_start|>user\n{r['input']}<|im_end|>\n"
+            f"<|im_start|>assistant\n{r['output']}<|im_end|>\n"
+        )
+    return texts
+
+
+def check_parity(slow, fast, texts, chat_template=True):
+    """返回不一致样本列表 [(text, slow_ids, fast_ids)]；编码与解码都需一致"""
+    mismatches = []
+    cases = list(texts)
+    if chat_template:
+        for text in texts[::3]:
+            msgs = [{"role": "system", "content": PROMPT}, {"role": "user", "content": text}]
+            cases.append(slow.apply_chat_template(msgs, tokenize=False, add_generation_prompt=True))
+    # 特殊 token 与 <think> 边界
+    cases += ["<|im_start|>", "<|im_end|>", "<think>\n\n</think>\n\n", "<think>头痛</think> 建议就医。"]
+    for text in cases:
+        s_ids = slow(text, add_special_tokens=False)["input_ids"]
+        f_ids = fast(text, add_special_tokens=False)["input_ids"]
+        if s_ids != f_ids or slow.decode(s_ids) != fast.decode(f_ids):
+            mismatches.append((text, s_ids, f_ids))
+    return mismatches
+
+
+def benchmark(slow, fast, texts, batch_size: int = 256) -> dict:
+    """编码/解码吞吐：slow 逐条、fast 逐条、fast 批量"""
+    n_chars = sum(len(t) for t in texts)
+    report = {"texts": len(texts), "chars": n_chars}
+
+    def run(name, fn):
+        start = time.perf_counter()
+        out = fn()
+        sec = time.perf_counter() - start
+        report[name] = {"sec": round(sec, 3), "texts_per_sec": round(len(texts) / max(sec, 1e-9), 1)}
+        return out
+
+    ids = run("slow_encode", lambda: [slow(t, add_special_tokens=False)["input_ids"] for t in texts])
+    run("fast_encode", lambda: [fast(t, add_special_tokens=False)["input_ids"] for t in texts])
+    run("fast_encode_batch", lambda: [
+        x for i in range(0, len(texts), batch_size)
+        for x in fast(texts[i:i + batch_size], add_special_tokens=False)["input_ids"]
+    ])
+    run("slow_decode", lambda: slow.batch_decode(ids, skip_special_tokens=True))
+    run("fast_decode", lambda: fast.batch_decode(ids, skip_special_tokens=True))
+    report["tokens"] = sum(len(x) for x in ids)
+    return report
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ("parity", "bench"):
+        print(__doc__)
+        sys.exit(1)
+    cmd, model_path, data_path = sys.argv[1:4]
+    slow = load_tokenizer(model_path, use_fast=False)
+    start = time.perf_counter()
+    fast = load_tokenizer(model_path, use_fast=True)
+    print(f"⏱️ Fast tokenizer load: {time.perf_counter() - start:.3f}s")
+    texts = _corpus_texts(data_path)
+
+    if cmd == "parity":
+        mismatches = check_parity(slow, fast, texts)
+        if mismatches:
+            for text, s_ids, f_ids in mismatches[:5]:
+                print(f"❌ {text[:60]!r}\n   slow={s_ids[:20]}\n   fast={f_ids[:20]}")
+            print(f"❌ {len(mismatches)} mismatches")
+            sys.exit(1)
+        print(f"✅ Slow/fast tokenizers identical on {len(texts)} corpus strings (+ chat template & special tokens)")
+    else:
+        report = benchmark(slow, fast, texts)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
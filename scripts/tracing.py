@@ -0,0 +1,230 @@
+# scripts/tracing.py
+"""
+全流程轻量埋点：span（上下文管理器 / 装饰器）、计数器、直方图。
+
+- 关闭时（默认）span() 返回同一个空上下文对象，count()/observe() 直接返回，开销接近零
+- TRACE=1 开启：
+    * 每个 span 记录为 Chrome trace-event（ph="X"），进程退出时写入 TRACE_FILE，
+      可在 chrome://tracing 或 https://ui.perfetto.dev 中查看火焰图
+    * span 耗时同时进入按名字聚合的直方图（对数分桶），计数器记录缓存命中等事件
+    * 每 TRACE_SUMMARY_EVERY 秒（默认 60，0 为只在退出时）打印一次汇总表
+- 已埋点：tokenize / prefill / decode / detokenize（generation、batch_predict、demo_gradio），
+  rule_scoring / teacher_call / teacher_cache_hit|miss（reward_fn、deepseek_teacher），
+  ppo_step / ppo_rollout / ppo_reward（train_ppo）
+
+    TRACE=1 TRACE_FILE=traces/predict.json python scripts/batch_predict.py
+    python scripts/tracing.py traces/predict.json    # 从 trace 文件重新打印汇总表
+"""
+import atexit
+import bisect
+import json
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Optional
+
+TRACE = os.environ.get("TRACE", "0") == "1"
+TRACE_FILE = os.environ.get("TRACE_FILE", f"traces/trace_{os.getpid()}.json")
+TRACE_SUMMARY_EVERY = float(os.environ.get("TRACE_SUMMARY_EVERY", "60"))
+TRACE_MAX_EVENTS = int(os.environ.get("TRACE_MAX_EVENTS", "500000"))
+
+# 直方图分桶上界（毫秒）：0.01ms 起每档 ×2，约覆盖到 1.5 小时
+BUCKETS_MS = [0.01 * 2 ** i for i in range(30)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS_MS, value)] += 1
+        self.n += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """桶上界近似（相对误差 ≤ 2 倍），不超过实际最大值"""
+        rank = math.ceil(q * self.n)
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return min(BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max, self.max)
+        return self.max
+
+
+class Tracer:
+    def __init__(self, enabled: bool = TRACE, path: str = TRACE_FILE, summary_every: float = TRACE_SUMMARY_EVERY):
+        self.enabled = enabled
+        self.path = path
+        self.summary_every = summary_every
+        self.events = []
+        self.dropped = 0
+        self.hist: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._last_summary = self._t0
+        self._pid = os.getpid()
+
+    # ---- 记录 ----
+    def record(self, name: str, start: float, end: float, args: Optional[dict] = None):
+        """记录一段已计时的区间（time.perf_counter 秒）"""
+        if not self.enabled:
+            return
+        dur_ms = (end - start) * 1000
+        event = {"name": name, "ph": "X", "ts": round((start - self._t0) * 1e6, 1), "dur": round(dur_ms * 1000, 1),
+                 "pid": self._pid, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.hist.setdefault(name, Histogram()).add(dur_ms)
+            if len(self.events) < TRACE_MAX_EVENTS:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+        self._maybe_summary(end)
+
+    def count(self, name: str, n: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            value = self.counters.get(name, 0) + n
+            self.counters[name] = value
+            if len(self.events) < TRACE_MAX_EVENTS:
+                self.events.append({"name": name, "ph": "C", "ts": round((time.perf_counter() - self._t0) * 1e6, 1),
+                                    "pid": self._pid, "args": {name: value}})
+
+    def observe(self, name: str, value: float):
+        """非耗时类数值（如每条回答的 token 数）进入直方图"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.hist.setdefault(name, Histogram()).add(value)
+
+    # ---- 输出 ----
+    def summary(self) -> str:
+        with self._lock:
+            rows = sorted(self.hist.items(), key=lambda kv: -kv[1].total)
+            counters = dict(self.counters)
+        lines = [f"{'name':<24}{'count':>9}{'total_ms':>12}{'mean_ms':>10}{'p50_ms':>10}{'p95_ms':>10}{'max_ms':>10}"]
+        for name, h in rows:
+            lines.append(f"{name:<24}{h.n:>9}{h.total:>12.1f}{h.total / max(h.n, 1):>10.2f}"
+                         f"{h.quantile(0.5):>10.2f}{h.quantile(0.95):>10.2f}{h.max:>10.2f}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<24}{value:>9g}")
+        return "\n".join(lines)
+
+    def _maybe_summary(self, now: float):
+        if self.summary_every > 0 and now - self._last_summary >= self.summary_every:
+            self._last_summary = now
+            print(f"📊 Trace summary (+{now - self._t0:.0f}s)\n{self.summary()}", flush=True)
+
+    def export(self, path: Optional[str] = None) -> str:
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            data = {"traceEvents": list(self.events), "displayTimeUnit": "ms",
+                    "otherData": {"dropped_events": self.dropped}}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+        return path
+
+    def close(self):
+        if self.enabled and (self.events or self.counters):
+            print(f"📊 Trace summary\n{self.summary()}")
+            print(f"✅ Chrome trace: {self.export()}")
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+tracer = Tracer()
+atexit.register(tracer.close)
+
+
+@contextmanager
+def _span(name: str, args: Optional[dict]):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.record(name, start, time.perf_counter(), args)
+
+
+def span(name: str, **args):
+    """with span("prefill", tokens=n): ...；关闭时返回共享的空上下文"""
+    if not tracer.enabled:
+        return _NULL_SPAN
+    return _span(name, args or None)
+
+
+def traced(name: Optional[str] = None):
+    """函数装饰器版本；关闭时直接调用原函数"""
+    def deco(fn):
+        label = name or fn.__qualname__
+
+        @wraps(fn)
+        def wrapper(*a, **kw):
+            if not tracer.enabled:
+                return fn(*a, **kw)
+            with _span(label, None):
+                return fn(*a, **kw)
+        return wrapper
+    return deco
+
+
+def record(name: str, start: float, end: float, **args):
+    if tracer.enabled:
+        tracer.record(name, start, end, args or None)
+
+
+def count(name: str, n: float = 1):
+    if tracer.enabled:
+        tracer.count(name, n)
+
+
+def observe(name: str, value: float):
+    if tracer.enabled:
+        tracer.observe(name, value)
+
+
+def enabled() -> bool:
+    return tracer.enabled
+
+
+def summarize_file(path: str) -> str:
+    """从已导出的 trace 文件重建汇总表"""
+    with open(path, "r", encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+    t = Tracer(enabled=True, summary_every=0)
+    for e in events:
+        if e["ph"] == "X":
+            t.hist.setdefault(e["name"], Histogram()).add(e["dur"] / 1000)
+        elif e["ph"] == "C":
+            t.counters[e["name"]] = e["args"][e["name"]]
+    return t.summary()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    print(summarize_file(sys.argv[1]))
@@ -1,8 +1,17 @@
 # scripts/train_full.py
-import os, pandas as pd, torch
-from datasets import Dataset
-from modelscope import snapshot_download, AutoTokenizer
-from transformers import AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForSeq2Seq
+import os, torch
+from modelscope import snapshot_download
+from transformers import AutoModelForCausalLM, TrainingArguments, DataCollatorForSeq2Seq
+from tokenizer_utils import load_tokenizer
+from dataset_io import resolve_path, to_hf_dataset
+from chunked_loss import trainer_class
+from length_filter import LENGTH_POLICY, apply_length_policy
+from train_metrics import instrument
+from ddp_sft import ddp_training_kwargs, is_distributed, model_device_map, rank_shard, signature, with_sharded_data
+from zero_optim import with_zero_optimizer
+from activation_ckpt import configure_checkpointing, hf_gradient_checkpointing
+from fast_eval import eval_columns, with_fast_eval
+from chat_template import chat_encoder
 
 BASE = "models/qwen3-1.7b"
 DATA = "data/processed"
@@ -11,14 +20,12 @@ PROMPT = "你是一个医学专家，你需要根据用户的问题，给出带
 MAX_LENGTH = 2048
 
 def process_func(example, tokenizer):
-    instr = tokenizer(
-        f"<|im_start|>system\n{PROMPT}<|im_end|>\n<|im_start|>user\n{example['input']}<|im_end|>\n<|im_start|>assistant\n",
-        add_special_tokens=False,
-    )
+    # 聊天模板的固定片段 token id 已缓存，只对问题文本分词（与模板渲染后整串分词一致）
+    instr_ids = chat_encoder(tokenizer).encode([{"role":"system","content":PROMPT},{"role":"user","content":example["input"]}])
     resp = tokenizer(example["output"], add_special_tokens=False)
-    input_ids = instr["input_ids"] + resp["input_ids"] + [tokenizer.pad_token_id]
-    attention_mask = instr["attention_mask"] + resp["attention_mask"] + [1]
-    labels = [-100]*len(instr["input_ids"]) + resp["input_ids"] + [tokenizer.pad_token_id]
+    input_ids = instr_ids + resp["input_ids"] + [tokenizer.pad_token_id]
+    attention_mask = [1]*len(instr_ids) + resp["attention_mask"] + [1]
+    labels = [-100]*len(instr_ids) + resp["input_ids"] + [tokenizer.pad_token_id]
     if len(input_ids) > MAX_LENGTH:
         input_ids = input_ids[:MAX_LENGTH]
         attention_mask = attention_mask[:MAX_LENGTH]
@@ -28,19 +35,34 @@ def process_func(example, tokenizer):
 def main():
     os.makedirs(OUT, exist_ok=True)
     snapshot_download("Qwen/Qwen3-1.7B", cache_dir="models", revision="master")
-    tokenizer = AutoTokenizer.from_pretrained(os.path.join("models","Qwen","Qwen3-1.7B"), use_fast=False, trust_remote_code=True)
-    model = AutoModelForCausalLM.from_pretrained(os.path.join("models","Qwen","Qwen3-1.7B"), device_map="auto", torch_dtype=torch.bfloat16, trust_remote_code=True)
+    tokenizer = load_tokenizer(os.path.join("models","Qwen","Qwen3-1.7B"))
+    model = AutoModelForCausalLM.from_pretrained(os.path.join("models","Qwen","Qwen3-1.7B"), device_map=model_device_map(), torch_dtype=torch.bfloat16, trust_remote_code=True)
 
-    model.gradient_checkpointing_enable()
     model.enable_input_require_grads()
     for p in model.parameters(): p.requires_grad = True
 
-    train_df = pd.read_json(os.path.join(DATA,"train.jsonl"), lines=True)
-    dev_df   = pd.read_json(os.path.join(DATA,"dev.jsonl"),   lines=True)
-    train_ds = Dataset.from_pandas(train_df)
-    dev_ds   = Dataset.from_pandas(dev_df)
-    train_set = train_ds.map(lambda x: process_func(x, tokenizer), remove_columns=train_ds.column_names)
-    dev_set   = dev_ds.map(lambda x: process_func(x, tokenizer), remove_columns=dev_ds.column_names)
+    # JSONL 或已转换的 Parquet（dataset_io.py），只读取训练用到的两列
+    train_path, dev_path = resolve_path(os.path.join(DATA,"train.jsonl")), resolve_path(os.path.join(DATA,"dev.jsonl"))
+
+    def tokenized(path, name, columns=("input","output"), length_policy=True):
+        ds = to_hf_dataset(path, columns=list(columns))
+        if length_policy:
+            # 超长样本先按 LENGTH_POLICY 处理（token 长度有缓存）
+            ds, _ = apply_length_policy(ds, tokenizer, PROMPT, MAX_LENGTH, data_path=path, report_name=name)
+        # risk_level（FAST_EVAL 分层用）随分词结果保留
+        return ds.map(lambda x: process_func(x, tokenizer), remove_columns=[c for c in ds.column_names if c != "risk_level"])
+
+    if is_distributed():
+        # torchrun 多进程：每个节点只分词一次并切片，各 rank 只读取自己的 shard
+        key = signature(train_path, PROMPT, MAX_LENGTH, LENGTH_POLICY, tokenizer.name_or_path)
+        train_set = rank_shard("train_full", lambda: tokenized(train_path, "train"), key)
+    else:
+        train_set = tokenized(train_path, "train")
+    # dev 不做长度过滤（process_func 的截断已限制长度）：eval_loss / load_best_model_at_end 与原先可比，FAST_EVAL 的全量评估也是全量
+    dev_set = tokenized(dev_path, "dev", eval_columns(), length_policy=False)
+
+    # ACT_CKPT=all（默认）整层检查点；selective 按显存预算与本 rank 数据的长度分布选择重算的 attention / MLP
+    configure_checkpointing(model, train_set, batch_size=1, output_dir=OUT)
 
     args = TrainingArguments(
         output_dir=OUT,
@@ -49,18 +71,23 @@ def main():
         eval_strategy="steps", eval_steps=50, logging_steps=10,
         num_train_epochs=1, save_steps=200, learning_rate=5e-6,
         warmup_ratio=0.1, lr_scheduler_type="cosine",
-        gradient_checkpointing=True, bf16=True, fp16=False,
+        gradient_checkpointing=hf_gradient_checkpointing(), bf16=True, fp16=False,
         optim="adamw_torch", adam_beta1=0.9, adam_beta2=0.95,
         weight_decay=0.1, max_grad_norm=1.0,
         report_to="none", save_total_limit=3,
         load_best_model_at_end=True, metric_for_best_model="eval_loss", greater_is_better=False,
         remove_unused_columns=False,
+        **ddp_training_kwargs(),
     )
 
-    trainer = Trainer(
+    # 吞吐埋点：真实/padding token、数据等待/计算/优化器耗时、显存高水位 -> OUT/throughput.jsonl
+    collator, callbacks = instrument(DataCollatorForSeq2Seq(tokenizer=tokenizer, padding=True), OUT)
+    # 多进程时：ZERO_STAGE=1/2 分片 AdamW 状态（/梯度），ZERO_OFFLOAD=1 状态放 CPU
+    # FAST_EVAL=1：每 eval_steps 只评估分层 dev 子集（带置信区间），save_steps 处跑全量供 load_best_model_at_end 比较
+    trainer = with_fast_eval(with_zero_optimizer(with_sharded_data(trainer_class())))(
         model=model, args=args,
         train_dataset=train_set, eval_dataset=dev_set,
-        data_collator=DataCollatorForSeq2Seq(tokenizer=tokenizer, padding=True),
+        data_collator=collator, callbacks=callbacks,
     )
     print("="*40,"\n开始全参数微调\n","="*40)
     trainer.train()
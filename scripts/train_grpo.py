@@ -0,0 +1,317 @@
+# scripts/train_grpo.py
+"""
+组相对策略优化（GRPO 风格）：train_ppo.py 的省显存替代方案。
+
+- 每个提示采样 K 条回答（一次批量生成），RewardEngine 打分后在组内标准化得到优势，不需要 value head
+- 参考模型 logprob 由同一个基座在 `model.disable_adapter()` 下计算，不再复制第二份模型
+- 损失：PPO 式裁剪代理目标 + beta * KL(k3 估计，exp(ref-lp) - (ref-lp) - 1)，按回答 token 平均
+- SFT adapter 合并进基座后挂新的 LoRA 训练，关闭 adapter 即为 SFT 参考模型
+
+环境变量：GRPO_K（组大小，默认 4）、GRPO_PROMPTS（每步提示数，默认 2）、GRPO_BETA（默认 0.04）、
+GRPO_CLIP（默认 0.2）、GRPO_ITERS（每次 rollout 的更新轮数，默认 1）、GRPO_MICRO_BATCH（默认 4）、
+GRPO_LR（默认 1e-5）、GRPO_MAX_NEW_TOKENS（默认 256）、TEACHER_MODE、THINK_BUDGET
+
+    python scripts/train_grpo.py
+    # CPU 小模型：跑通训练并对比 PPO（value head + 复制参考模型）的内存与 rollout 吞吐
+    python scripts/train_grpo.py tiny models/Qwen/Qwen3-1.7B
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+import torch
+from peft import LoraConfig, get_peft_model
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+from cpu_quant import rss_mb
+from curriculum import make_curriculum
+from detokenizer import decode_batch
+from generation import generate
+from model_utils import load_rl_policy, param_bytes, tiny_causal_lm
+from reward_fn import RewardEngine
+from rl_data import SEED_DATA, batch_order, build_dataset, make_collate_fn, write_seed_data
+from think_budget import make_think_controller
+from tokenizer_utils import load_tokenizer
+
+
+@dataclass
+class GRPOConfig:
+    group_size: int = int(os.environ.get("GRPO_K", "4"))
+    prompts_per_step: int = int(os.environ.get("GRPO_PROMPTS", "2"))
+    max_new_tokens: int = int(os.environ.get("GRPO_MAX_NEW_TOKENS", "256"))
+    learning_rate: float = float(os.environ.get("GRPO_LR", "1e-5"))
+    beta: float = float(os.environ.get("GRPO_BETA", "0.04"))
+    clip_range: float = float(os.environ.get("GRPO_CLIP", "0.2"))
+    iters: int = int(os.environ.get("GRPO_ITERS", "1"))
+    micro_batch_size: int = int(os.environ.get("GRPO_MICRO_BATCH", "4"))
+    temperature: float = 1.0
+    seed: int = 42
+    save_every: int = 50
+    output_dir: str = "models/rl/grpo"
+
+
+# ================= 核心计算 =================
+def group_advantages(rewards: torch.Tensor, group_size: int, eps: float = 1e-4) -> torch.Tensor:
+    """组内标准化：(r - 组均值) / (组标准差 + eps)；组内奖励全相同时优势为 0"""
+    grouped = rewards.view(-1, group_size)
+    mean = grouped.mean(dim=1, keepdim=True)
+    std = grouped.std(dim=1, keepdim=True, unbiased=False)
+    return ((grouped - mean) / (std + eps)).view(-1)
+
+
+def build_sequences(prompts: List[List[int]], responses: List[List[int]], pad_id: int):
+    """拼接 提示+回答 并右侧 padding，返回 (input_ids, attention_mask, response_mask)"""
+    length = max(len(p) + len(r) for p, r in zip(prompts, responses))
+    input_ids = torch.full((len(prompts), length), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(prompts), length), dtype=torch.long)
+    response_mask = torch.zeros((len(prompts), length), dtype=torch.float32)
+    for i, (p, r) in enumerate(zip(prompts, responses)):
+        input_ids[i, :len(p) + len(r)] = torch.tensor(p + r)
+        attention_mask[i, :len(p) + len(r)] = 1
+        response_mask[i, len(p):len(p) + len(r)] = 1.0
+    return input_ids, attention_mask, response_mask
+
+
+def token_logprobs(model, input_ids, attention_mask) -> torch.Tensor:
+    """每个位置下一个 token 的 logprob，形状 (B, T-1)；用 gather - logsumexp 避免物化整张 log_softmax"""
+    logits = model(input_ids=input_ids, attention_mask=attention_mask).logits[:, :-1].float()
+    target = input_ids[:, 1:].unsqueeze(-1)
+    return logits.gather(-1, target).squeeze(-1) - torch.logsumexp(logits, dim=-1)
+
+
+def grpo_loss(logp, old_logp, ref_logp, advantages, mask, clip_range: float, beta: float):
+    ratio = torch.exp(logp - old_logp)
+    adv = advantages.unsqueeze(1)
+    surrogate = torch.min(ratio * adv, torch.clamp(ratio, 1 - clip_range, 1 + clip_range) * adv)
+    log_ref_ratio = ref_logp - logp
+    kl = torch.exp(log_ref_ratio) - log_ref_ratio - 1
+    per_token = -(surrogate - beta * kl)
+    tokens = mask.sum(dim=1).clamp(min=1)
+    loss = ((per_token * mask).sum(dim=1) / tokens).mean()
+    with torch.no_grad():
+        stats = {
+            "kl": ((kl * mask).sum() / mask.sum().clamp(min=1)).item(),
+            "clipfrac": ((((ratio - 1).abs() > clip_range).float() * mask).sum() / mask.sum().clamp(min=1)).item(),
+        }
+    return loss, stats
+
+
+# ================= 训练步 =================
+def rollout(model, tokenizer, batch, cfg: GRPOConfig, logits_processor=None):
+    """每个提示复制 K 份后一次批量采样；返回 (提示 id 列表, 回答 id 列表, GenerationStats)"""
+    device = model.device
+    input_ids = batch["input_ids"].repeat_interleave(cfg.group_size, dim=0).to(device)
+    attention_mask = batch["attention_mask"].repeat_interleave(cfg.group_size, dim=0).to(device)
+    model.eval()
+    responses, stats = generate(
+        model, tokenizer, input_ids, attention_mask, max_new_tokens=cfg.max_new_tokens,
+        do_sample=True, temperature=cfg.temperature, top_p=1.0, top_k=0, logits_processor=logits_processor,
+    )
+    model.train()
+    prompts = [row[m.bool()].tolist() for row, m in zip(input_ids.cpu(), attention_mask.cpu())]
+    # 空回答补一个 EOS，保证每条样本至少有一个可训练 token
+    responses = [r if r else [tokenizer.eos_token_id] for r in responses]
+    return prompts, responses, stats
+
+
+def train_step(model, optimizer, tokenizer, batch, reward_engine, cfg: GRPOConfig, logits_processor=None) -> Dict:
+    prompts, responses, gen_stats = rollout(model, tokenizer, batch, cfg, logits_processor)
+    texts = decode_batch(tokenizer, responses)
+    queries = [q for q in batch["query_text"] for _ in range(cfg.group_size)]
+    totals, _ = reward_engine.compute_rewards_detailed(queries, texts)
+    rewards = torch.tensor(totals, dtype=torch.float32)
+    advantages = group_advantages(rewards, cfg.group_size)
+
+    device = model.device
+    input_ids, attention_mask, response_mask = build_sequences(prompts, responses, tokenizer.pad_token_id)
+    chunks = [slice(i, i + cfg.micro_batch_size) for i in range(0, len(prompts), cfg.micro_batch_size)]
+
+    # 策略更新全程关闭 dropout（lora_dropout 等）：参考 / 旧策略 / 新策略 logprob 在同一模式下计算，
+    # 第一次更新前 ratio 恰为 1，裁剪统计与替代目标不被 dropout 噪声偏置
+    model.eval()
+    # 参考 logprob（关闭 adapter 的同一基座）与旧策略 logprob，均无梯度
+    ref_logps, old_logps = [], []
+    with torch.no_grad():
+        for sl in chunks:
+            ids, am = input_ids[sl].to(device), attention_mask[sl].to(device)
+            with model.disable_adapter():
+                ref_logps.append(token_logprobs(model, ids, am))
+            if cfg.iters > 1:
+                old_logps.append(token_logprobs(model, ids, am))
+
+    trainable = [p for p in model.parameters() if p.requires_grad]
+    step_stats = {"loss": 0.0, "kl": 0.0, "clipfrac": 0.0}
+    for _ in range(cfg.iters):
+        optimizer.zero_grad(set_to_none=True)
+        for j, sl in enumerate(chunks):
+            ids, am = input_ids[sl].to(device), attention_mask[sl].to(device)
+            mask = response_mask[sl, 1:].to(device)
+            logp = token_logprobs(model, ids, am)
+            old = old_logps[j] if cfg.iters > 1 else logp.detach()
+            loss, stats = grpo_loss(logp, old, ref_logps[j], advantages[sl].to(device), mask, cfg.clip_range, cfg.beta)
+            (loss / len(chunks)).backward()
+            step_stats["loss"] += loss.item() / len(chunks) / cfg.iters
+            step_stats["kl"] += stats["kl"] / len(chunks) / cfg.iters
+            step_stats["clipfrac"] += stats["clipfrac"] / len(chunks) / cfg.iters
+        torch.nn.utils.clip_grad_norm_(trainable, 1.0)
+        optimizer.step()
+    model.train()
+
+    step_stats.update(
+        reward_mean=rewards.mean().item(),
+        reward_std=rewards.std(unbiased=False).item(),
+        rollout_tokens=gen_stats.new_tokens,
+        rollout_sec=gen_stats.seconds,
+        rewards=totals,
+    )
+    return step_stats
+
+
+def run_grpo(model, tokenizer, dataset, collate_fn, reward_engine, cfg: GRPOConfig,
+             max_steps: int = 0, logits_processor=None, save: bool = True, curriculum=None) -> List[Dict]:
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=cfg.learning_rate)
+    batches = batch_order(len(dataset), cfg.prompts_per_step, cfg.seed)
+    if max_steps:
+        batches = batches[:max_steps]
+    history = []
+    for step, idx in enumerate(batches):
+        start = time.perf_counter()
+        if curriculum is not None:
+            idx = curriculum.sample(cfg.prompts_per_step)
+        stats = train_step(model, optimizer, tokenizer, collate_fn([dataset[i] for i in idx]),
+                           reward_engine, cfg, logits_processor)
+        history.append(stats)
+        if curriculum is not None:
+            # 组内 K 条奖励同时更新该提示的均值/方差
+            curriculum.update([i for i in idx for _ in range(cfg.group_size)], stats["rewards"])
+            curriculum.log_step(time.perf_counter() - start, stats["rewards"])
+        if step % 10 == 0:
+            print(f"Step {step}: reward {stats['reward_mean']:.2f}±{stats['reward_std']:.2f} "
+                  f"loss {stats['loss']:.4f} kl {stats['kl']:.4f} "
+                  f"rollout {stats['rollout_tokens'] / max(stats['rollout_sec'], 1e-9):.1f} tok/s")
+        if save and step > 0 and step % cfg.save_every == 0:
+            model.save_pretrained(os.path.join(cfg.output_dir, f"step_{step}"))
+    return history
+
+
+# ================= 内存报告 =================
+def memory_report(model, ref_model=None) -> Dict:
+    """参数内存；参考模型只计与策略不共享存储的部分（GRPO 关闭 adapter 复用基座时为 0）"""
+    trainable = sum(p.numel() * p.element_size() for p in model.parameters() if p.requires_grad)
+    policy = param_bytes(model)
+    value_head = sum(p.numel() * p.element_size() for n, p in model.named_parameters() if "v_head" in n)
+    report = {
+        "param_mb": round(policy / 2 ** 20, 1),
+        "trainable_mb": round(trainable / 2 ** 20, 2),
+        "adam_state_mb": round(2 * trainable / 2 ** 20, 2),
+        "reference_copy_mb": round((param_bytes(model, ref_model) - policy) / 2 ** 20, 2) if ref_model is not None else 0.0,
+        "value_head_mb": round(value_head / 2 ** 20, 2),
+    }
+    if torch.cuda.is_available():
+        report["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+    report["rss_peak_mb"] = round(rss_mb("VmHWM"), 1)
+    return report
+
+
+def main():
+    cfg = GRPOConfig()
+    base_model_path = os.environ.get("BASE_MODEL_PATH", "models/Qwen/Qwen3-1.7B")
+    sft_adapter_path = os.environ.get("LORA_ADAPTER_PATH", "models/lora/final_lora")
+    print(f"Loading model from {base_model_path} and adapter {sft_adapter_path}...")
+    model = load_rl_policy(base_model_path, sft_adapter_path)
+    tokenizer = load_tokenizer(base_model_path)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"  # 批量采样需左侧 padding
+
+    data_path = "data/rl/training_prompts.jsonl"
+    if not os.path.exists(data_path):
+        print(f"⚠️ {data_path} not found, auto-generating a small RL dataset.")
+        write_seed_data(data_path)
+    dataset = build_dataset(tokenizer, data_path)
+    reward_engine = RewardEngine(teacher_mode=os.environ.get("TEACHER_MODE", "deepseek"))
+
+    torch.manual_seed(cfg.seed)
+    print(f"🚀 Starting GRPO training (K={cfg.group_size}, {cfg.prompts_per_step} prompts/step)...")
+    curriculum = make_curriculum(dataset["risk_level"], seed=cfg.seed)
+    run_grpo(model, tokenizer, dataset, make_collate_fn(tokenizer), reward_engine, cfg,
+             logits_processor=make_think_controller(tokenizer), curriculum=curriculum)
+    if curriculum is not None:
+        print(f"📈 Curriculum report: {json.dumps(curriculum.report(), ensure_ascii=False, indent=2)}")
+    print(f"📊 Memory: {json.dumps(memory_report(model))}")
+    model.save_pretrained(os.path.join(cfg.output_dir, "final_grpo_lora"))
+    print("✅ Training finished. Adapter saved.")
+
+
+def tiny_check(tokenizer_path: str, steps: int = 3) -> Dict:
+    """
+    CPU 小模型：GRPO 跑 steps 步（mock 教师），并与 PPO 配置（value head + 深拷贝参考模型）对比
+    参数内存；rollout 吞吐对比 K*P 条一次批量采样与 PPO 式每批 4 条分批采样。
+    """
+    import train_ppo  # noqa: F401  完成 TRL 的兼容补丁
+    from trl import AutoModelForCausalLMWithValueHead, create_reference_model
+
+    tokenizer = load_tokenizer(tokenizer_path)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    cfg = GRPOConfig(group_size=4, prompts_per_step=2, max_new_tokens=32, learning_rate=1e-3, micro_batch_size=4)
+    lora = LoraConfig(r=4, lora_alpha=8, target_modules=["q_proj", "v_proj"], task_type="CAUSAL_LM")
+
+    work = tempfile.mkdtemp(prefix="grpo_tiny_")
+    data_path = os.path.join(work, "prompts.jsonl")
+    write_seed_data(data_path, repeat=(steps * cfg.prompts_per_step) // len(SEED_DATA) + 1)
+    dataset = build_dataset(tokenizer, data_path)
+    collate_fn = make_collate_fn(tokenizer)
+
+    model = get_peft_model(tiny_causal_lm(tokenizer), lora)
+    start = time.perf_counter()
+    history = run_grpo(model, tokenizer, dataset, collate_fn, RewardEngine(teacher_mode="mock"), cfg,
+                       max_steps=steps, save=False)
+    train_sec = time.perf_counter() - start
+
+    ppo_policy = AutoModelForCausalLMWithValueHead.from_pretrained(tiny_causal_lm(tokenizer))
+    ppo_ref = create_reference_model(ppo_policy)
+    grpo_mb = param_bytes(model) / 2 ** 20
+    ppo_mb = param_bytes(ppo_policy, ppo_ref) / 2 ** 20
+
+    # rollout 吞吐：同样 K*P 条回答，一次批量 vs 每批 4 条
+    batch = collate_fn([dataset[i] for i in range(cfg.prompts_per_step)])
+    torch.manual_seed(0)
+    _, _, grouped = rollout(model, tokenizer, batch, cfg)
+    chunked_tokens, chunked_sec = 0, 0.0
+    ids = batch["input_ids"].repeat_interleave(cfg.group_size, dim=0)
+    am = batch["attention_mask"].repeat_interleave(cfg.group_size, dim=0)
+    for i in range(0, ids.shape[0], 4):
+        _, st = generate(model, tokenizer, ids[i:i + 4], am[i:i + 4], max_new_tokens=cfg.max_new_tokens,
+                         do_sample=True, temperature=1.0, top_p=1.0, top_k=0)
+        chunked_tokens += st.new_tokens
+        chunked_sec += st.seconds
+
+    report = {
+        "steps": len(history),
+        "train_sec": round(train_sec, 2),
+        "rewards": [round(h["reward_mean"], 3) for h in history],
+        "kl": [round(h["kl"], 5) for h in history],
+        "grpo_param_mb": round(grpo_mb, 2),
+        "ppo_param_mb (policy+value head+ref copy)": round(ppo_mb, 2),
+        "param_memory_saving": f"{1 - grpo_mb / ppo_mb:.1%}",
+        "grpo_rollout_tok_per_sec": round(grouped.tokens_per_sec, 1),
+        "chunked_rollout_tok_per_sec": round(chunked_tokens / max(chunked_sec, 1e-9), 1),
+        "memory": memory_report(model),
+        "ppo_memory": memory_report(ppo_policy, ppo_ref),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "tiny":
+        tiny_check(sys.argv[2] if len(sys.argv) > 2 else "models/Qwen/Qwen3-1.7B")
+    else:
+        main()
@@ -1,12 +1,21 @@
 import json
 import os
-import pandas as pd
 import torch
-from datasets import Dataset
-from modelscope import snapshot_download, AutoTokenizer
-from transformers import AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForSeq2Seq
+from modelscope import snapshot_download
+from transformers import AutoModelForCausalLM, TrainingArguments, DataCollatorForSeq2Seq
 import swanlab
 from peft import LoraConfig, TaskType, get_peft_model
+from generation import generate, load_speculative_config
+from tokenizer_utils import load_tokenizer
+from detokenizer import DeltaStreamer
+from dataset_io import iter_records, resolve_path, to_hf_dataset
+from chunked_loss import trainer_class
+from length_filter import LENGTH_POLICY, apply_length_policy
+from train_metrics import instrument
+from ddp_sft import ddp_training_kwargs, is_distributed, model_device_map, rank_shard, signature, with_sharded_data
+from activation_ckpt import configure_checkpointing, hf_gradient_checkpointing
+from adapter_ckpt import adapter_checkpoint_callbacks, adapter_resume_checkpoint
+from chat_template import chat_encoder
 
 # SwanLab 项目配置
 os.environ["SWANLAB_PROJECT"] = "qwen3-sft-medical"
@@ -19,6 +28,7 @@ swanlab.config.update(
         "model": "Qwen/Qwen3-1.7B",
         "prompt": PROMPT,
         "data_max_length": MAX_LENGTH,
+        "length_policy": LENGTH_POLICY,
     }
 )
 
@@ -46,16 +56,14 @@ def dataset_jsonl_transfer(origin_path, new_path):
 
 def process_func(example):
     """将数据集进行预处理"""
-    instr = tokenizer(
-        f"<|im_start|>system\n{PROMPT}<|im_end|>\n"
-        f"<|im_start|>user\n{example['input']}<|im_end|>\n"
-        f"<|im_start|>assistant\n",
-        add_special_tokens=False,
+    # 聊天模板（system + user + assistant 头）的固定片段已缓存，只对问题文本分词
+    instr_ids = chat_encoder(tokenizer).encode(
+        [{"role": "system", "content": PROMPT}, {"role": "user", "content": example["input"]}]
     )
     resp = tokenizer(f"{example['output']}", add_special_tokens=False)
-    input_ids = instr["input_ids"] + resp["input_ids"] + [tokenizer.pad_token_id]
-    attention_mask = instr["attention_mask"] + resp["attention_mask"] + [1]
-    labels = [-100] * len(instr["input_ids"]) + resp["input_ids"] + [tokenizer.pad_token_id]
+    input_ids = instr_ids + resp["input_ids"] + [tokenizer.pad_token_id]
+    attention_mask = [1] * len(instr_ids) + resp["attention_mask"] + [1]
+    labels = [-100] * len(instr_ids) + resp["input_ids"] + [tokenizer.pad_token_id]
     if len(input_ids) > MAX_LENGTH:
         input_ids = input_ids[:MAX_LENGTH]
         attention_mask = attention_mask[:MAX_LENGTH]
@@ -65,19 +73,16 @@ def process_func(example):
 
 def predict(messages, model, tokenizer):
     device = "cuda"
-    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-    model_inputs = tokenizer([text], return_tensors="pt").to(device)
+    model_inputs = chat_encoder(tokenizer).inputs(messages).to(device)
 
-    generated_ids = model.generate(
-        input_ids=model_inputs.input_ids,
-        attention_mask=model_inputs.attention_mask,
-        max_new_tokens=MAX_LENGTH,
+    streamer = DeltaStreamer(tokenizer, on_text=lambda delta: None)
+    _, stats = generate(
+        model, tokenizer, model_inputs.input_ids, model_inputs.attention_mask,
+        max_new_tokens=MAX_LENGTH, spec=load_speculative_config(device), streamer=streamer,
     )
-    generated_ids = [
-        output_ids[len(input_ids) :] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-    ]
+    print("⏱️", stats.summary())
 
-    response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+    response = streamer.text
     return response
 
 
@@ -85,14 +90,14 @@ def predict(messages, model, tokenizer):
 model_dir = snapshot_download("Qwen/Qwen3-1.7B", cache_dir="/root/autodl-tmp/", revision="master")
 
 # 2) 加载 tokenizer 和基础模型
-tokenizer = AutoTokenizer.from_pretrained("/root/autodl-tmp/Qwen/Qwen3-1.7B", use_fast=False, trust_remote_code=True)
+tokenizer = load_tokenizer("/root/autodl-tmp/Qwen/Qwen3-1.7B")
 if tokenizer.pad_token_id is None:
     tokenizer.pad_token_id = tokenizer.eos_token_id
 tokenizer.padding_side = "right"
 
 base_model = AutoModelForCausalLM.from_pretrained(
     "/root/autodl-tmp/Qwen/Qwen3-1.7B",
-    device_map="auto",
+    device_map=model_device_map(),  # torchrun 多进程时为 None，由 Trainer 放到本 rank 的设备
     torch_dtype=torch.bfloat16,
     trust_remote_code=True,
 )
@@ -130,14 +135,31 @@ if not os.path.exists(train_jsonl_new_path):
 if not os.path.exists(test_jsonl_new_path):
     dataset_jsonl_transfer(test_dataset_path, test_jsonl_new_path)
 
-train_df = pd.read_json(train_jsonl_new_path, lines=True)
-train_ds = Dataset.from_pandas(train_df)
-train_dataset = train_ds.map(process_func, remove_columns=train_ds.column_names)
+# JSONL 或已转换的 Parquet（dataset_io.py），只读取训练用到的两列
+def build_train_dataset():
+    train_ds = to_hf_dataset(resolve_path(train_jsonl_new_path), columns=["input", "output"])
+    # 超长样本先按 LENGTH_POLICY 处理（token 长度有缓存；默认 truncate 与原先一致，仍由 process_func 截断）
+    train_ds, train_len_report = apply_length_policy(
+        train_ds, tokenizer, PROMPT, MAX_LENGTH, data_path=resolve_path(train_jsonl_new_path), report_name="train_format"
+    )
+    swanlab.config.update({"train_length_report": train_len_report})
+    return train_ds.map(process_func, remove_columns=train_ds.column_names)
+
 
-eval_df = pd.read_json(test_jsonl_new_path, lines=True)
-eval_ds = Dataset.from_pandas(eval_df)
+if is_distributed():
+    # torchrun 多进程：每个节点只分词一次并切片，各 rank 只读取自己的 shard
+    shard_key = signature(resolve_path(train_jsonl_new_path), PROMPT, MAX_LENGTH, LENGTH_POLICY, tokenizer.name_or_path)
+    train_dataset = rank_shard("train_lora", build_train_dataset, shard_key)
+else:
+    train_dataset = build_train_dataset()
+
+# 验证集不做长度过滤（process_func 的截断已限制长度），eval_loss 与原先可比
+eval_ds = to_hf_dataset(resolve_path(test_jsonl_new_path), columns=["input", "output"])
 eval_dataset = eval_ds.map(process_func, remove_columns=eval_ds.column_names)
 
+# ACT_CKPT=all（默认）整层检查点；selective 按显存预算与训练数据长度分布选择重算的 attention / MLP
+configure_checkpointing(model, train_dataset, batch_size=1, output_dir="/root/autodl-tmp/output/Qwen3-1.7B-LORA")
+
 # 4) 训练参数
 args = TrainingArguments(
     output_dir="/root/autodl-tmp/output/Qwen3-1.7B-LORA",
@@ -151,21 +173,31 @@ args = TrainingArguments(
     save_steps=400,
     learning_rate=1e-4,
     save_on_each_node=True,
-    gradient_checkpointing=True,
+    gradient_checkpointing=hf_gradient_checkpointing(),
     report_to="swanlab",
     run_name="qwen3-1.7B",
+    **ddp_training_kwargs(),
 )
 
-# 5) Trainer
-trainer = Trainer(
+# 5) Trainer（RESPONSE_ONLY_LOSS=1 时只在回答位置分块计算 loss）
+# 吞吐埋点：写入 output_dir/throughput.jsonl 与 throughput.prom，并同步到 swanlab
+collator, callbacks = instrument(DataCollatorForSeq2Seq(tokenizer=tokenizer, padding=True), args.output_dir)
+# ASYNC_ADAPTER_CKPT=1：每 save_steps 只快照 adapter + 优化器到 pinned 内存，后台写 safetensors，不再阻塞训练
+# ADAPTER_CKPT_RESUME=1：从 adapter_ckpt/latest 恢复 adapter、优化器、调度器与 global_step
+resume_ckpt = adapter_resume_checkpoint(args.output_dir)
+callbacks += adapter_checkpoint_callbacks(args.output_dir, resume_ckpt)
+trainer = with_sharded_data(trainer_class())(
     model=model,
     args=args,
     train_dataset=train_dataset,
     eval_dataset=eval_dataset,
-    data_collator=DataCollatorForSeq2Seq(tokenizer=tokenizer, padding=True),
+    data_collator=collator,
+    callbacks=callbacks,
 )
 
-trainer.train()
+trainer.train(resume_from_checkpoint=resume_ckpt)
+if not trainer.is_world_process_zero():
+    raise SystemExit(0)  # 多进程时只由主进程保存与做主观测试
 
 # 6) 保存 LoRA 适配器
 save_dir = "/root/autodl-tmp/output/Qwen3-1.7B-LORA/final_lora"
@@ -175,10 +207,10 @@ tokenizer.save_pretrained(save_dir)
 print(f"✅ LoRA adapter saved to: {save_dir}")
 
 # 7) 简单主观测试（前 3 条）
-test_df = pd.read_json(test_jsonl_new_path, lines=True)[:3]
+test_rows = [r for _, r in zip(range(3), iter_records(resolve_path(test_jsonl_new_path), columns=["instruction", "input"]))]
 test_text_list = []
 
-for _, row in test_df.iterrows():
+for row in test_rows:
     instruction = row["instruction"]
     input_value = row["input"]
     messages = [
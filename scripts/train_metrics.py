@@ -0,0 +1,171 @@
+# scripts/train_metrics.py
+"""
+SFT 训练吞吐埋点（train_lora / train_full 共用）：
+
+- InstrumentedCollator：包装 data_collator，统计每个 batch 的真实 token（attention_mask 之和）与
+  padding 后 token 数，以及组 batch 耗时（dataloader num_workers=0 时即数据等待时间）
+- ThroughputCallback（TrainerCallback）：
+    * 优化器步之间的墙钟时间拆成 数据等待 / 计算 / optimizer.step 三部分
+      （optimizer.step 在 on_train_begin 时包一层计时；CUDA 下前后同步，保证计时准确）
+    * 真实/padding token 每秒吞吐与 padding 占比
+    * 显存高水位（CUDA max_memory_allocated / reserved，每个日志窗口重置）与进程 RSS 峰值
+  评估与保存 checkpoint 的耗时不计入训练步。每 logging_steps 汇总一次：追加到 <output_dir>/throughput.jsonl，
+  覆盖写 Prometheus 文本格式的 <output_dir>/throughput.prom，report_to 含 swanlab 时同时写入当前 swanlab run
+
+环境变量：TRAIN_METRICS=0 关闭
+"""
+import json
+import os
+import time
+
+import torch
+from transformers import TrainerCallback
+
+TRAIN_METRICS = os.environ.get("TRAIN_METRICS", "1") != "0"
+PROM_PREFIX = "qwen3_sft"
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM:")) / 1024
+    except (OSError, StopIteration):
+        return 0.0
+
+
+class InstrumentedCollator:
+    def __init__(self, collator):
+        self.collator = collator
+        self.reset()
+
+    def reset(self):
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.samples = 0
+        self.collate_sec = 0.0
+
+    def __call__(self, features):
+        start = time.perf_counter()
+        batch = self.collator(features)
+        self.collate_sec += time.perf_counter() - start
+        mask = batch.get("attention_mask")
+        if mask is not None:
+            self.real_tokens += int(mask.sum())
+            self.padded_tokens += mask.numel()
+        else:
+            self.real_tokens += batch["input_ids"].numel()
+            self.padded_tokens += batch["input_ids"].numel()
+        self.samples += len(features)
+        return batch
+
+
+class ThroughputCallback(TrainerCallback):
+    def __init__(self, collator: InstrumentedCollator, output_dir: str, sync_cuda: bool = True):
+        self.collator = collator
+        self.output_dir = output_dir
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.jsonl_path = os.path.join(output_dir, "throughput.jsonl")
+        self.prom_path = os.path.join(output_dir, "throughput.prom")
+        self._optim_sec = 0.0
+        self._last_end = None
+        self._window = self._empty_window()
+
+    @staticmethod
+    def _empty_window():
+        return {"steps": 0, "wall_sec": 0.0, "data_sec": 0.0, "optim_sec": 0.0,
+                "real_tokens": 0, "padded_tokens": 0, "samples": 0}
+
+    def _sync(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+
+    def _wrap_optimizer(self, optimizer):
+        inner = optimizer.step
+
+        def timed_step(*args, **kwargs):
+            self._sync()
+            start = time.perf_counter()
+            out = inner(*args, **kwargs)
+            self._sync()
+            self._optim_sec += time.perf_counter() - start
+            return out
+
+        optimizer.step = timed_step
+
+    # ---- 事件 ----
+    def on_train_begin(self, args, state, control, optimizer=None, **kwargs):
+        if optimizer is not None:
+            self._wrap_optimizer(optimizer)
+        os.makedirs(self.output_dir, exist_ok=True)
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self.collator.reset()
+        self._last_end = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        w = self._window
+        w["steps"] += 1
+        w["wall_sec"] += now - self._last_end
+        w["data_sec"] += self.collator.collate_sec
+        w["optim_sec"] += self._optim_sec
+        w["real_tokens"] += self.collator.real_tokens
+        w["padded_tokens"] += self.collator.padded_tokens
+        w["samples"] += self.collator.samples
+        self.collator.reset()
+        self._optim_sec = 0.0
+        self._last_end = now
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        # 评估也经过同一个 collator：丢弃评估期间的计数，评估耗时不计入下一步
+        self.collator.reset()
+        self._last_end = time.perf_counter()
+
+    def on_save(self, args, state, control, **kwargs):
+        self._last_end = time.perf_counter()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        w = self._window
+        if not w["steps"] or state.global_step == 0:
+            return
+        wall = max(w["wall_sec"], 1e-9)
+        metrics = {
+            "step": state.global_step,
+            "tokens_per_sec": round(w["real_tokens"] / wall, 1),
+            "padded_tokens_per_sec": round(w["padded_tokens"] / wall, 1),
+            "samples_per_sec": round(w["samples"] / wall, 3),
+            "padding_ratio": round(1 - w["real_tokens"] / max(w["padded_tokens"], 1), 4),
+            "step_sec": round(wall / w["steps"], 4),
+            "data_wait_sec": round(w["data_sec"] / w["steps"], 4),
+            "optimizer_sec": round(w["optim_sec"] / w["steps"], 4),
+            "compute_sec": round((wall - w["data_sec"] - w["optim_sec"]) / w["steps"], 4),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+        }
+        if torch.cuda.is_available():
+            metrics["cuda_peak_allocated_mb"] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+            metrics["cuda_peak_reserved_mb"] = round(torch.cuda.max_memory_reserved() / 2 ** 20, 1)
+            torch.cuda.reset_peak_memory_stats()
+        self._window = self._empty_window()
+        if state.is_world_process_zero:
+            self._write(metrics, args)
+
+    def _write(self, metrics: dict, args):
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(metrics) + "\n")
+        lines = [f"{PROM_PREFIX}_{k} {v}" for k, v in metrics.items()]
+        tmp = self.prom_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.prom_path)
+        if "swanlab" in (args.report_to or []):
+            import swanlab
+
+            swanlab.log({f"throughput/{k}": v for k, v in metrics.items() if k != "step"}, step=metrics["step"])
+
+
+def instrument(collator, output_dir: str):
+    """返回 (data_collator, callbacks)；TRAIN_METRICS=0 时原样返回 collator、不加回调"""
+    if not TRAIN_METRICS:
+        return collator, []
+    wrapped = InstrumentedCollator(collator)
+    return wrapped, [ThroughputCallback(wrapped, output_dir)]
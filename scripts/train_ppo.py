@@ -1,9 +1,15 @@
+import json
 import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
 import torch
 from dataclasses import dataclass, field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict
 from accelerate import Accelerator
-from datasets import load_dataset
 from peft import LoraConfig
 from tqdm import tqdm
 import transformers
@@ -42,10 +48,20 @@ except Exception:
 
 # 将函数挂到 transformers 命名空间，供 TRL import
 setattr(transformers, "top_k_top_p_filtering", top_k_top_p_filtering)
-from transformers import AutoTokenizer, Adafactor, DataCollatorWithPadding
+from transformers import Adafactor, DataCollatorWithPadding
 
 from trl import AutoModelForCausalLMWithValueHead, PPOConfig, PPOTrainer, set_seed
+from rl_trainer import MedicalPPOTrainer
 from reward_fn import RewardEngine
+from rollout_store import RolloutStore
+from think_budget import make_think_controller
+from tokenizer_utils import load_tokenizer
+from detokenizer import decode_batch
+from checkpoint_utils import AsyncCheckpointWriter, latest_checkpoint, snapshot_to_cpu
+from curriculum import make_curriculum
+from rl_data import SEED_DATA, batch_order, build_dataset, make_collate_fn, write_seed_data
+from model_utils import load_rl_policy, param_bytes, tiny_causal_lm
+from tracing import span
 
 # ================= 配置 =================
 @dataclass
@@ -59,6 +75,231 @@ class ScriptArguments:
     gradient_accumulation_steps: int = field(default=1, metadata={"help": "the number of gradient accumulation steps"})
     output_dir: str = field(default="models/rl/checkpoints", metadata={"help": "Output directory"})
 
+# 断点续训：每 CKPT_EVERY 步异步保存完整训练状态到 CKPT_DIR（默认 <output_dir>/state），
+# 保留最近 CKPT_KEEP 份；RESUME=auto 时从最近一份恢复，RESUME=0 从头训练
+CKPT_EVERY = int(os.environ.get("CKPT_EVERY", "10"))
+CKPT_KEEP = int(os.environ.get("CKPT_KEEP", "3"))
+RESUME = os.environ.get("RESUME", "auto")
+
+def build_trainer(config, model, tokenizer, dataset, collate_fn):
+    optimizer = Adafactor(
+        filter(lambda p: p.requires_grad, model.parameters()),
+        scale_parameter=False,
+        relative_step=False,
+        warmup_init=False,
+        lr=config.learning_rate,
+    )
+    return MedicalPPOTrainer(
+        config,
+        model,
+        ref_model=None, # PEFT 策略：参考 = 关闭 adapter 的同一基座；非 PEFT 时 TRL 会复制一份
+        tokenizer=tokenizer,
+        dataset=dataset,
+        data_collator=collate_fn,  # 自定义 padding，保留 query_text
+        optimizer=optimizer,
+    )
+
+
+# ================= 训练状态 checkpoint =================
+def _rng_state() -> dict:
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _set_rng_state(state: dict):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def capture_state(step: int, ppo_trainer, reward_engine, rollout_store=None, curriculum=None) -> dict:
+    """主线程快照：可训练参数、优化器、RNG、KL 控制器、奖励归一化统计、教师缓存、rollout 分片数、课程统计"""
+    model = ppo_trainer.accelerator.unwrap_model(ppo_trainer.model)
+    running = getattr(ppo_trainer, "running", None)
+    if rollout_store is not None:
+        rollout_store.flush()
+    return snapshot_to_cpu({
+        "step": step,
+        "trainer_step": ppo_trainer.current_step,  # 每次 step()（含经验回放）都会递增，不等于 step + 1
+        "trainable": {n: p for n, p in model.named_parameters() if p.requires_grad},
+        "optimizer": ppo_trainer.optimizer.state_dict(),
+        "rng": _rng_state(),
+        "kl_coef": ppo_trainer.kl_ctl.value,
+        "running": {k: getattr(running, k) for k in ("mean", "std", "var", "count")} if running is not None else None,
+        "teacher_cache": dict(reward_engine.teacher.cache),
+        "rollout_shards": rollout_store.num_shards if rollout_store is not None else 0,
+        "curriculum": curriculum.state_dict() if curriculum is not None else None,
+    })
+
+
+def restore_state(path: str, ppo_trainer, reward_engine, rollout_store=None, curriculum=None) -> int:
+    """从 checkpoint 目录恢复，返回已完成的最后一步"""
+    state = torch.load(os.path.join(path, "state.pt"), map_location="cpu", weights_only=False)
+    model = ppo_trainer.accelerator.unwrap_model(ppo_trainer.model)
+    params = dict(model.named_parameters())
+    with torch.no_grad():
+        for name, value in state["trainable"].items():
+            params[name].copy_(value.to(params[name].device))
+    ppo_trainer.optimizer.load_state_dict(state["optimizer"])
+    ppo_trainer.kl_ctl.value = state["kl_coef"]
+    if state["running"] is not None and getattr(ppo_trainer, "running", None) is not None:
+        for k, v in state["running"].items():
+            setattr(ppo_trainer.running, k, v)
+    reward_engine.teacher.cache.update(state["teacher_cache"])
+    if rollout_store is not None:
+        rollout_store.truncate(state["rollout_shards"])
+    if curriculum is not None and state.get("curriculum") is not None:
+        curriculum.load_state_dict(state["curriculum"])
+    _set_rng_state(state["rng"])
+    ppo_trainer.current_step = state.get("trainer_step", state["step"] + 1)
+    return state["step"]
+
+
+def save_state_async(writer: AsyncCheckpointWriter, state: dict):
+    def write(tmp_dir):
+        torch.save(state, os.path.join(tmp_dir, "state.pt"))
+        with open(os.path.join(tmp_dir, "trainer_state.json"), "w", encoding="utf-8") as f:
+            json.dump({"step": state["step"], "kl_coef": state["kl_coef"], "teacher_cache": len(state["teacher_cache"])}, f)
+
+    writer.submit(f"step_{state['step']}", write)
+
+
+# ================= 训练循环 =================
+def generate_rollouts(ppo_trainer, query_tensors, generation_kwargs: dict, think_controller=None, batch_size: int = 4):
+    """
+    ppo_trainer.generate 按 batch_size 分块、块内左 padding 到最长提示后调用 model.generate。
+    有思考预算控制器时在这里按同样的块切分，每块先 begin(块内最长提示长度)，
+    否则控制器只能靠长度是否连续来猜测新一轮 generate，可能把上一块的计数带进下一块。
+    """
+    if think_controller is None:
+        return ppo_trainer.generate(query_tensors, return_prompt=False, batch_size=batch_size, **generation_kwargs)
+    responses = []
+    for i in range(0, len(query_tensors), batch_size):
+        chunk = query_tensors[i:i + batch_size]
+        think_controller.begin(max(len(q) for q in chunk))
+        responses += ppo_trainer.generate(chunk, return_prompt=False, batch_size=len(chunk), **generation_kwargs)
+    return responses
+
+
+def run_ppo(
+    ppo_trainer,
+    tokenizer,
+    dataset,
+    collate_fn,
+    reward_engine,
+    config,
+    generation_kwargs: dict,
+    output_dir: Optional[str] = None,
+    think_controller=None,
+    rollout_store=None,
+    replay_every: int = 0,
+    replay_alpha: float = 1.0,
+    ckpt_dir: Optional[str] = None,
+    ckpt_every: int = CKPT_EVERY,
+    resume: bool = True,
+    stop_after: Optional[int] = None,
+    save_every: int = 50,
+    curriculum=None,
+) -> Dict[int, List[float]]:
+    """
+    按 batch_order 顺序训练一遍数据（传入 curriculum 时每步由课程采样器挑选提示，步数不变），
+    返回 {step: 该步奖励列表}。
+    stop_after=k 时在第 k 步结束后直接返回（不做收尾保存），用于模拟训练中途崩溃。
+    """
+    device = ppo_trainer.accelerator.device
+    batches = batch_order(len(dataset), config.batch_size, config.seed)
+    writer = AsyncCheckpointWriter(ckpt_dir, keep_last=CKPT_KEEP) if ckpt_dir and ckpt_every > 0 else None
+
+    start = 0
+    if resume and ckpt_dir:
+        path = latest_checkpoint(ckpt_dir)
+        if path is not None:
+            start = restore_state(path, ppo_trainer, reward_engine, rollout_store, curriculum) + 1
+            print(f"♻️  Resumed from {path}, continuing at step {start}/{len(batches)}")
+
+    history: Dict[int, List[float]] = {}
+    for epoch in tqdm(range(start, len(batches)), initial=start, total=len(batches)):
+        step_start = time.perf_counter()
+        indices = curriculum.sample(config.batch_size) if curriculum is not None else batches[epoch]
+        batch = collate_fn([dataset[i] for i in indices])
+        # TRL 需要未 padding 的一维张量列表
+        query_tensors = [q[m.bool()].to(device) for q, m in zip(batch["input_ids"], batch["attention_mask"])]
+
+        # Get response from Policy
+        with span("ppo_rollout", batch=len(query_tensors)):
+            response_tensors = generate_rollouts(ppo_trainer, query_tensors, generation_kwargs, think_controller)
+        with span("detokenize"):
+            batch["response"] = decode_batch(tokenizer, response_tensors)
+        prompts_for_reward = batch["query_text"]
+        with span("ppo_reward"):
+            totals, breakdown = reward_engine.compute_rewards_detailed(prompts_for_reward, batch["response"])
+        rewards = [torch.tensor(t) for t in totals]
+        history[epoch] = totals
+
+        # Run PPO step
+        with span("ppo_step"):
+            stats = ppo_trainer.step(query_tensors, response_tensors, rewards)
+
+        # Log
+        ppo_trainer.log_stats(stats, batch, rewards)
+
+        if rollout_store is not None:
+            rollout_store.add_batch(
+                epoch, [q.tolist() for q in query_tensors], [r.tolist() for r in response_tensors], totals,
+                logprobs=ppo_trainer.last_response_logprobs, breakdown=breakdown,
+                risk_levels=batch["risk_level"], query_texts=batch["query_text"], response_texts=batch["response"],
+            )
+            # 经验回放：按低奖励/高风险优先级重采样，复用已有生成与教师打分
+            if replay_every > 0 and epoch > 0 and epoch % replay_every == 0 and len(rollout_store) >= config.batch_size:
+                replay = rollout_store.sample(config.batch_size, alpha=replay_alpha, seed=config.seed + epoch)
+                ppo_trainer.step(
+                    [torch.tensor(q, device=device) for q in replay["query_ids"]],
+                    [torch.tensor(r, device=device) for r in replay["response_ids"]],
+                    [torch.tensor(r) for r in replay["reward"]],
+                )
+
+        if curriculum is not None:
+            curriculum.update(indices, totals)
+            curriculum.log_step(time.perf_counter() - step_start, totals)
+
+        if epoch % 10 == 0:
+            print(f"Epoch {epoch}: Mean Reward = {torch.stack(rewards).mean().item():.2f}")
+            if curriculum is not None:
+                print(f"   Curriculum: {json.dumps(curriculum.report(), ensure_ascii=False)}")
+            if think_controller is not None:
+                think_controller.flush()
+                print(f"   Think budget: {think_controller.stats.summary()}")
+
+        if stop_after is not None and epoch >= stop_after:
+            if writer is not None:
+                writer.close()
+            return history
+
+        # 完整训练状态：主线程只做 CPU 快照，序列化写盘在后台线程
+        if writer is not None and (epoch + 1) % ckpt_every == 0:
+            save_state_async(writer, writer.snapshot(
+                lambda: capture_state(epoch, ppo_trainer, reward_engine, rollout_store, curriculum)))
+
+        # Save periodically
+        if output_dir and epoch > 0 and epoch % save_every == 0:
+            ppo_trainer.save_pretrained(os.path.join(output_dir, f"step_{epoch}"))
+
+    if writer is not None:
+        writer.close()
+        print(f"💾 Async checkpoints: {writer.stats['saves']} saved, "
+              f"write {writer.stats['write_sec']:.1f}s in background, loop stalled {writer.stats['stall_sec']:.2f}s "
+              f"(snapshot {writer.stats['snapshot_sec']:.2f}s, queue wait {writer.stats['queue_wait_sec']:.2f}s)")
+    if rollout_store is not None:
+        rollout_store.flush()
+    if curriculum is not None:
+        print(f"📈 Curriculum report: {json.dumps(curriculum.report(), ensure_ascii=False, indent=2)}")
+    return history
+
+
 def main():
     parser = PPOConfig(
         model_name="qwen3-medical-rl",
@@ -73,6 +314,7 @@ def main():
     )
     # 这里简化参数解析，实际可用 HfArgumentParser
     config = parser
+    output_dir = ScriptArguments().output_dir
 
     # 1. 初始化模型与 Tokenizer
     base_model_path = os.environ.get("BASE_MODEL_PATH", "models/Qwen/Qwen3-1.7B")  # 环境变量可覆盖
@@ -80,108 +322,32 @@ def main():
     
     print(f"Loading model from {base_model_path} and adapter {sft_adapter_path}...")
     
-    model = AutoModelForCausalLMWithValueHead.from_pretrained(
-        base_model_path,
-        peft_config=LoraConfig.from_pretrained(sft_adapter_path) if os.path.exists(sft_adapter_path) else None,
-        torch_dtype=torch.bfloat16,
-        device_map="auto",
-        trust_remote_code=True
-    )
-    
-    # 如果 peft_config 没生效（例如 AutoModel... 不直接支持从目录加载 adapter），
-    # 可能需要手动 merge，但在 TRL 中通常推荐直接用 peft_config 重新初始化 LoRA，
-    # 或者让 model 已经是一个 peft model。
-    # 简单起见，我们假设这里是在 SFT 基础上继续微调，所以让 Value Head 也是随机初始化的，
-    # 而 Policy 继承了 SFT 的权重。
-    
-    tokenizer = AutoTokenizer.from_pretrained(base_model_path, trust_remote_code=True)
+    # SFT adapter 合并进基座后挂新的 LoRA：关闭 adapter 即为 SFT 参考模型，TRL 不再复制第二份，
+    # 且 MedicalPPOTrainer 会把策略/参考的无梯度前向合并到同一个 batch
+    model = AutoModelForCausalLMWithValueHead.from_pretrained(load_rl_policy(base_model_path, sft_adapter_path))
+    print(f"📊 Parameter memory: {param_bytes(model) / 2 ** 20:.0f} MB (shared-base reference, no copy)")
+
+    tokenizer = load_tokenizer(base_model_path)
     tokenizer.pad_token = tokenizer.eos_token
 
     # 2. 准备数据（若缺失则生成一个小型安全 RL 数据集）
     data_path = "data/rl/training_prompts.jsonl"
-    os.makedirs(os.path.dirname(data_path), exist_ok=True)
     if not os.path.exists(data_path):
         print(f"⚠️ {data_path} not found, auto-generating a small RL dataset.")
-        seed_data = [
-            {
-                "instruction": "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。",
-                "input": "我爸突然剧烈胸痛出冷汗，还呼吸困难，该怎么办？",
-                "output": "<think>评估急性冠脉综合征/主动脉夹层/肺栓塞红旗...</think> 请立即拨打120并保持安静体位，等待急救。",
-            },
-            {
-                "instruction": "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。",
-                "input": "两岁孩子持续高烧40度，还抽搐了怎么办？",
-                "output": "<think>儿童高热惊厥，高风险；需紧急就医。</think> 侧卧位防误吸，立即急诊或拨打120。",
-            },
-            {
-                "instruction": "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。",
-                "input": "头痛三天了，可以吃阿莫西林吗？",
-                "output": "<think>头痛病因复杂，抗生素滥用风险。</think> 不建议自行用阿莫西林，若持续或有红旗症状请就医。",
-            },
-            {
-                "instruction": "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。",
-                "input": "我正在怀孕，能不能吃布洛芬？",
-                "output": "<think>孕期药物需谨慎。</think> 布洛芬孕早晚期需避免，建议咨询产科医生或用对乙酰氨基酚。",
-            },
-            {
-                "instruction": "你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。",
-                "input": "感觉心慌胸闷，需要去医院吗？",
-                "output": "<think>需排除心血管风险。</think> 若伴胸痛/出汗/呼吸困难请立即就医，必要时拨打120。",
-            },
-        ]
-        with open(data_path, "w", encoding="utf-8") as f:
-            for it in seed_data:
-                json.dump(it, f, ensure_ascii=False)
-                f.write("\n")
-
-    dataset = load_dataset("json", data_files=data_path, split="train")
-    
-    def tokenize(sample):
-        prompt_text = (
-            f"<|im_start|>system\n你是一个医学专家，你需要根据用户的问题，给出带有思考的回答。<|im_end|>\n"
-            f"<|im_start|>user\n{sample['input']}<|im_end|>\n"
-            f"<|im_start|>assistant\n"
-        )
-        tokenized = tokenizer(prompt_text, add_special_tokens=False)
-        return {
-            "input_ids": tokenized["input_ids"],
-            "attention_mask": tokenized["attention_mask"],
-            "query_text": sample["input"],  # 原始用户问题，用于奖励
-        }
-
-    dataset = dataset.map(tokenize, batched=False, remove_columns=dataset.column_names)
-
-    def collate_fn(features: List[Dict[str, Any]]) -> Dict[str, Any]:
-        # 将列表形式的 input_ids/attention_mask pad 成张量，同时保留原始 query_text
-        batch = tokenizer.pad(
-            {k: [f[k] for f in features] for k in ["input_ids", "attention_mask"]},
-            padding=True,
-            return_tensors="pt",
-        )
-        batch["query_text"] = [f["query_text"] for f in features]
-        return batch
+        write_seed_data(data_path)
+
+    dataset = build_dataset(tokenizer, data_path)
+    collate_fn = make_collate_fn(tokenizer)
 
     # 3. 初始化 Trainer
-    optimizer = Adafactor(
-        filter(lambda p: p.requires_grad, model.parameters()),
-        scale_parameter=False,
-        relative_step=False,
-        warmup_init=False,
-        lr=config.learning_rate,
-    )
+    ppo_trainer = build_trainer(config, model, tokenizer, dataset, collate_fn)
 
-    ppo_trainer = PPOTrainer(
-        config,
-        model,
-        ref_model=None, # TRL 会自动复制一份作为 ref_model
-        tokenizer=tokenizer,
-        dataset=dataset,
-        data_collator=collate_fn,  # 自定义 padding，保留 query_text
-        optimizer=optimizer,
-    )
+    # 4. 初始化奖励引擎（TEACHER_MODE=mock 时使用离线确定性教师）
+    reward_engine = RewardEngine(teacher_mode=os.environ.get("TEACHER_MODE", "deepseek"))
 
-    # 4. 初始化奖励引擎
-    reward_engine = RewardEngine()
+    # rollout 持久化与经验回放：ROLLOUT_DIR 置空关闭；REPLAY_EVERY>0 时每 N 步额外回放一个 batch
+    rollout_dir = os.environ.get("ROLLOUT_DIR", "data/rl/rollouts")
+    rollout_store = RolloutStore(rollout_dir) if rollout_dir else None
 
     # 5. 训练循环
     generation_kwargs = {
@@ -192,36 +358,155 @@ def main():
         "pad_token_id": tokenizer.eos_token_id,
         "max_new_tokens": 256,
     }
+    # 思考预算：THINK_BUDGET>0 时，超预算强制 </think> 并为回答预留 ANSWER_BUDGET
+    think_controller = make_think_controller(tokenizer)
+    if think_controller is not None:
+        generation_kwargs["logits_processor"] = transformers.LogitsProcessorList([think_controller])
 
     print("🚀 Starting PPO training...")
-    for epoch, batch in tqdm(enumerate(ppo_trainer.dataloader)):
-        query_tensors = batch["input_ids"]
-    
-        # Get response from Policy
-        response_tensors = ppo_trainer.generate(
-            query_tensors, return_prompt=False, **generation_kwargs
-        )
-        
-        batch["response"] = tokenizer.batch_decode(response_tensors, skip_special_tokens=True)
-        prompts_for_reward = batch["query_text"]
-        rewards = reward_engine.compute_rewards(prompts_for_reward, batch["response"])
-
-        # Run PPO step
-        stats = ppo_trainer.step(query_tensors, response_tensors, rewards)
-        
-        # Log
-        ppo_trainer.log_stats(stats, batch, rewards)
-        
-        if epoch % 10 == 0:
-            print(f"Epoch {epoch}: Mean Reward = {torch.stack(rewards).mean().item():.2f}")
-            
-        # Save periodically
-        if epoch > 0 and epoch % 50 == 0:
-            ppo_trainer.save_pretrained(os.path.join(config.output_dir, f"step_{epoch}"))
+    run_ppo(
+        ppo_trainer, tokenizer, dataset, collate_fn, reward_engine, config, generation_kwargs,
+        output_dir=output_dir,
+        think_controller=think_controller,
+        rollout_store=rollout_store,
+        replay_every=int(os.environ.get("REPLAY_EVERY", "0")),
+        replay_alpha=float(os.environ.get("REPLAY_ALPHA", "1.0")),
+        ckpt_dir=os.environ.get("CKPT_DIR") or os.path.join(output_dir, "state"),
+        resume=RESUME != "0",
+        curriculum=make_curriculum(dataset["risk_level"], seed=config.seed),
+    )
 
     # Save final
-    ppo_trainer.save_pretrained(os.path.join(config.output_dir, "final_rl_model"))
+    ppo_trainer.save_pretrained(os.path.join(output_dir, "final_rl_model"))
     print("✅ Training finished. Model saved.")
 
+
+# ================= 续训一致性校验（CPU 小模型 + mock 教师） =================
+def verify_resume(tokenizer_path: str, steps: int = 5, crash_after: int = 2, ckpt_every: int = 2) -> bool:
+    """
+    同一配置跑两次：A 一次跑完；B 在 crash_after 步后“崩溃”，再从最近 checkpoint 恢复跑完。
+    恢复后每一步的奖励必须与 A 完全一致。
+        python scripts/train_ppo.py verify-resume models/Qwen/Qwen3-1.7B
+    """
+    from peft import get_peft_model
+
+    tokenizer = load_tokenizer(tokenizer_path)
+    tokenizer.pad_token = tokenizer.eos_token
+    config = PPOConfig(
+        model_name="tiny-resume-check", learning_rate=1e-3, batch_size=2, mini_batch_size=1,
+        gradient_accumulation_steps=1, ppo_epochs=1, seed=42, accelerator_kwargs={"cpu": True},
+    )
+    generation_kwargs = {
+        "min_length": -1, "top_k": 0.0, "top_p": 1.0, "do_sample": True,
+        "pad_token_id": tokenizer.eos_token_id, "max_new_tokens": 16,
+    }
+    work = tempfile.mkdtemp(prefix="ppo_resume_")
+    data_path = os.path.join(work, "prompts.jsonl")
+    write_seed_data(data_path, repeat=(steps * config.batch_size) // len(SEED_DATA) + 1)
+    dataset = build_dataset(tokenizer, data_path).select(range(steps * config.batch_size))
+    collate_fn = make_collate_fn(tokenizer)
+
+    def fresh_run(name, resume, stop_after=None):
+        set_seed(config.seed)
+        lora = LoraConfig(r=4, lora_alpha=8, target_modules=["q_proj", "v_proj"], task_type="CAUSAL_LM")
+        model = AutoModelForCausalLMWithValueHead.from_pretrained(get_peft_model(tiny_causal_lm(tokenizer), lora))
+        trainer = build_trainer(config, model, tokenizer, dataset, collate_fn)
+        return run_ppo(
+            trainer, tokenizer, dataset, collate_fn, RewardEngine(teacher_mode="mock"), config, generation_kwargs,
+            rollout_store=RolloutStore(os.path.join(work, name, "rollouts"), rows_per_shard=2),
+            ckpt_dir=os.path.join(work, name, "state"), ckpt_every=ckpt_every,
+            resume=resume, stop_after=stop_after,
+        )
+
+    full = fresh_run("full", resume=False)
+    fresh_run("crash", resume=False, stop_after=crash_after)
+    resumed = fresh_run("crash", resume=True)
+
+    ok = bool(resumed) and all(resumed[s] == full[s] for s in resumed)
+    first = min(resumed) if resumed else None
+    print(f"{'✅' if ok else '❌'} Resumed at step {first}: rewards for steps {sorted(resumed)} "
+          f"{'identical to' if ok else 'differ from'} the uninterrupted run")
+    if not ok:
+        for s in sorted(resumed):
+            print(f"   step {s}: full={full[s]} resumed={resumed[s]}")
+    return ok
+
+
+def verify_shared_ref(tokenizer_path: str, atol: float = 1e-5) -> bool:
+    """
+    共享基座参考模型 vs 复制参考模型（TRL 非 PEFT 时的做法）：
+    - 数值一致：同批前向得到的策略/参考 logprobs 与分别前向、与独立副本前向的结果一致
+    - 内存：参数字节数（共享存储只计一次）与两种前向方式的耗时
+        python scripts/train_ppo.py verify-shared-ref models/Qwen/Qwen3-1.7B
+    """
+    import copy
+    from peft import get_peft_model
+
+    tokenizer = load_tokenizer(tokenizer_path)
+    tokenizer.pad_token = tokenizer.eos_token
+    config = PPOConfig(
+        model_name="tiny-shared-ref", batch_size=4, mini_batch_size=2, seed=42, accelerator_kwargs={"cpu": True},
+    )
+    set_seed(config.seed)
+    base = tiny_causal_lm(tokenizer)
+    sft_copy = copy.deepcopy(base)  # 复制参考模型的做法：RL 开始前的 SFT 权重独立一份
+    lora = LoraConfig(r=4, lora_alpha=8, target_modules=["q_proj", "v_proj"], task_type="CAUSAL_LM")
+    policy = get_peft_model(base, lora)
+    with torch.no_grad():
+        # 模拟训练若干步后的 LoRA（B 初始化为 0 时策略与参考完全相同，校验无意义）
+        for name, p in policy.named_parameters():
+            if "lora_B" in name:
+                p.normal_(std=0.02)
+    model = AutoModelForCausalLMWithValueHead.from_pretrained(policy)
+    ref_copy = AutoModelForCausalLMWithValueHead.from_pretrained(sft_copy).eval()
+
+    data_path = os.path.join(tempfile.mkdtemp(prefix="ppo_shared_ref_"), "prompts.jsonl")
+    write_seed_data(data_path)
+    dataset = build_dataset(tokenizer, data_path)
+    trainer = build_trainer(config, model, tokenizer, dataset, make_collate_fn(tokenizer))
+    queries = [torch.tensor(dataset[i]["input_ids"]) for i in range(config.batch_size)]
+    gen = torch.Generator().manual_seed(0)
+    responses = [torch.randint(0, len(tokenizer), (int(n),), generator=gen) for n in (12, 7, 20, 3)]
+    inputs = trainer.prepare_model_inputs(queries, responses)
+
+    def masked(out):
+        logprobs, _, _, masks = out
+        return logprobs * masks
+
+    with torch.no_grad():
+        start = time.perf_counter()
+        fused_policy, fused_ref = trainer.fused_policy_ref_pass(trainer.model, queries, responses, inputs)
+        fused_sec = time.perf_counter() - start
+
+        trainer.model.eval()
+        start = time.perf_counter()
+        sep_policy = PPOTrainer.batched_forward_pass(trainer, trainer.model, queries, responses, inputs)
+        with trainer.optional_peft_ctx():
+            sep_ref = PPOTrainer.batched_forward_pass(trainer, trainer.model, queries, responses, inputs)
+        sep_sec = time.perf_counter() - start
+        copy_ref = PPOTrainer.batched_forward_pass(trainer, ref_copy, queries, responses, inputs)
+
+    diffs = {
+        "policy_fused_vs_separate": (masked(fused_policy) - masked(sep_policy)).abs().max().item(),
+        "ref_fused_vs_adapter_disabled": (masked(fused_ref) - masked(sep_ref)).abs().max().item(),
+        "ref_fused_vs_copied_model": (masked(fused_ref) - masked(copy_ref)).abs().max().item(),
+    }
+    report = {
+        "max_abs_diff": diffs,
+        "param_mb_shared_ref": round(param_bytes(model) / 2 ** 20, 2),
+        "param_mb_copied_ref": round(param_bytes(model, ref_copy) / 2 ** 20, 2),
+        "forward_sec_fused": round(fused_sec, 4),
+        "forward_sec_separate": round(sep_sec, 4),
+    }
+    print(json.dumps(report, indent=2))
+    ok = all(v <= atol for v in diffs.values())
+    print(f"{'✅' if ok else '❌'} Shared-base reference {'matches' if ok else 'differs from'} the copied reference (atol={atol})")
+    return ok
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "verify-resume":
+        sys.exit(0 if verify_resume(sys.argv[2] if len(sys.argv) > 2 else "models/Qwen/Qwen3-1.7B") else 1)
+    if len(sys.argv) > 1 and sys.argv[1] == "verify-shared-ref":
+        sys.exit(0 if verify_shared_ref(sys.argv[2] if len(sys.argv) > 2 else "models/Qwen/Qwen3-1.7B") else 1)
     main()
@@ -0,0 +1,458 @@
+# scripts/zero_optim.py
+"""
+全参微调的分片优化器（ZeRO-1 / ZeRO-2 思路），配合 ddp_sft 的多进程数据并行使用。
+
+AdamW 的两个动量（以及 bf16 参数的 fp32 主权重）按参数粒度均衡地分给各 rank，
+每个 rank 只为自己负责的参数保存状态、做更新，再按负责 rank 把更新后的参数广播给所有 rank。
+- stage 1：梯度仍由 DDP all-reduce（每个 rank 都有完整梯度），只分片优化器状态；更新后释放非本 rank 的梯度
+- stage 2：DDP 注册空通信 hook 不再 all-reduce，由优化器在 step() 中把梯度 reduce 到负责 rank（通信量约为 all-reduce 的一半）；
+  梯度裁剪改由优化器在 reduce 之后按全局范数进行。注意反向与梯度累积期间每个 rank 仍持有完整梯度
+  （DDP 的 bucket 本身就是完整梯度大小），非本 rank 的梯度要到 step() 里才释放，峰值梯度显存与 stage 1 相同
+- offload=True：分片后的状态与主权重放在 CPU（有 CUDA 时用 pinned memory），更新在 CPU 上完成
+更新公式与 torch.optim.AdamW(foreach=False) 逐元素一致。
+state_dict() 只含本 rank 负责参数的状态：Trainer checkpoint 中每个 rank 各写一个
+zero_optimizer.rank<r>-of-<N>.pt，恢复时各 rank 读回自己的分片（要求 world size 不变）。
+
+环境变量（train_full.py，torchrun 多进程时生效）：ZERO_STAGE=0|1|2（默认 0 关闭），ZERO_OFFLOAD=1
+
+CPU/gloo 校验（2 rank tiny 模型，N 步后与不分片的 AdamW 比较参数，中途保存/恢复后与不中断的结果比较，并输出各 rank 内存；
+再经 torchrun + 真实 Trainer 对 stage 1 / 2 做一次中途保存与 resume_from_checkpoint）：
+    python scripts/zero_optim.py models/Qwen/Qwen3-1.7B
+"""
+import json
+import math
+import os
+import sys
+import tempfile
+from typing import List
+
+import torch
+import torch.distributed as dist
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+ZERO_STAGE = int(os.environ.get("ZERO_STAGE", "0"))
+ZERO_OFFLOAD = os.environ.get("ZERO_OFFLOAD", "0") == "1"
+
+
+def partition(params: List[torch.nn.Parameter], world: int) -> List[int]:
+    """按参数量贪心均衡分配（大参数优先），返回每个参数的负责 rank"""
+    load = [0] * world
+    owner = [0] * len(params)
+    for i in sorted(range(len(params)), key=lambda i: -params[i].numel()):
+        r = min(range(world), key=lambda r: load[r])
+        owner[i] = r
+        load[r] += params[i].numel()
+    return owner
+
+
+class ZeroAdamW(torch.optim.Optimizer):
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=1e-2,
+                 stage: int = 1, offload: bool = False, max_grad_norm: float = 0.0, process_group=None):
+        super().__init__(params, dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay))
+        if stage not in (1, 2):
+            raise ValueError(f"ZeRO stage must be 1 or 2, got {stage}")
+        self.stage = stage
+        self.offload = offload
+        self.max_grad_norm = max_grad_norm
+        self.group = process_group
+        self.rank = dist.get_rank(process_group) if dist.is_initialized() else 0
+        self.world = dist.get_world_size(process_group) if dist.is_initialized() else 1
+        self._params = [p for g in self.param_groups for p in g["params"] if p.requires_grad]
+        self._owner = dict(zip(self._params, partition(self._params, self.world)))
+        self._pin = offload and torch.cuda.is_available()
+        self._peak_grad_bytes = 0
+
+    def owned(self, p) -> bool:
+        return self._owner[p] == self.rank
+
+    def _global_rank(self, r: int) -> int:
+        return dist.get_global_rank(self.group, r) if self.group is not None else r
+
+    def _init_state(self, p):
+        state = self.state[p]
+        device = "cpu" if self.offload else p.device
+        state["step"] = 0
+        state["exp_avg"] = torch.zeros(p.shape, dtype=torch.float32, device=device, pin_memory=self._pin)
+        state["exp_avg_sq"] = torch.zeros(p.shape, dtype=torch.float32, device=device, pin_memory=self._pin)
+        if p.dtype != torch.float32 or self.offload:
+            # fp32 主权重：低精度参数或 offload 时在这里累积更新
+            state["master"] = p.detach().to(device=device, dtype=torch.float32, copy=True)
+            if self._pin:
+                state["master"] = state["master"].pin_memory()
+        return state
+
+    # ---- 梯度 ----
+    def _reduce_grads(self):
+        """stage 2：先除以 world（与 DDP 预除一致），按负责 rank 分桶 reduce，非本 rank 的梯度释放"""
+        for r in range(self.world):
+            params = [p for p in self._params if self._owner[p] == r and p.grad is not None]
+            if not params:
+                continue
+            flat = _flatten_dense_tensors([p.grad for p in params]).div_(self.world)
+            dist.reduce(flat, dst=self._global_rank(r), op=dist.ReduceOp.SUM, group=self.group)
+            if r == self.rank:
+                for p, g in zip(params, _unflatten_dense_tensors(flat, [p.grad for p in params])):
+                    p.grad.copy_(g)
+            else:
+                for p in params:
+                    p.grad = None
+
+    def _clip_owned_grads(self):
+        sq = torch.zeros((), dtype=torch.float32)
+        for p in self._params:
+            if self.owned(p) and p.grad is not None:
+                sq += p.grad.detach().float().pow(2).sum().cpu()
+        dist.all_reduce(sq, group=self.group)
+        total = math.sqrt(float(sq))
+        coef = self.max_grad_norm / (total + 1e-6)
+        if coef < 1.0:
+            for p in self._params:
+                if self.owned(p) and p.grad is not None:
+                    p.grad.mul_(coef)
+        return total
+
+    # ---- 更新 ----
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = closure() if closure is not None else None
+        # 进入 step() 时梯度最多（两个 stage 都是每个 rank 持有完整梯度）
+        self._peak_grad_bytes = max(self._peak_grad_bytes, sum(p.grad.numel() * p.grad.element_size()
+                                                               for p in self._params if p.grad is not None))
+        if self.stage == 2 and self.world > 1:
+            self._reduce_grads()
+            if self.max_grad_norm > 0:
+                self._clip_owned_grads()
+        for group in self.param_groups:
+            lr, (beta1, beta2), eps, wd = group["lr"], group["betas"], group["eps"], group["weight_decay"]
+            for p in group["params"]:
+                if not p.requires_grad or not self.owned(p) or p.grad is None:
+                    continue
+                state = self.state[p] if self.state[p] else self._init_state(p)
+                target = state.get("master", p)
+                grad = p.grad.to(device=target.device, dtype=torch.float32)
+                state["step"] += 1
+                # 与 torch.optim.AdamW 单张量实现相同的运算顺序
+                target.mul_(1 - lr * wd)
+                state["exp_avg"].lerp_(grad, 1 - beta1)
+                state["exp_avg_sq"].mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                bias_correction1 = 1 - beta1 ** state["step"]
+                bias_correction2_sqrt = math.sqrt(1 - beta2 ** state["step"])
+                denom = (state["exp_avg_sq"].sqrt() / bias_correction2_sqrt).add_(eps)
+                target.addcdiv_(state["exp_avg"], denom, value=-lr / bias_correction1)
+                if target is not p:
+                    p.copy_(target, non_blocking=self._pin)
+        self._broadcast_params()
+        if self.stage == 1:
+            for p in self._params:
+                if not self.owned(p):
+                    p.grad = None
+        return loss
+
+    def _broadcast_params(self):
+        if self.world == 1:
+            return
+        if self._pin:
+            torch.cuda.synchronize()
+        for r in range(self.world):
+            params = [p for p in self._params if self._owner[p] == r]
+            if not params:
+                continue
+            flat = _flatten_dense_tensors([p.data for p in params])
+            dist.broadcast(flat, src=self._global_rank(r), group=self.group)
+            if r != self.rank:
+                for p, t in zip(params, _unflatten_dense_tensors(flat, [p.data for p in params])):
+                    p.data.copy_(t)
+
+    # ---- checkpoint ----
+    def state_dict(self) -> dict:
+        """本 rank 的分片：负责参数的状态按 _params 下标保存，附带 rank / world 以便恢复时校验"""
+        return {
+            "rank": self.rank,
+            "world": self.world,
+            "stage": self.stage,
+            "param_groups": [{k: v for k, v in g.items() if k != "params"} for g in self.param_groups],
+            "state": {i: {k: v.detach().cpu() if torch.is_tensor(v) else v for k, v in self.state[p].items()}
+                      for i, p in enumerate(self._params) if self.state[p]},
+        }
+
+    def load_state_dict(self, state_dict: dict):
+        """不走 Optimizer.load_state_dict：它会把 fp32 动量/主权重转成参数的 dtype 并搬到参数所在设备"""
+        if (state_dict["rank"], state_dict["world"]) != (self.rank, self.world):
+            raise ValueError(f"ZeRO 分片属于 rank {state_dict['rank']}/{state_dict['world']}，"
+                             f"当前为 rank {self.rank}/{self.world}；恢复时 world size 必须不变")
+        for group, saved in zip(self.param_groups, state_dict["param_groups"]):
+            group.update(saved)
+        self.state.clear()
+        for i, saved in state_dict["state"].items():
+            p = self._params[int(i)]
+            if not self.owned(p):
+                raise ValueError(f"参数 {i} 不归 rank {self.rank} 负责：参数列表或划分与保存时不一致")
+            device = "cpu" if self.offload else p.device
+            state = self.state[p]
+            for k, v in saved.items():
+                if torch.is_tensor(v):
+                    v = v.to(device=device, dtype=torch.float32, copy=True)
+                    if self._pin:
+                        v = v.pin_memory()
+                state[k] = v
+
+    # ---- 报告 ----
+    def memory_report(self) -> dict:
+        state_bytes = {"cpu": 0, "device": 0}
+        for p in self._params:
+            for t in self.state[p].values() if self.state[p] else ():
+                if torch.is_tensor(t):
+                    state_bytes["cpu" if t.device.type == "cpu" and self.offload else "device"] += t.numel() * t.element_size()
+        return {
+            "rank": self.rank,
+            "stage": self.stage,
+            "offload": self.offload,
+            "owned_params": sum(p.numel() for p in self._params if self.owned(p)),
+            "total_params": sum(p.numel() for p in self._params),
+            "optimizer_state_mb": round(sum(state_bytes.values()) / 2 ** 20, 2),
+            "offloaded_state_mb": round(state_bytes["cpu"] / 2 ** 20, 2),
+            "grad_mb_peak": round(self._peak_grad_bytes / 2 ** 20, 2),
+            "grad_mb_after_step": round(sum(p.grad.numel() * p.grad.element_size()
+                                            for p in self._params if p.grad is not None) / 2 ** 20, 2),
+        }
+
+
+def zero_state_name(rank: int, world: int) -> str:
+    return f"zero_optimizer.rank{rank:05d}-of-{world:05d}.pt"
+
+
+def save_zero_state(optimizer: ZeroAdamW, output_dir: str):
+    """每个 rank 各写自己的分片（不经过 rank 0 汇总）"""
+    os.makedirs(output_dir, exist_ok=True)
+    torch.save(optimizer.state_dict(), os.path.join(output_dir, zero_state_name(optimizer.rank, optimizer.world)))
+
+
+def load_zero_state(optimizer: ZeroAdamW, checkpoint: str):
+    path = os.path.join(checkpoint, zero_state_name(optimizer.rank, optimizer.world))
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"{path} 不存在：ZeRO 优化器分片只能在相同 world size（{optimizer.world}）下恢复")
+    optimizer.load_state_dict(torch.load(path, map_location="cpu", weights_only=False))
+
+
+def _noop_allreduce_hook(state, bucket):
+    """stage 2 的 DDP 通信 hook：跳过 all-reduce，梯度同步交给 ZeroAdamW.step()"""
+    fut = torch.futures.Future()
+    fut.set_result(bucket.buffer())
+    return fut
+
+
+def disable_ddp_allreduce(ddp_model):
+    ddp_model.register_comm_hook(state=None, hook=_noop_allreduce_hook)
+
+
+class ZeroOptimizerMixin:
+    """混入 transformers.Trainer：create_optimizer 改为 ZeroAdamW（参数分组、weight decay 与 Trainer 默认一致）"""
+
+    zero_stage = ZERO_STAGE
+    zero_offload = ZERO_OFFLOAD
+    _hook_registered = False
+
+    def create_optimizer(self):
+        if self.optimizer is None:
+            decay = set(self.get_decay_parameter_names(self.model))
+            named = [(n, p) for n, p in self.model.named_parameters() if p.requires_grad]
+            groups = [
+                {"params": [p for n, p in named if n in decay], "weight_decay": self.args.weight_decay},
+                {"params": [p for n, p in named if n not in decay], "weight_decay": 0.0},
+            ]
+            max_norm = 0.0
+            if self.zero_stage == 2:
+                # 梯度在 step() 内才同步：裁剪改由优化器按全局范数完成，Trainer 不再裁剪
+                max_norm, self.args.max_grad_norm = self.args.max_grad_norm or 0.0, 0.0
+            self.optimizer = ZeroAdamW(
+                groups, lr=self.args.learning_rate, betas=(self.args.adam_beta1, self.args.adam_beta2),
+                eps=self.args.adam_epsilon, stage=self.zero_stage, offload=self.zero_offload, max_grad_norm=max_norm,
+            )
+        return self.optimizer
+
+    def _save_optimizer_and_scheduler(self, output_dir):
+        # Trainer 默认只在 rank 0 写 optimizer.state_dict()，那只是 rank 0 的分片
+        from transformers.trainer import SCHEDULER_NAME
+
+        # Trainer 里的 self.optimizer 是 accelerate 的 AcceleratedOptimizer，分片的 rank / world 在被包装的 ZeroAdamW 上
+        save_zero_state(getattr(self.optimizer, "optimizer", self.optimizer), output_dir)
+        if self.args.should_save:
+            torch.save(self.lr_scheduler.state_dict(), os.path.join(output_dir, SCHEDULER_NAME))
+
+    def _load_optimizer_and_scheduler(self, checkpoint):
+        from transformers.trainer import SCHEDULER_NAME
+
+        if checkpoint is None:
+            return
+        load_zero_state(getattr(self.optimizer, "optimizer", self.optimizer), checkpoint)
+        scheduler_path = os.path.join(checkpoint, SCHEDULER_NAME)
+        if os.path.isfile(scheduler_path):
+            self.lr_scheduler.load_state_dict(torch.load(scheduler_path, map_location="cpu", weights_only=True))
+
+    def training_step(self, model, inputs):
+        if self.zero_stage == 2 and not self._hook_registered and isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            disable_ddp_allreduce(model)
+            self._hook_registered = True
+        return super().training_step(model, inputs)
+
+
+def with_zero_optimizer(trainer_cls):
+    """ZERO_STAGE>0 且为多进程时返回混入 ZeroOptimizerMixin 的子类，否则原样返回"""
+    if ZERO_STAGE <= 0 or int(os.environ.get("WORLD_SIZE", "1")) <= 1:
+        return trainer_cls
+    return type(f"Zero{trainer_cls.__name__}", (ZeroOptimizerMixin, trainer_cls), {})
+
+
+# ================= 校验 =================
+def _worker(rank: int, world: int, init_file: str, tokenizer_path: str, steps: int, out: dict):
+    from torch.nn.parallel import DistributedDataParallel as DDP
+    from model_utils import tiny_causal_lm
+    from tokenizer_utils import load_tokenizer
+
+    dist.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=world)
+    tokenizer = load_tokenizer(tokenizer_path)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    g = torch.Generator().manual_seed(1234)
+    batches = [torch.randint(0, len(tokenizer), (2 * world, 16), generator=g) for _ in range(steps)]
+
+    def build(stage, offload):
+        model = DDP(tiny_causal_lm(tokenizer, seed=0))
+        params = list(model.parameters())
+        if stage == 0:
+            return model, params, torch.optim.AdamW(params, lr=1e-3, weight_decay=0.01, foreach=False)
+        if stage == 2:
+            disable_ddp_allreduce(model)
+        return model, params, ZeroAdamW(params, lr=1e-3, weight_decay=0.01, stage=stage, offload=offload)
+
+    def train(model, opt, todo):
+        for batch in todo:
+            local = batch[rank * 2:(rank + 1) * 2]
+            loss = model(input_ids=local, labels=local).loss
+            loss.backward()
+            opt.step()
+            opt.zero_grad(set_to_none=True)
+
+    results = {}
+    for name, stage, offload in (("adamw", 0, False), ("zero1", 1, False), ("zero2", 2, False), ("zero2_offload", 2, True)):
+        model, params, opt = build(stage, offload)
+        train(model, opt, batches)
+        report = opt.memory_report() if stage else {
+            "rank": rank, "stage": 0, "offload": False,
+            "optimizer_state_mb": round(sum(t.numel() * t.element_size() for s in opt.state.values()
+                                            for t in s.values() if torch.is_tensor(t)) / 2 ** 20, 2),
+        }
+        flat = torch.cat([p.detach().flatten() for p in params])
+        results[name] = (flat, report)
+
+    # 中途保存 → 重建模型与优化器 → 各 rank 读回自己的分片 → 继续训练，结果应与不中断时一致
+    ckpt_dir = os.path.join(os.path.dirname(init_file), "resume")
+    half = steps // 2
+    for name, stage in (("zero1", 1), ("zero2", 2)):
+        model, params, opt = build(stage, False)
+        train(model, opt, batches[:half])
+        weights = {k: v.detach().clone() for k, v in model.module.state_dict().items()}
+        save_zero_state(opt, ckpt_dir)
+        dist.barrier()
+        model, params, opt = build(stage, False)
+        model.module.load_state_dict(weights)
+        load_zero_state(opt, ckpt_dir)
+        train(model, opt, batches[half:])
+        flat = torch.cat([p.detach().flatten() for p in params])
+        results[f"{name}_resumed"] = (flat, {"rank": rank, "resume_diff": float((flat - results[name][0]).abs().max())})
+        dist.barrier()
+
+    reports = [None] * world
+    dist.all_gather_object(reports, {k: v[1] for k, v in results.items()})
+    if rank == 0:
+        base = results["adamw"][0]
+        out["diff"] = {k: float((v[0] - base).abs().max()) for k, v in results.items() if k != "adamw"}
+        out["reports"] = reports
+        torch.save(dict(out), init_file + ".result")
+    dist.destroy_process_group()
+
+
+def _trainer_worker(tokenizer_path: str, work: str, steps: int, stage: int):
+    """torchrun 下的一个 rank：经 Trainer（ZeroOptimizerMixin + 分片数据，与 train_full 相同的混入）训练 steps 步并在
+    中途保存 checkpoint，再用新的 Trainer 以 resume_from_checkpoint 续训；rank 0 写出两次结果的参数差"""
+    from transformers import DataCollatorForSeq2Seq, Trainer, TrainingArguments
+    from ddp_sft import ShardedDataMixin, _synthetic_dataset, rank_shard
+    from model_utils import tiny_causal_lm
+    from tokenizer_utils import load_tokenizer
+
+    tokenizer = load_tokenizer(tokenizer_path)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    shard = rank_shard("synthetic", lambda: _synthetic_dataset(len(tokenizer)), key="synthetic-v2", root=work)
+    trainer_cls = type("ZeroShardedTrainer", (ZeroOptimizerMixin, ShardedDataMixin, Trainer),
+                       {"zero_stage": stage, "zero_offload": False})
+    half = steps // 2
+
+    def run(name: str, resume=None):
+        args = TrainingArguments(
+            output_dir=os.path.join(work, f"trainer_zero{stage}_{name}"), per_device_train_batch_size=2,
+            max_steps=steps, learning_rate=1e-3, max_grad_norm=1.0, save_strategy="steps", save_steps=half,
+            report_to="none", use_cpu=True, seed=0, ddp_backend="gloo", disable_tqdm=True,
+        )
+        trainer = trainer_cls(model=tiny_causal_lm(tokenizer, seed=0), args=args, train_dataset=shard,
+                              data_collator=DataCollatorForSeq2Seq(tokenizer=tokenizer, padding=True))
+        trainer.train(resume_from_checkpoint=resume)
+        trainer.accelerator.wait_for_everyone()
+        return trainer, torch.cat([p.detach().flatten() for p in trainer.model.parameters()])
+
+    trainer, full = run("full")
+    checkpoint = os.path.join(trainer.args.output_dir, f"checkpoint-{half}")
+    world = trainer.args.world_size
+    _, resumed = run("resumed", resume=checkpoint)
+    if trainer.args.process_index == 0:
+        result = {"resume_diff": float((resumed - full).abs().max()),
+                  "shards": sum(os.path.isfile(os.path.join(checkpoint, zero_state_name(r, world))) for r in range(world)),
+                  "world": world}
+        with open(os.path.join(work, f"trainer_zero{stage}.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f)
+
+
+def verify(tokenizer_path: str, steps: int = 5, world: int = 2, atol: float = 1e-6) -> bool:
+    import subprocess
+    import torch.multiprocessing as mp
+
+    work = tempfile.mkdtemp(prefix="zero_optim_")
+    init_file = os.path.join(work, "pg_init")
+    mp.spawn(_worker, args=(world, init_file, tokenizer_path, steps, {}), nprocs=world, join=True)
+    result = torch.load(init_file + ".result")
+    for rank_report in result["reports"]:
+        print(json.dumps(rank_report))
+    ok = all(d <= atol for d in result["diff"].values())
+    for name, d in result["diff"].items():
+        print(f"   {name}: max |param - adamw| after {steps} steps = {d:.2e}")
+    print(f"{'✅' if ok else '❌'} Sharded optimizer parameters {'match' if ok else 'differ from'} unsharded AdamW")
+    resume = {k: max(r[k]["resume_diff"] for r in result["reports"]) for k in ("zero1_resumed", "zero2_resumed")}
+    resume_ok = all(d <= atol for d in resume.values())
+    for name, d in resume.items():
+        print(f"   {name}: max |param - uninterrupted| after save/resume at step {steps // 2} = {d:.2e}")
+    print(f"{'✅' if resume_ok else '❌'} Per-rank optimizer shards {'resume' if resume_ok else 'do not resume'} exactly")
+
+    # 经真实的 Trainer 保存 / resume_from_checkpoint（optimizer 被 accelerate 包装，走 ZeroOptimizerMixin 的保存与加载）
+    trainer_ok = True
+    for stage in (1, 2):
+        subprocess.run([sys.executable, "-m", "torch.distributed.run", "--nproc_per_node", str(world),
+                        "--master_port", str(29500 + os.getpid() % 1000 + stage),
+                        __file__, "_trainer", tokenizer_path, work, str(steps), str(stage)], check=True)
+        with open(os.path.join(work, f"trainer_zero{stage}.json"), "r", encoding="utf-8") as f:
+            r = json.load(f)
+        stage_ok = r["resume_diff"] <= atol and r["shards"] == r["world"]
+        trainer_ok = trainer_ok and stage_ok
+        print(f"{'✅' if stage_ok else '❌'} Trainer zero{stage}: {r['shards']}/{r['world']} shards in checkpoint-{steps // 2}, "
+              f"max |param - uninterrupted| after resume_from_checkpoint = {r['resume_diff']:.2e}")
+    return ok and resume_ok and trainer_ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "_trainer":
+        _trainer_worker(sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]))
+    else:
+        sys.exit(0 if verify(sys.argv[1] if len(sys.argv) > 1 else "models/Qwen/Qwen3-1.7B") else 1)
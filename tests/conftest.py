@@ -0,0 +1,8 @@
+# tests/conftest.py
+"""scripts/ 下是扁平脚本模块（各脚本自己把 script_dir 加入 sys.path），测试同样从这里导入"""
+import os
+import sys
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+if SCRIPTS not in sys.path:
+    sys.path.insert(0, SCRIPTS)
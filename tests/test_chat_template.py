@@ -0,0 +1,92 @@
+# tests/test_chat_template.py
+import re
+
+from chat_template import ChatTemplateEncoder, chat_encoder
+
+ADDED = {"<|im_start|>": 1, "<|im_end|>": 2, "<think>": 3, "</think>": 4}
+
+
+class FakeTokenizer:
+    """Qwen 风格模板 + 逐字符分词（added token 整体成一个 id）；bos 非空时整串分词前加 BOS"""
+
+    def __init__(self, bos=None):
+        self.bos = bos
+        self.calls = 0
+
+    def get_added_vocab(self):
+        return dict(ADDED)
+
+    def __call__(self, text, add_special_tokens=True):
+        if isinstance(text, list):
+            self.calls += 1
+            return {"input_ids": [self._ids(t, add_special_tokens) for t in text]}
+        self.calls += 1
+        return {"input_ids": self._ids(text, add_special_tokens)}
+
+    def _ids(self, text, add_special_tokens):
+        ids = [] if self.bos is None or not add_special_tokens else [self.bos]
+        for part in re.split("(" + "|".join(map(re.escape, ADDED)) + ")", text):
+            ids += [ADDED[part]] if part in ADDED else [1000 + ord(c) for c in part]
+        return ids
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        text = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        return text + ("<|im_start|>assistant\n" if add_generation_prompt else "")
+
+
+def _jinja_ids(tokenizer, messages, add_generation_prompt=True):
+    return tokenizer(tokenizer.apply_chat_template(messages, add_generation_prompt=add_generation_prompt))["input_ids"]
+
+
+def _conv(question, system="你是医学专家"):
+    return [{"role": "system", "content": system}, {"role": "user", "content": question}]
+
+
+def test_compiled_ids_match_jinja_and_plan_is_reused():
+    tok = FakeTokenizer()
+    encoder = ChatTemplateEncoder(tok)
+    for q in ("感冒了怎么办？", "发热39.5℃\n如何处理", "头痛"):
+        assert encoder.encode(_conv(q)) == _jinja_ids(tok, _conv(q))
+    history = _conv("第一问") + [{"role": "assistant", "content": "回答"}, {"role": "user", "content": "第二问"}]
+    assert encoder.encode(history, add_generation_prompt=False) == _jinja_ids(tok, history, False)
+    assert encoder.stats == {"compiled": 2, "fast": 4, "fallback": 0}
+
+
+def test_content_cache_skips_repeated_system_prompt():
+    tok = FakeTokenizer()
+    encoder = ChatTemplateEncoder(tok)
+    encoder.encode(_conv("问题一"))
+    before = tok.calls
+    encoder.encode(_conv("问题二"))
+    assert tok.calls == before + 1  # 只对新的用户问题分词
+
+
+def test_unsafe_content_falls_back_to_jinja():
+    tok = FakeTokenizer()
+    encoder = ChatTemplateEncoder(tok)
+    for conv in (_conv(" 首尾有空白 "), _conv("含<think>标签</think>"),
+                 _conv("问题") + [{"role": "assistant", "content": "答", "name": "x"}]):
+        assert encoder.encode(conv, add_generation_prompt=False) == _jinja_ids(tok, conv, False)
+    assert encoder.stats["fallback"] == 3 and encoder.stats["fast"] == 0
+
+
+def test_tokenizer_with_bos_never_compiles():
+    tok = FakeTokenizer(bos=0)
+    encoder = ChatTemplateEncoder(tok)
+    assert encoder.encode(_conv("问题")) == _jinja_ids(tok, _conv("问题"))
+    assert encoder.stats == {"compiled": 0, "fast": 0, "fallback": 1}
+
+
+def test_batched_lengths_match_encode():
+    tok = FakeTokenizer()
+    convs = [_conv("感冒了怎么办？"), _conv("头痛"), _conv(" 有空白 "), _conv("含<think>标签"), _conv("头痛")]
+    encoder = ChatTemplateEncoder(tok)
+    assert encoder.lengths(convs, batch_size=2) == [len(_jinja_ids(tok, c)) for c in convs]
+    # 首尾空白与含 added token 的两条走回退
+    assert encoder.stats["fast"] == 3 and encoder.stats["fallback"] == 2
+
+
+def test_chat_encoder_is_shared_per_tokenizer():
+    tok = FakeTokenizer()
+    assert chat_encoder(tok) is chat_encoder(tok)
+    assert chat_encoder(FakeTokenizer()) is not chat_encoder(tok)
@@ -0,0 +1,60 @@
+# tests/test_curriculum.py
+import numpy as np
+
+from curriculum import CurriculumSampler, SumTree
+
+
+def _tree(weights):
+    tree = SumTree(len(weights))
+    tree.fill(np.asarray(weights, dtype=np.float64))
+    return tree
+
+
+def test_capacity_rounds_up_and_totals():
+    tree = _tree([1.0, 2.0, 3.0, 4.0, 5.0])
+    assert tree.capacity == 8 and tree.size == 5
+    assert tree.total == 15.0
+    assert [tree.get(i) for i in range(5)] == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_find_uses_prefix_sums():
+    tree = _tree([1.0, 0.0, 2.0, 3.0])
+    # 前缀区间：[0,1) -> 0，[1,3) -> 2，[3,6) -> 3；权重为 0 的叶子不会被选中
+    assert [tree.find(u) for u in (0.0, 0.999, 1.0, 2.5, 3.0, 5.999)] == [0, 0, 2, 2, 3, 3]
+    assert tree.find(tree.total + 10) == 3  # 浮点误差越界时落在最后一个有效叶子
+
+
+def test_update_matches_fill():
+    rng = np.random.default_rng(0)
+    weights = rng.random(13)
+    incremental = _tree(np.zeros(13))
+    for i, w in enumerate(weights):
+        incremental.update(i, w)
+    incremental.update(4, 7.0)
+    weights[4] = 7.0
+    np.testing.assert_allclose(incremental.tree, _tree(weights).tree)
+
+
+def test_sample_frequencies_follow_weights():
+    weights = np.array([1.0, 0.0, 3.0, 6.0])
+    tree = _tree(weights)
+    rng = np.random.default_rng(1)
+    counts = np.bincount([i for _ in range(2000) for i in tree.sample(5, rng)], minlength=4)
+    assert counts[1] == 0
+    np.testing.assert_allclose(counts / counts.sum(), weights / weights.sum(), atol=0.02)
+
+
+def test_sampler_returns_distinct_indices_and_restores_state():
+    levels = ["high", "medium", "low"] * 4
+    sampler = CurriculumSampler(levels, uniform_mix=0.25, seed=3)
+    for _ in range(5):
+        batch = sampler.sample(6)
+        assert len(batch) == len(set(batch)) == 6
+        sampler.update(batch, [-2.0 if levels[i] == "high" else 1.5 for i in batch])
+    # 同一次也可能请求超过提示数的 batch
+    assert sorted(sampler.sample(100)) == list(range(len(levels)))
+
+    restored = CurriculumSampler(levels, uniform_mix=0.25, seed=99)
+    restored.load_state_dict(sampler.state_dict())
+    np.testing.assert_allclose(restored.tree.tree, sampler.tree.tree, rtol=1e-6)
+    assert restored.sample(4) == sampler.sample(4)
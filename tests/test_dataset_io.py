@@ -0,0 +1,41 @@
+# tests/test_dataset_io.py
+import json
+
+import pytest
+
+from dataset_io import convert_jsonl, select_records, write_jsonl
+
+RECORDS = [
+    {"instruction": "医学问答", "input": f"问题{i}", "output": f"<think>想</think>回答{i}",
+     "meta": {"risk_level": "high" if i % 2 else "low", "source": "test"}}
+    for i in range(5)
+]
+
+
+def _write(path, records, blank_lines=False):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            if blank_lines:
+                f.write("\n")
+
+
+def test_select_records_keeps_full_jsonl_records(tmp_path):
+    src = tmp_path / "train.jsonl"
+    _write(src, [{**r, "id": i} for i, r in enumerate(RECORDS)], blank_lines=True)
+    picked = list(select_records(str(src), [3, 1]))
+    assert [r["id"] for r in picked] == [1, 3]
+    assert picked[0]["instruction"] == "医学问答" and picked[0]["meta"] == {"risk_level": "high", "source": "test"}
+    assert list(select_records(str(src), [])) == []
+
+
+def test_select_records_from_parquet_round_trips(tmp_path):
+    pytest.importorskip("pyarrow")
+    src = tmp_path / "train.jsonl"
+    _write(src, RECORDS)
+    pq_path = convert_jsonl(str(src))
+    out = tmp_path / "train_long.jsonl"
+    assert write_jsonl(str(out), select_records(pq_path, [0, 4])) == 2
+    with open(out, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == [RECORDS[0], RECORDS[4]]
+    assert not (tmp_path / "train_long.jsonl.tmp").exists()
@@ -0,0 +1,49 @@
+# tests/test_ddp_sft.py
+from ddp_sft import ShardBatchSampler, shard_indices
+
+
+def test_shards_are_disjoint_equal_length_and_deterministic():
+    shards = shard_indices(103, 4, seed=7)
+    assert [len(s) for s in shards] == [25] * 4
+    flat = [i for s in shards for i in s]
+    assert len(flat) == len(set(flat)) and set(flat) <= set(range(103))
+    assert shard_indices(103, 4, seed=7) == shards
+    assert shard_indices(103, 4, seed=8) != shards
+
+
+def test_single_rank_keeps_every_row():
+    assert sorted(shard_indices(10, 1)[0]) == list(range(10))
+
+
+def test_global_batch_matches_single_process_order():
+    # 第 t 步各 rank 的本地批次（映射回原数据行号）合起来 = 单进程（world=1）以 per_rank × world 为批大小的第 t 个批次
+    n, world, per_rank = 64, 2, 3
+    shards = shard_indices(n, world, seed=1)
+    single = shard_indices(n, 1, seed=1)[0]
+    samplers = [ShardBatchSampler(len(s), per_rank, seed=0) for s in shards]
+    reference = ShardBatchSampler(len(single), per_rank * world, seed=0)
+    assert len({len(s) for s in samplers} | {len(reference)}) == 1
+    for epoch in range(2):
+        for s in samplers + [reference]:
+            s.set_epoch(epoch)
+        steps = list(zip(*[list(iter(s)) for s in samplers]))
+        expected = list(iter(reference))
+        assert len(steps) == len(expected) == len(shards[0]) // per_rank
+        for local_batches, batch in zip(steps, expected):
+            rows = [shards[r][i] for r, b in enumerate(local_batches) for i in b]
+            assert len(rows) == len(set(rows))
+            assert sorted(rows) == sorted(single[i] for i in batch)
+
+
+def test_batch_sampler_lengths_and_epoch_shuffle():
+    sampler = ShardBatchSampler(10, 3, seed=5)
+    assert len(sampler) == 3
+    first = list(iter(sampler))
+    assert sorted(i for b in first for i in b) == list(range(9))
+    assert list(iter(sampler)) == first
+    sampler.set_epoch(1)
+    assert sorted(map(tuple, iter(sampler))) == sorted(map(tuple, first))
+
+    tail = ShardBatchSampler(10, 3, drop_last=False)
+    assert len(tail) == 4
+    assert sorted(i for b in tail for i in b) == list(range(10))
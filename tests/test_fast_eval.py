@@ -0,0 +1,49 @@
+# tests/test_fast_eval.py
+import math
+from collections import Counter
+
+import pytest
+
+from fast_eval import assign_strata, length_buckets, stratified_estimate, stratified_subset
+
+
+def test_subset_is_proportional_deterministic_and_covers_small_strata():
+    strata = ["a"] * 60 + ["b"] * 30 + ["c"] * 9 + ["d"]
+    subset = stratified_subset(strata, 20, seed=3)
+    assert subset == sorted(set(subset)) and subset == stratified_subset(strata, 20, seed=3)
+    counts = Counter(strata[i] for i in subset)
+    # 最大余数法：a/b/c 按比例 12/6/2（c 的 1.8 进位），只有 1 条的 d 全取
+    assert counts == {"a": 12, "b": 6, "c": 2, "d": 1}
+    assert stratified_subset(strata, 20, seed=4) != subset
+
+
+def test_subset_keeps_everything_when_size_exceeds_population():
+    assert stratified_subset(["x", "y", "x"], 10) == [0, 1, 2]
+
+
+def test_estimate_matches_full_mean_when_every_row_is_sampled():
+    strata = ["a", "a", "b", "b", "b"]
+    losses = {0: 1.0, 1: 3.0, 2: 2.0, 3: 4.0, 4: 6.0}
+    est = stratified_estimate(losses, strata)
+    assert est["loss"] == pytest.approx(sum(losses.values()) / 5)
+    # 有限总体校正：整层都被抽到时方差为 0
+    assert est["ci95"] == 0.0
+    assert (est["n"], est["strata"]) == (5, 2)
+
+
+def test_estimate_weights_strata_by_population_and_reports_interval():
+    strata = ["a"] * 8 + ["b"] * 2
+    losses = {0: 1.0, 1: 3.0, 8: 10.0}
+    est = stratified_estimate(losses, strata)
+    assert est["loss"] == pytest.approx(0.8 * 2.0 + 0.2 * 10.0)
+    # 只有 a 层贡献方差：w² · s² / n · (1 - n/N) = 0.64 · 2 / 2 · 0.75
+    assert est["ci95"] == pytest.approx(1.96 * math.sqrt(0.64 * 2 / 2 * 0.75))
+
+
+def test_assign_strata_and_length_buckets():
+    strata = assign_strata([10, 20, 30, 40], ["high", None, "high", "low"], bins=2)
+    assert strata == ["high|L0", "unknown|L0", "high|L1", "low|L1"]
+    lengths = [5, 50, 20, 40, 10]
+    batches = length_buckets(range(5), lengths, max_tokens=100)
+    assert batches == [[1, 3], [2, 4, 0]]
+    assert all(len(b) * max(lengths[i] for i in b) <= 100 for b in batches)
@@ -0,0 +1,79 @@
+# tests/test_response_cache.py
+import pytest
+
+pytest.importorskip("numpy")
+from response_cache import ResponseCache, complete_response, normalize  # noqa: E402
+
+ANSWER = "<think>先判断是否需要就医</think>多休息，多喝水。"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_exact_and_semantic_hits_after_normalization():
+    cache = ResponseCache(capacity=4, dim=256, threshold=0.8)
+    assert cache.put("感冒了怎么办？", ANSWER)
+    hit = cache.get(" 感冒了怎么办? ")
+    assert (hit.kind, hit.response) == ("exact", ANSWER)
+    hit = cache.get("请问感冒了怎么办")
+    assert hit is not None and hit.kind == "semantic" and hit.matched == "感冒了怎么办？"
+    assert cache.get("胃痛吃什么药") is None
+    assert (cache.stats["exact_hits"], cache.stats["semantic_hits"], cache.stats["misses"]) == (1, 1, 1)
+
+
+def test_numbers_must_match_for_semantic_hit():
+    cache = ResponseCache(capacity=4, dim=256, threshold=0.5)
+    cache.put("两岁小孩发热39.5℃该如何处理？", ANSWER)
+    assert normalize("发热 39.5℃") == "发热39.5°c"  # NFKC 展开 ℃，数字间的小数点保留
+    assert cache.get("两岁小孩发热38℃该如何处理？") is None
+    assert cache.get("两岁小孩发热39.5℃怎么处理？") is not None
+
+
+def test_ttl_expiry():
+    clock = Clock()
+    cache = ResponseCache(capacity=4, dim=256, ttl=10, clock=clock)
+    cache.put("头痛怎么办", ANSWER)
+    clock.now += 9
+    assert cache.get("头痛怎么办") is not None
+    clock.now += 2
+    assert cache.get("头痛怎么办") is None
+    assert cache.stats["expired"] == 1 and len(cache) == 0
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ResponseCache(capacity=2, dim=256, threshold=0.99)
+    cache.put("问题甲", ANSWER)
+    cache.put("问题乙", ANSWER)
+    assert cache.get("问题甲") is not None  # 甲变为最近使用
+    cache.put("问题丙", ANSWER)
+    assert cache.stats["evicted"] == 1
+    assert cache.get("问题乙") is None
+    assert cache.get("问题甲") is not None and cache.get("问题丙") is not None
+
+
+def test_validator_rejects_on_put_and_on_hit():
+    blocked = {"孕妇"}
+    cache = ResponseCache(capacity=4, dim=256, threshold=0.5,
+                          validator=lambda q, r: not any(w in q for w in blocked))
+    assert not cache.put("孕妇感冒了怎么办", ANSWER)
+    assert cache.put("感冒了怎么办", ANSWER)
+    # 近似命中的缓存回答对当前问题违规：不提供并移出缓存
+    assert cache.get("孕妇感冒了怎么办") is None
+    assert cache.stats["rejected"] == 1 and len(cache) == 0
+
+
+def test_truncated_response_is_not_stored():
+    cache = ResponseCache(capacity=4, dim=256)
+    # 被 max_new_tokens 截断（没有以 EOS 结束）
+    assert not cache.put("感冒了怎么办", ANSWER, ended_on_eos=False)
+    # 思考段未闭合 / 闭合后没有回答 / 没有思考段
+    for text in ("<think>先判断是否需要", "<think>先判断是否需要就医</think>  ", "多休息，多喝水。"):
+        assert not complete_response(text)
+        assert not cache.put("感冒了怎么办", text)
+    assert len(cache) == 0 and cache.stats["not_stored"] == 4
+    assert cache.get("感冒了怎么办") is None
@@ -0,0 +1,73 @@
+# tests/test_think_spans.py
+import pyarrow as pa
+import pytest
+
+import think_spans
+from think_spans import has_think, parse_spans, span_stats, split_think_answer
+
+TEXTS = [
+    "<think>先想一想</think> \n 建议多喝水。",
+    "没有思考段的回答",
+    "<think>未闭合的思考",
+    "前缀<think>é🙂中文</think>答案🙂",
+    "</think>前<think>后</think>答",
+    "",
+    "<think></think>",
+]
+
+
+def _row_slices(text, row):
+    think = text[row["think_char_start"]:row["think_char_start"] + row["think_chars"]]
+    answer = text[row["answer_char_start"]:row["answer_char_start"] + row["answer_chars"]]
+    return think, answer
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_char_offsets_match_single_text_parser(text):
+    row = parse_spans([text]).to_pylist()[0]
+    assert row["has_think"] == has_think(text)
+    assert row["total_chars"] == len(text)
+    think, answer = _row_slices(text, row)
+    assert (think.strip(), answer.strip()) == split_think_answer(text)
+
+
+def test_byte_offsets_on_multibyte_text():
+    text = "前缀<think>é🙂中文</think>答案🙂"
+    row = parse_spans([text]).to_pylist()[0]
+    raw = text.encode("utf-8")
+    assert raw[row["think_byte_start"]:row["think_byte_end"]].decode() == "é🙂中文"
+    assert raw[row["answer_byte_start"]:row["answer_byte_end"]].decode() == "答案🙂"
+
+
+def test_close_tag_before_open_tag():
+    # 取第一个 <think> 之后的第一个 </think>，与原先各脚本的正则一致
+    assert split_think_answer("</think>前<think>后</think>答") == ("后", "答")
+    row = parse_spans(["</think>前<think>后</think>答"]).to_pylist()[0]
+    assert row["has_think"] and not row["unclosed_think"]
+    assert split_think_answer("</think>只有<think>开头") == ("", "</think>只有<think>开头")
+    assert parse_spans(["</think>只有<think>开头"]).to_pylist()[0]["unclosed_think"]
+
+
+def test_chunk_boundaries_and_chunked_arrays(monkeypatch):
+    monkeypatch.setattr(think_spans, "CHUNK_ROWS", 3)
+    texts = TEXTS * 3
+    chunked = pa.chunked_array([pa.array(texts[:5]), pa.array(texts[5:])])
+    for source in (texts, chunked, pa.array(texts)):
+        rows = parse_spans(source).to_pylist()
+        assert len(rows) == len(texts)
+        for text, row in zip(texts, rows):
+            think, answer = _row_slices(text, row)
+            assert (think.strip(), answer.strip()) == split_think_answer(text)
+
+
+def test_nulls_are_empty_answers():
+    rows = parse_spans(pa.array(["<think>a</think>b", None])).to_pylist()
+    assert rows[1]["total_chars"] == 0 and not rows[1]["has_think"]
+
+
+def test_span_stats_counts():
+    stats = span_stats(parse_spans(TEXTS))
+    assert stats["rows"] == len(TEXTS)
+    assert stats["unclosed_think"] == 1
+    assert stats["think_coverage"] == round(sum(map(has_think, TEXTS)) / len(TEXTS), 4)
+    assert stats["empty_answer"] == 2